@@ -0,0 +1,77 @@
+"""
+Time of the BLEU-1 overlap filter of `_selection_with_rl`, the former per pair
+nlgeval scoring against `Bleu1Matrix`, on the options of the test fixture
+
+    python -m benchmarks.bench_bleu --options 30 --gen-quantity 3
+
+The former path is timed with the pycocoevalcap Bleu and Rouge scorers, which
+is what `NLGEval.compute_individual_metrics` runs with the metrics the
+distractor model omits
+"""
+import argparse
+import itertools as it
+import time
+from pathlib import Path
+
+import numpy as np
+from nlp2 import split_lines_by_punc
+from pycocoevalcap.bleu.bleu import Bleu
+from pycocoevalcap.rouge.rouge import Rouge
+
+from distractor_generation.bleu import Bleu1Matrix
+
+FIXTURE = Path(__file__).parent.parent / "tests" / "fixtures" / "options.txt"
+
+
+def per_pair(all_options, answer, gen_quantity, max_combinations):
+    bleu, rouge = Bleu(4), Rouge()
+    kept = []
+    for combin in it.islice(
+        it.combinations(all_options, gen_quantity), max_combinations
+    ):
+        keep = True
+        for a, b in it.combinations(list(combin) + [answer], 2):
+            a = " ".join(split_lines_by_punc([a]))
+            b = " ".join(split_lines_by_punc([b]))
+            scores, _ = bleu.compute_score({0: [a]}, {0: [b]}, verbose=0)
+            rouge.compute_score({0: [a]}, {0: [b]})
+            if scores[0] > 0.60:
+                keep = False
+                break
+        if keep:
+            kept.append(combin)
+    return kept
+
+
+def matrix(all_options, answer, gen_quantity, max_combinations):
+    bleu_1 = Bleu1Matrix(all_options + [answer])
+    option_indexes = [bleu_1.index[option] for option in all_options]
+    compatible = bleu_1.matrix[np.ix_(option_indexes, option_indexes)] <= 0.60
+    with_answer = bleu_1.matrix[option_indexes, bleu_1.index[answer]] <= 0.60
+    kept = []
+    for combin in it.islice(
+        it.combinations(range(len(all_options)), gen_quantity), max_combinations
+    ):
+        if with_answer[list(combin)].all() and all(
+            compatible[i, j] for i, j in it.combinations(combin, 2)
+        ):
+            kept.append(tuple(all_options[i] for i in combin))
+    return kept
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--options", type=int, default=30)
+    parser.add_argument("--gen-quantity", type=int, default=3)
+    parser.add_argument("--max-combinations", type=int, default=500)
+    args = parser.parse_args()
+
+    options = FIXTURE.read_text().splitlines()
+    answer, all_options = options[0], options[1 : args.options + 1]
+    for name, func in [("per pair nlgeval", per_pair), ("Bleu1Matrix", matrix)]:
+        start = time.perf_counter()
+        kept = func(all_options, answer, args.gen_quantity, args.max_combinations)
+        print(
+            f"{name}: {(time.perf_counter() - start) * 1000:.1f} ms, "
+            f"{len(kept)} of {args.max_combinations} combinations kept"
+        )
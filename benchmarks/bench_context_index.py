@@ -0,0 +1,69 @@
+"""
+Time of the keyword coverage of many questions on a long article, the former
+scan of every article sentence per question against `ContextIndex`, the
+article is made of the fixture sentences repeated up to `--words` words
+
+    python -m benchmarks.bench_context_index --words 1000 5000 20000 --questions 200
+"""
+import argparse
+import re
+import time
+from pathlib import Path
+
+from question_group_generation.scorer import ContextIndex, CoverageScorer
+
+FIXTURES = Path(__file__).parent.parent / "tests" / "fixtures"
+
+
+def sentence_scan(keyword_lists, article):
+    scores = []
+    for keyword_list in keyword_lists:
+        article_sent_list = re.split(r",|\.|\!|\?", article)
+        count_coverage = 0
+        for article_sent in article_sent_list:
+            article_sent = article_sent.lower().split()
+            for keyword in keyword_list:
+                if keyword in article_sent:
+                    count_coverage += 1
+                    break
+        scores.append(count_coverage / len(article_sent_list))
+    return scores
+
+
+def context_index(keyword_lists, article):
+    index = ContextIndex(article)
+    return [index.coverage(keyword_list) for keyword_list in keyword_lists]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--words", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--questions", type=int, default=200)
+    args = parser.parse_args()
+
+    sentences = (FIXTURES / "sentences.txt").read_text().splitlines()
+    questions = (FIXTURES / "questions.txt").read_text().splitlines()
+    scorer = CoverageScorer(preprocess=False)
+    keyword_lists = [
+        scorer._extract_keywords([questions[i % len(questions)]])
+        for i in range(args.questions)
+    ]
+
+    print("| words | sentence scan ms | ContextIndex ms | same scores |")
+    print("| --- | --- | --- | --- |")
+    for num_words in args.words:
+        words = []
+        while len(words) < num_words:
+            words += " ".join(sentences).split()
+        article = " ".join(words[:num_words])
+
+        timings, results = [], []
+        for func in [sentence_scan, context_index]:
+            func(keyword_lists[:1], article)  # warm up
+            start = time.perf_counter()
+            results.append(func(keyword_lists, article))
+            timings.append((time.perf_counter() - start) * 1000)
+        print(
+            f"| {num_words} | {timings[0]:.1f} | {timings[1]:.1f} "
+            f"| {results[0] == results[1]} |"
+        )
@@ -0,0 +1,139 @@
+"""
+DOCX export of 10, 100 and 1000 question pairs, built on a thread of the
+server process (the former streaming path) against `DocxRenderer`, with the
+event loop lag a 1 ms ticker sees meanwhile, and what importing the render
+function costs a spawned worker
+
+    python -m benchmarks.bench_docx_export --pairs 10 100 1000 --concurrency 2
+"""
+import argparse
+import asyncio
+import io
+import subprocess
+import sys
+import time
+
+import docx
+import numpy as np
+
+from data.model import ExportSet
+from docx_render import build_docx
+
+
+def question_sets(num_pairs, pairs_per_set=10):
+    return [
+        ExportSet.parse_obj(
+            {
+                "context": "Harry Potter is a series of seven fantasy novels. " * 20,
+                "question_pairs": [
+                    {
+                        "question": f"Question {start + i} about the novels?",
+                        "options": [
+                            {"text": f"option {j}", "is_answer": j == 0}
+                            for j in range(4)
+                        ],
+                    }
+                    for i in range(min(pairs_per_set, num_pairs - start))
+                ],
+            }
+        )
+        for start in range(0, num_pairs, pairs_per_set)
+    ]
+
+
+def render_on_thread(sets):
+    buffer = io.BytesIO()
+    build_docx(sets).save(buffer)
+    return buffer.getvalue()
+
+
+# run in a fresh interpreter, as a spawned render worker would
+IMPORT_COST = """
+import re, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+with open("/proc/self/status") as f:
+    rss_kb = int(re.search(r"VmRSS:\\s+(\\d+)", f.read()).group(1))
+print(f"{{elapsed:.2f}} | {{rss_kb // 1024}} | {{'torch' in sys.modules}}")
+"""
+
+
+def import_cost(module):
+    """Seconds, RSS and whether torch is loaded, of a process importing `module`"""
+    return subprocess.run(
+        [sys.executable, "-c", IMPORT_COST.format(module=module)],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.strip()
+
+
+async def measure(export, concurrency):
+    """
+    Seconds `concurrency` concurrent exports take, and the delays of a 1 ms
+    ticker meanwhile
+    """
+    lags = []
+    task = asyncio.ensure_future(
+        asyncio.gather(*[export() for _ in range(concurrency)])
+    )
+
+    async def tick():
+        while not task.done():
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(time.perf_counter() - start - 0.001)
+
+    start = time.perf_counter()
+    contents, _ = await asyncio.gather(task, tick())
+    elapsed = time.perf_counter() - start
+    for content in contents:
+        assert len(docx.Document(io.BytesIO(content)).paragraphs) > 0
+    return elapsed, lags
+
+
+async def main(args):
+    # not at the top, spawned render workers import this module too
+    from utils.export import DocxRenderer
+
+    loop = asyncio.get_event_loop()
+    renderer = DocxRenderer(max_concurrency=args.workers, queue_timeout=60)
+
+    print("| render worker imports | s | RSS MB | torch loaded |")
+    print("| --- | --- | --- | --- |")
+    for module in ["docx_render", "utils.export"]:
+        print(f"| {module} | {import_cost(module)} |")
+    start = time.perf_counter()
+    await renderer.render(question_sets(1))
+    print(f"\nDocxRenderer cold start: {time.perf_counter() - start:.2f}s\n")
+
+    print(f"{args.concurrency} concurrent exports\n")
+    print("| pairs | path | ms | max loop lag ms | p50 loop lag ms |")
+    print("| --- | --- | --- | --- | --- |")
+    for num_pairs in args.pairs:
+        sets = question_sets(num_pairs)
+        paths = [
+            ("thread", lambda: loop.run_in_executor(None, render_on_thread, sets)),
+            ("DocxRenderer", lambda: renderer.render(sets)),
+        ]
+        for name, export in paths:
+            elapsed, lags = [], []
+            for _ in range(args.repeat):
+                export_elapsed, export_lags = await measure(export, args.concurrency)
+                elapsed.append(export_elapsed)
+                lags += export_lags
+            print(
+                f"| {num_pairs} | {name} | {np.mean(elapsed) * 1000:.1f} "
+                f"| {max(lags) * 1000:.1f} | {np.median(lags) * 1000:.2f} |"
+            )
+    renderer.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pairs", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
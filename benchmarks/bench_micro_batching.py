@@ -0,0 +1,95 @@
+"""
+Throughput and latency of micro-batched `generate` against one `generate`
+per request, with the generation settings of English QG, on a small randomly
+initialised BART (no download needed)
+
+    python -m benchmarks.bench_micro_batching --clients 8 --requests 64
+"""
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from loguru import logger
+from transformers import BartConfig, BartForConditionalGeneration
+
+from question_generation.en_us import GENERATION_KWARGS
+from utils.batching import MicroBatcher
+
+
+def build_model(vocab_size=1000):
+    torch.manual_seed(0)
+    config = BartConfig(
+        vocab_size=vocab_size,
+        d_model=128,
+        encoder_layers=2,
+        decoder_layers=2,
+        encoder_attention_heads=4,
+        decoder_attention_heads=4,
+        encoder_ffn_dim=256,
+        decoder_ffn_dim=256,
+        max_position_embeddings=512,
+    )
+    return BartForConditionalGeneration(config).eval()
+
+
+def make_requests(num_requests, vocab_size=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    return [
+        [0] + rng.integers(4, vocab_size, size=rng.integers(64, 256)).tolist() + [2]
+        for _ in range(num_requests)
+    ]
+
+
+def run(model, requests, clients):
+    """Send `requests` from `clients` concurrent threads, like the inference pool does"""
+
+    def call(input_ids):
+        start = time.perf_counter()
+        with torch.no_grad():
+            model.generate(input_ids=torch.LongTensor([input_ids]), **GENERATION_KWARGS)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        latencies = list(pool.map(call, requests))
+    elapsed = time.perf_counter() - start
+    return {
+        "throughput": len(requests) / elapsed,
+        "p50_ms": np.percentile(latencies, 50) * 1000,
+        "p95_ms": np.percentile(latencies, 95) * 1000,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--max-wait-ms", type=int, nargs="+", default=[5, 10, 20])
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="INFO")
+
+    model = build_model()
+    requests = make_requests(args.requests)
+    run(model, requests[:2], 1)  # warm up
+
+    print("| mode | max batch | max wait ms | req/s | p50 ms | p95 ms |")
+    print("|---|---|---|---|---|---|")
+    row = run(model, requests, args.clients)
+    print(
+        f"| one at a time | 1 | - | {row['throughput']:.2f} "
+        f"| {row['p50_ms']:.0f} | {row['p95_ms']:.0f} |"
+    )
+    for batch_size in args.batch_sizes:
+        for max_wait_ms in args.max_wait_ms:
+            batcher = MicroBatcher(model, batch_size, max_wait_ms)
+            row = run(batcher, requests, args.clients)
+            batcher.close()
+            print(
+                f"| micro-batched | {batch_size} | {max_wait_ms} "
+                f"| {row['throughput']:.2f} | {row['p50_ms']:.0f} | {row['p95_ms']:.0f} |"
+            )
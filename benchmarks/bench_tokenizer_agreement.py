@@ -0,0 +1,52 @@
+"""
+Agreement of the regex scorer tokenizer with stanza, and the time of each, on
+the sentences of the test fixture, needs the stanza English models
+
+    python -m benchmarks.bench_tokenizer_agreement --show 20
+
+Sentences the two tokenizers split differently are printed with both token
+lists, to check whether the differences matter to the scorers
+"""
+import argparse
+import time
+from pathlib import Path
+
+from question_group_generation import preprocess
+
+FIXTURE = Path(__file__).parent.parent / "tests" / "fixtures" / "sentences.txt"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file", default=str(FIXTURE))
+    parser.add_argument("--show", type=int, default=10)
+    args = parser.parse_args()
+
+    sentences = [
+        line for line in Path(args.file).read_text().splitlines() if line.strip()
+    ]
+    # load the pipeline before timing it
+    preprocess.resources.get_tokenize_pipeline()
+
+    tokens = {}
+    print("| tokenizer | ms / sentence |")
+    print("| --- | --- |")
+    for tokenizer in ["stanza", "regex"]:
+        start = time.perf_counter()
+        tokens[tokenizer] = preprocess.tokenize_batch(sentences, tokenizer=tokenizer)
+        elapsed = time.perf_counter() - start
+        print(f"| {tokenizer} | {elapsed * 1000 / len(sentences):.3f} |")
+
+    agreement = preprocess.agreement(sentences)
+    print()
+    print(f"{len(sentences)} sentences")
+    print(f"sentence agreement: {agreement['sentences']:.1%}")
+    print(f"token agreement: {agreement['tokens']:.1%}")
+
+    shown = 0
+    for sentence, expected, actual in zip(sentences, tokens["stanza"], tokens["regex"]):
+        if expected != actual and shown < args.show:
+            shown += 1
+            print()
+            print(sentence)
+            print(f"  stanza: {expected}")
+            print(f"  regex:  {actual}")
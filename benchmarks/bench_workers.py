@@ -0,0 +1,128 @@
+"""
+RSS and throughput of the server with 1 vs N gunicorn workers (Linux only)
+
+    python -m benchmarks.bench_workers --workers 1 4 --requests 200
+
+Starts `gunicorn -c gunicorn.conf.py server:app` for each worker count, sends
+the example request of `--route` from `--clients` threads, and reports
+requests per second with RSS and PSS (shared pages split between the
+processes sharing them) of the master and of every worker
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+
+
+def memory_kb(pid):
+    """`(rss, pss)` of process `pid`, in KB"""
+    with open(f"/proc/{pid}/status") as f:
+        rss = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        pss = next(int(line.split()[1]) for line in f if line.startswith("Pss:"))
+    return rss, pss
+
+
+def children(pid):
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(child) for child in f.read().split()]
+
+
+def route_request(route, port):
+    """URL and body of the example request of `route`, e.g. `generate-question/en-US`"""
+    with open(ROOT / "data" / "examples.json") as f:
+        payload = next(iter(json.load(f)[route].values()))["value"]
+    task, _, language = route.partition("/")
+    path = f"/{language}/{task}" if language else f"/{task}"
+    url = f"http://127.0.0.1:{port}{path}?use_cache=false"
+    return url, json.dumps(payload).encode("utf-8")
+
+
+def post(url, body):
+    request = urllib.request.Request(
+        url, data=body, headers={"Content-Type": "application/json"}
+    )
+    start = time.perf_counter()
+    with urllib.request.urlopen(request) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def wait_ready(port, process, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("server exited")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/status/models")
+            return
+        except OSError:
+            time.sleep(1)
+    raise TimeoutError("server did not start")
+
+
+def measure(num_workers, args):
+    env = dict(os.environ, WEB_CONCURRENCY=str(num_workers), PORT=str(args.port))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", args.app],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_ready(args.port, process, args.startup_timeout)
+        url, body = route_request(args.route, args.port)
+        for _ in range(num_workers):
+            post(url, body)  # warm up
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.clients) as pool:
+            list(pool.map(lambda _: post(url, body), range(args.requests)))
+        throughput = args.requests / (time.perf_counter() - start)
+
+        master = memory_kb(process.pid)
+        workers = [memory_kb(pid) for pid in children(process.pid)]
+        return {
+            "workers": num_workers,
+            "throughput": throughput,
+            "master_rss_mb": master[0] / 1024,
+            "worker_rss_mb": max(rss for rss, _ in workers) / 1024,
+            "worker_pss_mb": max(pss for _, pss in workers) / 1024,
+            "total_pss_mb": (master[1] + sum(pss for _, pss in workers)) / 1024,
+        }
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--route", default="generate-question/en-US")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--app", default="server:app")
+    parser.add_argument("--startup-timeout", type=int, default=900)
+    args = parser.parse_args()
+
+    print(
+        "| workers | req/s | master RSS MB | worker RSS MB | worker PSS MB "
+        "| total PSS MB |"
+    )
+    print("|---|---|---|---|---|---|")
+    for num_workers in args.workers:
+        row = measure(num_workers, args)
+        print(
+            f"| {row['workers']} | {row['throughput']:.2f} "
+            f"| {row['master_rss_mb']:.0f} | {row['worker_rss_mb']:.0f} "
+            f"| {row['worker_pss_mb']:.0f} | {row['total_pss_mb']:.0f} |"
+        )
@@ -1,3 +1,5 @@
+import os
+
 max_length = 512
 max_question_length = 22
 hl_token = "[HL]"
@@ -6,3 +8,91 @@ CUDA_MODELS = [
     "p208p2002/gpt2-drcd-qg-hl",
     "p208p2002/qmst-qgg",
 ]
+
+
+def _env_mapping(name, default, value_type=int):
+    """Parse `key=value,key=value` style environment variable into a dict"""
+    raw = os.getenv(name, default)
+    mapping = {}
+    for pair in raw.split(","):
+        if pair.strip() == "":
+            continue
+        key, value = pair.split("=")
+        mapping[key.strip()] = value_type(value.strip())
+    return mapping
+
+
+def _env_flag(name, default="false"):
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
+
+
+# Models that put a micro-batching scheduler in front of `generate`, distractor
+# models already generate all options of a request in one batch
+MICRO_BATCHING_MODELS = [
+    "p208p2002/bart-squad-qg-hl",
+]
+# Max rows of a micro-batch, and how long a request waits for others to join it
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = int(os.getenv("BATCH_MAX_WAIT_MS", "10"))
+
+# Inference worker pools, how many requests each pool may run concurrently.
+# English QG requests wait in the micro-batcher rather than in the pool, its pool
+# needs a worker per row of a micro-batch for batches to fill up
+INFERENCE_POOLS = _env_mapping(
+    "INFERENCE_POOLS", f"qg_en={BATCH_MAX_SIZE},qg=2,dis=1,qgg=1,fm=1"
+)
+INFERENCE_POOLS.setdefault("qg_en", BATCH_MAX_SIZE)
+# Torch intra-op threads used by each pool's workers, pools not listed keep torch default
+INFERENCE_TORCH_THREADS = _env_mapping("INFERENCE_TORCH_THREADS", "")
+
+# Inference precision of models by alias, `fp32`, `int8` (dynamic quantization
+# of Linear layers, CPU only) or `bf16`, overrides the precision of `MODELS_SPECS`
+MODEL_PRECISIONS = _env_mapping("MODEL_PRECISIONS", "", str)
+
+# Load models on first use instead of at startup
+LAZY_MODEL_LOADING = _env_flag("LAZY_MODEL_LOADING")
+# Evict least recently used models once resident models exceed this size, 0 means unlimited
+MODEL_MEMORY_BUDGET_MB = int(os.getenv("MODEL_MEMORY_BUDGET_MB", "0"))
+
+# Directory of snapshots saved by `python language_model.py snapshot`, models
+# without a snapshot there load from their checkpoint
+MODEL_SNAPSHOT_DIR = os.getenv("MODEL_SNAPSHOT_DIR", "snapshots")
+
+# Torch threads of each distractor model generating in parallel, 0 splits torch
+# threads evenly between the models
+DG_TORCH_THREADS = int(os.getenv("DG_TORCH_THREADS", "0"))
+
+# Generation result cache, bytes kept in memory and seconds a result stays valid (0 means forever)
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 ** 2)))
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", "0"))
+# SQLite file keeping results across restarts, empty disables the on-disk store
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", "")
+RESULT_CACHE_DISK_MAX_BYTES = int(
+    os.getenv("RESULT_CACHE_DISK_MAX_BYTES", str(1024 ** 3))
+)
+
+# Tokenizer of the question group scorers, "stanza" or "regex" (no neural model,
+# see `python -m question_group_generation.preprocess` for its agreement with stanza).
+# Agreement on tests/fixtures/sentences.txt is not recorded yet, it needs the stanza
+# English models. What to check in its diff are the regex rules: ca|n't, clitics ('s 're
+# 've 'll 'd 'm), students|', U.S. and e-mail and 1,000 kept whole, Harry|’|s (curly
+# apostrophes and quotes are not clitics)
+SCORER_TOKENIZER = os.getenv("SCORER_TOKENIZER", "stanza")
+# Tokenized sentences kept in memory, shared by every scorer
+PREPROCESS_CACHE_SIZE = int(os.getenv("PREPROCESS_CACHE_SIZE", "4096"))
+
+# Rows of each sampling pass of question group generation, feedback iterations of
+# every context window are generated together in batches of this size
+QGG_BATCH_SIZE = int(os.getenv("QGG_BATCH_SIZE", "16"))
+
+# Job API: SQLite file shared by every worker process, jobs each process runs at
+# once, max jobs waiting per process, and seconds finished jobs are kept
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "jobs.sqlite3")
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "1"))
+JOB_QUEUE_MAX_SIZE = int(os.getenv("JOB_QUEUE_MAX_SIZE", "100"))
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", str(24 * 60 * 60)))
+
+# DOCX exports render on a process pool of this many workers, an export waiting
+# longer than the timeout (seconds) for a free worker is refused with 503
+DOCX_RENDER_WORKERS = int(os.getenv("DOCX_RENDER_WORKERS", "2"))
+DOCX_RENDER_QUEUE_TIMEOUT = float(os.getenv("DOCX_RENDER_QUEUE_TIMEOUT", "10"))
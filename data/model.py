@@ -26,6 +26,11 @@ class QGItem(BaseModel):
     answer: Answer
 
 
+class QGBatchItem(BaseModel):
+    article: str
+    answers: List[Answer]
+
+
 class DisItem(BaseModel):
     article: str
     answer: Answer
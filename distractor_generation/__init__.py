@@ -1,15 +1,17 @@
-import itertools as it
 import json
 import os
-from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 import torch
-from config import max_length
+from config import DG_TORCH_THREADS, max_length
 from loguru import logger
-from nlgeval import NLGEval
-from nlp2 import split_lines_by_punc
 from question_group_generation.optimizer import GAOptimizer
 from torch.distributions import Categorical
+from utils.batching import MicroBatcher, pad_sequences
+from utils.inference import set_torch_threads
+
+from .bleu import Bleu1Matrix
 
 
 def prepare_dis_model_ga_input_ids(article, question, answer, tokenizer):
@@ -82,6 +84,36 @@ def prepare_dis_model_input_ids(
     return torch.LongTensor([final_input_ids]), total_legnth
 
 
+def iter_cliques(adjacency, size, nodes, max_steps=10000):
+    """
+    Lazily yield `size`-cliques among `nodes` in lexicographic order, only
+    `adjacency[i][j]` with i < j is consulted, the search gives up after
+    `max_steps` expanded partial cliques
+    """
+    steps = 0
+
+    def extend(clique, candidates):
+        nonlocal steps
+        if len(clique) == size:
+            yield tuple(clique)
+            return
+        for k, node in enumerate(candidates):
+            # not enough candidates left to complete the clique
+            if len(candidates) - k < size - len(clique):
+                return
+            steps += 1
+            if steps == max_steps + 1:
+                logger.warning(f"Stop clique search after {max_steps} steps")
+            if steps > max_steps:
+                return
+            yield from extend(
+                clique + [node],
+                [other for other in candidates[k + 1 :] if adjacency[node][other]],
+            )
+
+    yield from extend([], list(nodes))
+
+
 class BartDistractorGeneration:
     def __init__(
         self,
@@ -89,60 +121,115 @@ class BartDistractorGeneration:
         dg_tokenizer,
         dg_selection_models,
         dg_selection_tokenizer,
-        pplscorer_model,
-        pplscorer_tokenizer,
     ):
-        self.nlgeval = NLGEval(
-            metrics_to_omit=[
-                "METEOR",
-                "EmbeddingAverageCosineSimilairty",
-                "SkipThoughtCS",
-                "VectorExtremaCosineSimilarity",
-                "GreedyMatchingScore",
-                "CIDEr",
-            ]
-        )
-
         self.dg_models = dg_models
         self.dg_tokenizers = dg_tokenizer
 
         self.model = dg_selection_models
         self.model.eval()
         self.tokenizer = dg_selection_tokenizer
-        self.pplscorer_model = pplscorer_model
-        self.pplscorer_tokenizer = pplscorer_tokenizer
 
-    @lru_cache(maxsize=1000)
-    def generate_distractor(self, context, question, answer, gen_quantity, strategy):
-        if type(answer) is str:
-            from data.model import Answer
+        # one thread per distractor model, see `_torch_threads`
+        self._dg_pool = ThreadPoolExecutor(
+            max_workers=len(dg_models), thread_name_prefix="dg"
+        )
 
-            answer = Answer.parse_obj(json.loads(answer))
+    def _torch_threads(self):
+        """
+        Torch threads of each distractor model thread, a share of the calling
+        thread's, so it follows the split of the process (e.g. per gunicorn
+        worker) and of the calling inference pool, not the count at build time
+        """
+        return DG_TORCH_THREADS or max(
+            1, torch.get_num_threads() // len(self.dg_models)
+        )
 
-        all_options = []
-        for i, (dg_tokenizer, dg_model) in enumerate(
-            zip(self.dg_tokenizers, self.dg_models)
-        ):
-            d_input_ids, _ = prepare_dis_model_input_ids(
-                context,
-                question,
-                answer.tag,
-                answer.start_at,
-                answer.end_at,
-                dg_tokenizer,
-            )  # 如果文章過長進行重新裁切與處理
+    def close(self):
+        """Stop the distractor model threads, once the models are evicted"""
+        self._dg_pool.shutdown(wait=False)
+
+    def _generate_options(self, build_input_ids, gen_quantity):
+        """
+        Generate candidate options with every distractor model concurrently
+
+        Args:
+            build_input_ids: builds model input ids from a distractor tokenizer
+        Returns:
+            candidate options of each distractor model, in model order
+        """
+        return self._generate_options_batch(
+            lambda dg_tokenizer: build_input_ids(dg_tokenizer).tolist(), gen_quantity
+        )[0]
+
+    def _generate_options_batch(self, build_inputs, gen_quantity):
+        """
+        Generate candidate options for many inputs, one padded `generate` per
+        distractor model, models run concurrently
+
+        Args:
+            build_inputs: builds the input ids (lists) of every input from a distractor tokenizer
+        Returns:
+            for each input, candidate options of each distractor model, in model order
+        """
+        num_return_sequences = gen_quantity * 2
+        torch_threads = self._torch_threads()
+
+        def generate(dg_tokenizer, dg_model):
+            set_torch_threads(torch_threads)
+            # generate on this thread and its share of torch threads, not on
+            # the thread of a micro-batcher
+            if isinstance(dg_model, MicroBatcher):
+                dg_model = dg_model.model
+            input_ids, attention_mask = pad_sequences(
+                build_inputs(dg_tokenizer), dg_tokenizer.pad_token_id
+            )
             out_ids = dg_model.generate(
-                input_ids=d_input_ids.to(dg_model.device),
+                input_ids=input_ids.to(dg_model.device),
+                attention_mask=attention_mask.to(dg_model.device),
                 num_beams=gen_quantity * 3,
                 length_penalty=0.9,
                 num_beam_groups=gen_quantity,
                 diversity_penalty=1.0,
-                num_return_sequences=gen_quantity * 2,
+                num_return_sequences=num_return_sequences,
             )
-            for out_seq_ids in out_ids:
-                option = dg_tokenizer.decode(out_seq_ids, skip_special_tokens=True)
+            options = dg_tokenizer.batch_decode(out_ids, skip_special_tokens=True)
+            return [
+                options[i : i + num_return_sequences]
+                for i in range(0, len(options), num_return_sequences)
+            ]
+
+        futures = [
+            self._dg_pool.submit(generate, dg_tokenizer, dg_model)
+            for dg_tokenizer, dg_model in zip(self.dg_tokenizers, self.dg_models)
+        ]
+        # [model][input] -> [input][model]
+        return [list(options) for options in zip(*[f.result() for f in futures])]
+
+    def generate_distractor(self, context, question, answer, gen_quantity, strategy):
+        if type(answer) is str:
+            from data.model import Answer
+
+            answer = Answer.parse_obj(json.loads(answer))
+
+        all_options = []
+        for i, options in enumerate(
+            self._generate_options(
+                lambda dg_tokenizer: prepare_dis_model_input_ids(
+                    context,
+                    question,
+                    answer.tag,
+                    answer.start_at,
+                    answer.end_at,
+                    dg_tokenizer,
+                )[
+                    0
+                ],  # 如果文章過長進行重新裁切與處理
+                gen_quantity,
+            )
+        ):
+            for option in options:
                 logger.info(f"{i} {option}")
-                all_options.append(option)
+            all_options += options
         # logger.info(all_options)
 
         if strategy == "RL":
@@ -155,92 +242,129 @@ class BartDistractorGeneration:
             )
 
     def _selection_with_rl(self, context, question, answer, all_options, gen_quantity):
-        max_combin = [0, []]
         max_num_selection_model = 5
-        num_selection_model = 0
-        for combin in set(it.combinations(all_options, gen_quantity)):
-            options = list(combin) + [answer]
-            keep = True
-            for i in set(it.combinations(options, 2)):
-                a = " ".join([char for char in split_lines_by_punc([i[0]])])
-                b = " ".join([char for char in split_lines_by_punc([i[1]])])
-                metrics_dict = self.nlgeval.compute_individual_metrics([a], b)
-                if metrics_dict["Bleu_1"] > 0.60:
-                    keep = False
-                    break
-            if keep:
-                from config import max_length
-
-                prompt = context + self.tokenizer.sep_token + question
-                encoding_input = []
-                for choice in options:
-                    encoding_input.append([prompt, choice])
-                encoding_input.append([prompt, answer])
-                labels = torch.tensor(len(options) - 1).unsqueeze(0)
-                encoding = self.tokenizer(
-                    encoding_input,
-                    return_tensors="pt",
-                    padding=True,
-                    truncation="only_first",
-                    max_length=max_length,
-                )
-                outputs = self.model(
-                    **{
-                        k: v.unsqueeze(0).to(self.model.device)
-                        for k, v in encoding.items()
-                    },
-                    labels=labels.to(self.model.device),
-                )  # batch size is 1
-                entropy = (
-                    Categorical(probs=torch.softmax(outputs.logits, -1))
-                    .entropy()
-                    .tolist()[0]
-                )
+        all_options = list(dict.fromkeys(all_options))  # dedup, keep order
+        bleu_1 = Bleu1Matrix(all_options + [answer])
 
-                if entropy >= max_combin[0]:
-                    max_combin = [entropy, options]
+        # options are compatible if they do not overlap too much (BLEU-1 > 0.60),
+        # every option of a group must also be compatible with the answer
+        option_indexes = [bleu_1.index[option] for option in all_options]
+        answer_index = bleu_1.index[answer]
+        compatible = bleu_1.matrix[np.ix_(option_indexes, option_indexes)] <= 0.60
+        with_answer = bleu_1.matrix[option_indexes, answer_index] <= 0.60
 
-                num_selection_model += 1
-                if num_selection_model >= max_num_selection_model:
-                    return max_combin[1][:-1]
+        candidate_options = []
+        for clique in iter_cliques(
+            compatible, gen_quantity, np.flatnonzero(with_answer)
+        ):
+            candidate_options.append([all_options[i] for i in clique] + [answer])
+            if len(candidate_options) >= max_num_selection_model:
+                break
 
+        max_combin = [0, []]
+        entropies = self._compute_selection_entropies(
+            context, question, answer, candidate_options
+        )
+        for entropy, options in zip(entropies, candidate_options):
+            if entropy >= max_combin[0]:
+                max_combin = [entropy, options]
         return max_combin[1][:-1]
 
-    @lru_cache(maxsize=1000)
-    def generate_distractor_ga(self, context, question, answer, gen_quantity):
-        if answer == "":
-            logger.warning("answer is null")
+    def _compute_selection_entropies(
+        self, context, question, answer, candidate_options
+    ):
+        """Score every candidate options group in one multiple-choice forward"""
+        if len(candidate_options) == 0:
             return []
-        all_options = []
-        for i, (dg_tokenizer, dg_model) in enumerate(
-            zip(self.dg_tokenizers, self.dg_models)
-        ):
-            d_input_ids = prepare_dis_model_ga_input_ids(
-                context, question, answer, dg_tokenizer
-            )  # 如果文章過長進行重新裁切與處理
-            out_ids = dg_model.generate(
-                input_ids=d_input_ids.to(dg_model.device),
-                num_beams=gen_quantity * 3,
-                length_penalty=0.9,
-                num_beam_groups=gen_quantity,
-                diversity_penalty=1.0,
-                num_return_sequences=gen_quantity * 2,
-            )
-            for out_seq_ids in out_ids:
-                option = dg_tokenizer.decode(out_seq_ids, skip_special_tokens=True)
-                # logger.info(f"{i} {option}")
-                all_options.append(option)
-        # logger.info(all_options)
-        # return all_options
-        return self._selection_with_ga(
-            context, question, answer, all_options, gen_quantity
+
+        # the prompt is shared by every choice, tokenize it only once
+        prompt = context + self.tokenizer.sep_token + question
+        prompt_ids = self.tokenizer(prompt, add_special_tokens=False)["input_ids"]
+        num_special_tokens = self.tokenizer.num_special_tokens_to_add(pair=True)
+        choice_ids = {}
+
+        encoding_input = []
+        for options in candidate_options:
+            for choice in options + [answer]:
+                if choice not in choice_ids:
+                    choice_ids[choice] = self.tokenizer(
+                        choice, add_special_tokens=False
+                    )["input_ids"]
+                # same as `truncation="only_first"`
+                truncated_prompt_ids = prompt_ids
+                num_tokens_to_remove = (
+                    len(prompt_ids)
+                    + len(choice_ids[choice])
+                    + num_special_tokens
+                    - max_length
+                )
+                if 0 < num_tokens_to_remove < len(prompt_ids):
+                    truncated_prompt_ids = prompt_ids[:-num_tokens_to_remove]
+                encoding_input.append(
+                    self.tokenizer.build_inputs_with_special_tokens(
+                        truncated_prompt_ids, choice_ids[choice]
+                    )
+                )
+
+        input_ids, attention_mask = pad_sequences(
+            encoding_input, self.tokenizer.pad_token_id
         )
+        num_choices = len(candidate_options[0]) + 1
+        with torch.no_grad():
+            outputs = self.model(
+                input_ids=input_ids.view(-1, num_choices, input_ids.size(-1)).to(
+                    self.model.device
+                ),
+                attention_mask=attention_mask.view(
+                    -1, num_choices, attention_mask.size(-1)
+                ).to(self.model.device),
+            )
+        probs = torch.softmax(outputs.logits.float(), -1)
+        return Categorical(probs=probs).entropy().tolist()
 
-    def _selection_with_ga(self, context, question, answer, all_options, gen_quantity):
-        ga_optim = GAOptimizer(
-            self.pplscorer_model,
-            self.pplscorer_tokenizer,
-            len(all_options),
+    def generate_distractor_ga(self, context, question, answer, gen_quantity):
+        return self.generate_distractors_ga(
+            [{"context": context, "question": question, "answer": answer}],
+            gen_quantity,
+        )[0]
+
+    def generate_distractors_ga(self, cqas, gen_quantity):
+        """
+        `generate_distractor_ga` for many context/question/answer dicts, their
+        candidate options are generated in one batch
+        """
+        outs = [[] for _ in cqas]
+        batch = []
+        for i, cqa in enumerate(cqas):
+            if cqa["answer"] == "":
+                logger.warning("answer is null")
+            else:
+                batch.append(i)
+        if len(batch) == 0:
+            return outs
+
+        all_options = self._generate_options_batch(
+            lambda dg_tokenizer: [
+                prepare_dis_model_ga_input_ids(
+                    cqas[i]["context"],
+                    cqas[i]["question"],
+                    cqas[i]["answer"],
+                    dg_tokenizer,
+                )[0].tolist()
+                for i in batch
+            ],  # 如果文章過長進行重新裁切與處理
             gen_quantity,
         )
+        for i, options in zip(batch, all_options):
+            outs[i] = self._selection_with_ga(
+                cqas[i]["context"],
+                cqas[i]["question"],
+                cqas[i]["answer"],
+                sum(options, []),
+                gen_quantity,
+            )
+        return outs
+
+    def _selection_with_ga(self, context, question, answer, all_options, gen_quantity):
+        ga_optim = GAOptimizer(len(all_options), gen_quantity)
         return ga_optim.optimize(all_options, context)[:gen_quantity]
@@ -0,0 +1,46 @@
+import numpy as np
+from nlp2 import split_lines_by_punc
+
+# smoothing constants of the nlgeval (pycocoevalcap) BLEU scorer
+_TINY = 1e-15
+_SMALL = 1e-9
+
+
+def tokenize(sentence):
+    return " ".join(split_lines_by_punc([sentence])).split()
+
+
+class Bleu1Matrix:
+    """
+    Pairwise BLEU-1 between sentences, same as
+    `nlgeval.compute_individual_metrics([ref], hyp)["Bleu_1"]` on sentences
+    tokenized by `split_lines_by_punc`
+    """
+
+    def __init__(self, sentences):
+        self.index = {}
+        for sentence in sentences:
+            self.index.setdefault(sentence, len(self.index))
+
+        # unigram count of every sentence over a shared vocabulary
+        tokens = [tokenize(sentence) for sentence in self.index]
+        vocab = {}
+        for sentence_tokens in tokens:
+            for token in sentence_tokens:
+                vocab.setdefault(token, len(vocab))
+        counts = np.zeros((len(tokens), max(len(vocab), 1)))
+        for i, sentence_tokens in enumerate(tokens):
+            for token in sentence_tokens:
+                counts[i, vocab[token]] += 1
+
+        # matrix[i, j] scores hyp `j` against ref `i`
+        lengths = counts.sum(axis=1)
+        ref_lengths, hyp_lengths = lengths[:, None], lengths[None, :]
+        correct = np.minimum(counts[:, None, :], counts[None, :, :]).sum(axis=-1)
+        precision = (correct + _TINY) / (hyp_lengths + _SMALL)
+        ratio = (hyp_lengths + _TINY) / (ref_lengths + _SMALL)
+        brevity_penalty = np.where(ratio < 1, np.exp(1 - 1 / np.minimum(ratio, 1)), 1.0)
+        self.matrix = precision * brevity_penalty
+
+    def __call__(self, ref, hyp):
+        return self.matrix[self.index[ref], self.index[hyp]]
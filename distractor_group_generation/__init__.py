@@ -3,7 +3,7 @@ from transformers import AutoModel
 
 from config import max_length
 from data.model import DistractorOrder
-from question_group_generation.scorer import CoverageScorer
+from question_group_generation.scorer import ContextIndex, CoverageScorer
 
 
 def generate(model: AutoModel, order: DistractorOrder):
@@ -22,17 +22,17 @@ def generate(model: AutoModel, order: DistractorOrder):
 
     # 由於內文有長度限制；計算問句最匹配的內文段落
     keyword_coverage_scorer = CoverageScorer()
+    paragraphs = tokenizer.batch_decode(tokenize_result.input_ids)
+    paragraph_indexes = [ContextIndex(paragraph) for paragraph in paragraphs]
     cqas = []
     for question_and_answer in order.question_and_answers:
         question = question_and_answer.question
         answer = question_and_answer.answer
         score = 0.0
-        paragraph = tokenizer.decode(tokenize_result.input_ids[0])
-        for input_ids in tokenize_result.input_ids:
-            _paragraph = tokenizer.decode(input_ids)
-            _score = keyword_coverage_scorer._compute_coverage_score(
-                [question], _paragraph
-            )
+        paragraph = paragraphs[0]
+        keywords = keyword_coverage_scorer._extract_keywords([question])
+        for _paragraph, paragraph_index in zip(paragraphs, paragraph_indexes):
+            _score = paragraph_index.coverage(keywords)
             # logger.debug(f"Q:{question} A:{answer} score:{score}")
 
             if _score > score:
@@ -42,13 +42,7 @@ def generate(model: AutoModel, order: DistractorOrder):
         cqas.append({"context": paragraph, "question": question, "answer": answer})
 
     outs = []
-    for cqa in cqas:
-        options = model.generate_distractor_ga(
-            context=cqa["context"],
-            question=cqa["question"],
-            answer=cqa["answer"],
-            gen_quantity=3,
-        )
+    for cqa, options in zip(cqas, model.generate_distractors_ga(cqas, gen_quantity=3)):
         logger.info(f"Q:{cqa['question']} A:{cqa['answer']} O:{options}")
         outs.append(
             {
@@ -0,0 +1,45 @@
+"""
+DOCX building of the export endpoint, kept out of the `utils` package so the
+spawned render workers import only `docx` and `data.model`, not the models'
+torch
+"""
+import io
+import time
+from typing import List
+
+from docx import Document
+
+from data.model import ExportSet
+
+
+def build_docx(question_sets: List[ExportSet]):
+    document = Document()
+    for question_set in question_sets:
+        document.add_paragraph(f"{question_set.context}")
+        document.add_paragraph("")
+        for qa_pair in question_set.question_pairs:
+            document.add_paragraph(f"{qa_pair.question}")
+            document.add_paragraph("")
+            for option in qa_pair.options:
+                if option.is_answer:
+                    document.add_paragraph(f"+ {option.text}")
+                else:
+                    document.add_paragraph(f"- {option.text}")
+            document.add_paragraph("")
+    return document
+
+
+def render_docx(question_sets: List[dict]):
+    """
+    Render a DOCX export in a worker process
+
+    Returns:
+        `(content, render_seconds)`
+    """
+    start = time.perf_counter()
+    document = build_docx(
+        [ExportSet.parse_obj(question_set) for question_set in question_sets]
+    )
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue(), time.perf_counter() - start
@@ -0,0 +1,41 @@
+# gunicorn -c gunicorn.conf.py server:app
+#
+# Models are loaded once in the master process (`preload_app`) and shared
+# copy-on-write with every forked worker, so per-worker memory only grows by
+# activations. CUDA can not be initialized before fork, on GPU hosts every
+# worker loads its own models instead, CPU weights loaded from snapshots are
+# still shared through the page cache.
+import gc
+import multiprocessing
+import os
+
+import torch
+
+from utils.inference import set_default_torch_threads
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+preload_app = os.getenv(
+    "PRELOAD_MODELS", "false" if torch.cuda.is_available() else "true"
+).lower() in ("1", "true", "yes")
+
+
+def pre_fork(server, worker):
+    # move everything loaded so far out of gc tracking, otherwise the collector
+    # touches every object header and un-shares the pages in the workers
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # split cores between workers unless torch threads are set explicitly, the
+    # inference and batcher threads doing the work are set on start
+    if os.getenv("OMP_NUM_THREADS") is None:
+        set_default_torch_threads(
+            max(1, multiprocessing.cpu_count() // server.cfg.workers)
+        )
+    server.log.info(
+        f"Worker {worker.pid} spawned with {torch.get_num_threads()} torch threads"
+    )
@@ -1,11 +1,18 @@
+import argparse
+import json
+import resource
 import threading
 import time
-from collections import namedtuple
+from collections import Counter, OrderedDict, deque, namedtuple
+from contextlib import contextmanager
+from pathlib import Path
 
+import numpy as np
 import stanza
 import torch
 from loguru import logger
 from transformers import (
+    AutoConfig,
     AutoModelForCausalLM,
     AutoModelForPreTraining,
     AutoModelForSeq2SeqLM,
@@ -17,7 +24,19 @@ from transformers import (
     RobertaTokenizer,
 )
 
-ModelSpec = namedtuple("ModelSpec", ["model_class", "tokenizer_class", "name", "alias"])
+try:
+    from transformers.modeling_utils import no_init_weights as _no_init_weights
+except ImportError:
+    from contextlib import nullcontext as _no_init_weights
+
+# `precision` is the inference precision, one of `PRECISIONS`
+ModelSpec = namedtuple(
+    "ModelSpec",
+    ["model_class", "tokenizer_class", "name", "alias", "precision"],
+    defaults=["fp32"],
+)
+
+PRECISIONS = ("fp32", "int8", "bf16")
 
 MODELS_SPECS = [
     ModelSpec(
@@ -76,11 +95,226 @@ MODELS_SPECS = [
     ),
 ]
 
+MODELS_ALIASES = [spec.alias for spec in MODELS_SPECS]
+
+COMPOSITE_MODELS = {
+    "dis_en": ["_dg_en", "_dg_pm", "_dg_both", "_dg_rl"],
+}
+
+ResidentModel = namedtuple(
+    "ResidentModel", ["model", "tokenizer", "size", "precision"], defaults=["fp32"]
+)
+
+
+def _model_size(model):
+    """Bytes held by parameters and buffers of `model`, packed int8 weights included"""
+    seen = set()
+    size = 0
+    for value in model.state_dict().values():
+        # dynamically quantized Linear layers keep `(weight, bias)` packed
+        for tensor in value if isinstance(value, tuple) else (value,):
+            if not isinstance(tensor, torch.Tensor) or tensor.data_ptr() in seen:
+                continue
+            # tied weights are listed under every name
+            seen.add(tensor.data_ptr())
+            size += tensor.numel() * tensor.element_size()
+    return size
+
+
+def _peak_rss_mb():
+    # `ru_maxrss` is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _snapshot_tensors(model):
+    # tied weights show up once in `named_parameters`, keep them tied on load
+    yield from model.named_parameters()
+    yield from model.named_buffers()
+
+
+def save_snapshot(spec: ModelSpec, snapshot_dir):
+    """
+    Save model of `spec` as a memory-mappable snapshot: config, tokenizer and
+    every weight packed into one raw `weights.bin` indexed by `weights.json`
+    """
+    path = Path(snapshot_dir) / spec.alias
+    path.mkdir(parents=True, exist_ok=True)
+    logger.info(f"Start snapshotting <{spec.name}> into {path}...")
+
+    model = spec.model_class.from_pretrained(spec.name)
+    tokenizer = spec.tokenizer_class.from_pretrained(spec.name)
+    model.config.save_pretrained(path)
+    tokenizer.save_pretrained(path)
+
+    index = []
+    offset = 0
+    with open(path / "weights.bin", "wb") as f:
+        for name, tensor in _snapshot_tensors(model):
+            array = tensor.detach().cpu().contiguous().numpy()
+            index.append(
+                {
+                    "name": name,
+                    "dtype": array.dtype.str,
+                    "shape": list(array.shape),
+                    "offset": offset,
+                }
+            )
+            f.write(array.tobytes())
+            offset += array.nbytes
+            # keep every tensor aligned
+            padding = -offset % 64
+            f.write(b"\0" * padding)
+            offset += padding
+    with open(path / "weights.json", "w") as f:
+        json.dump({"name": spec.name, "tensors": index}, f)
+    logger.info(f"<{spec.name}> snapshot saved! ({offset / 1024 ** 2:.0f} MB)")
+
+
+def _snapshot_name(spec: ModelSpec, snapshot_dir):
+    with open(Path(snapshot_dir) / spec.alias / "weights.json", "r") as f:
+        return json.load(f).get("name")
+
+
+def load_snapshot(spec: ModelSpec, snapshot_dir):
+    """Build model of `spec` on top of weights memory-mapped from its snapshot"""
+    path = Path(snapshot_dir) / spec.alias
+    with open(path / "weights.json", "r") as f:
+        snapshot = json.load(f)
+    if snapshot.get("name") != spec.name:
+        raise ValueError(
+            f"Snapshot {path} is of <{snapshot.get('name')}>, not <{spec.name}>"
+        )
+    index = snapshot["tensors"]
+
+    config = AutoConfig.from_pretrained(path)
+    with _no_init_weights():
+        if hasattr(spec.model_class, "from_config"):
+            model = spec.model_class.from_config(config)
+        else:
+            model = spec.model_class(config)
+
+    # copy-on-write mapping, pages are only read from disk when touched
+    weights = np.memmap(path / "weights.bin", dtype=np.uint8, mode="c")
+    tensors = {}
+    for entry in index:
+        dtype = np.dtype(entry["dtype"])
+        nbytes = int(np.prod(entry["shape"])) * dtype.itemsize
+        array = weights[entry["offset"] : entry["offset"] + nbytes].view(dtype)
+        tensors[entry["name"]] = torch.from_numpy(array.reshape(entry["shape"]))
+    model_tensors = dict(_snapshot_tensors(model))
+    for name, tensor in tensors.items():
+        model_tensors[name].data = tensor
+    model.tie_weights()
+    model.eval()
+
+    tokenizer = spec.tokenizer_class.from_pretrained(path)
+    return model, tokenizer
+
+
+def has_snapshot(spec: ModelSpec, snapshot_dir):
+    """Whether `snapshot_dir` holds a snapshot of the checkpoint of `spec`"""
+    if (
+        snapshot_dir is None
+        or not (Path(snapshot_dir) / spec.alias / "weights.json").exists()
+    ):
+        return False
+    # the alias may point to another checkpoint since the snapshot was taken
+    name = _snapshot_name(spec, snapshot_dir)
+    if name != spec.name:
+        logger.warning(
+            f"Snapshot of <{spec.alias}> is of <{name}>, not <{spec.name}>, "
+            "load from checkpoint instead, re-run `python language_model.py snapshot`"
+        )
+        return False
+    return True
+
+
+def load_model(spec: ModelSpec, snapshot_dir=None):
+    """
+    Returns:
+        `(model, tokenizer, source)`, from the snapshot of `spec` if there is
+        one, else from its checkpoint
+    """
+    if has_snapshot(spec, snapshot_dir):
+        return (*load_snapshot(spec, snapshot_dir), "snapshot")
+    model = spec.model_class.from_pretrained(spec.name)
+    tokenizer = spec.tokenizer_class.from_pretrained(spec.name)
+    return model, tokenizer, "checkpoint"
+
+
+def _bf16_supported(device):
+    if device.type == "cuda":
+        is_supported = getattr(torch.cuda, "is_bf16_supported", None)
+        return is_supported is not None and is_supported()
+    try:
+        x = torch.ones((2, 2), dtype=torch.bfloat16)
+        torch.matmul(x, x)
+        return True
+    except RuntimeError:
+        return False
+
+
+def apply_precision(model, precision):
+    """
+    Convert `model` in place to inference precision `precision`, falls back
+    to fp32 where the precision is not supported
+
+    Returns:
+        `(model, applied precision)`
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision}, expected one of {PRECISIONS}")
+    if precision == "int8":
+        if model.device.type != "cpu":
+            logger.warning("int8 dynamic quantization is CPU only, keep fp32")
+            return model, "fp32"
+        model = torch.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+        )
+    elif precision == "bf16":
+        if not _bf16_supported(model.device):
+            logger.warning(f"bf16 is not supported on {model.device}, keep fp32")
+            return model, "fp32"
+        model = model.to(torch.bfloat16)
+    return model, precision
+
 
 class LanguageModels:
-    def __init__(self, download_only=False):
+    def __init__(self, download_only=False, lazy=None, memory_budget_mb=None):
+        """
+        Args:
+            download_only: only download the checkpoints
+            lazy: load a model on first use of its alias instead of at startup
+            memory_budget_mb: evict least recently used models when resident
+                models exceed this size, 0 means unlimited
+        """
+        self._specs = {spec.alias: spec for spec in MODELS_SPECS}
+        self._lock = threading.RLock()
+        self._alias_locks = {alias: threading.Lock() for alias in self._specs}
+        self._resident = OrderedDict()
+        self._known_sizes = {}
+        self._pins = Counter()
+        self._composites = {}
+        self.events = deque(maxlen=100)
+
+        if not download_only:
+            from config import LAZY_MODEL_LOADING, MODEL_MEMORY_BUDGET_MB
+
+            lazy = LAZY_MODEL_LOADING if lazy is None else lazy
+            if memory_budget_mb is None:
+                memory_budget_mb = MODEL_MEMORY_BUDGET_MB
+        self.memory_budget = (memory_budget_mb or 0) * 1024 ** 2
+
+        if lazy and not download_only:
+            logger.info("Lazy model loading enabled, models load on first use")
+            return
+
         threads = [
-            threading.Thread(target=self._init, args=(spec, download_only))
+            (
+                threading.Thread(target=self._init, args=(spec, download_only))
+                if download_only
+                else threading.Thread(target=self._load, args=(spec.alias,))
+            )
             for spec in MODELS_SPECS
         ]
 
@@ -96,29 +330,189 @@ class LanguageModels:
             thread.join()
 
         if not download_only:
-            self._post_dg_load()
-        logger.info(f"Model loading took {(time.time() - start_at):.2f} secs")
+            for name in COMPOSITE_MODELS:
+                self._composite(name)
+        logger.info(
+            f"Model loading took {(time.time() - start_at):.2f} secs, "
+            f"peak RSS {_peak_rss_mb():.0f} MB"
+        )
+
+    def __getattr__(self, name):
+        # resolve `{alias}_model` and `{alias}_tokenizer`, loading on demand
+        alias, _, kind = name.rpartition("_")
+        if kind == "model" and alias in COMPOSITE_MODELS:
+            return self._composite(alias)
+        if kind not in ("model", "tokenizer") or alias not in MODELS_ALIASES:
+            raise AttributeError(name)
+        resident = self._load(alias)
+        return resident.model if kind == "model" else resident.tokenizer
+
+    @contextmanager
+    def hold(self, *aliases):
+        """Keep `aliases` resident and protected from eviction while in the block"""
+        aliases = [
+            component
+            for alias in aliases
+            for component in COMPOSITE_MODELS.get(alias, [alias])
+        ]
+        with self._lock:
+            self._pins.update(aliases)
+        try:
+            for alias in aliases:
+                self._load(alias)
+            yield self
+        finally:
+            with self._lock:
+                self._pins.subtract(aliases)
+                self._evict()
+
+    def precision(self, alias):
+        """Configured inference precision of `alias`"""
+        from config import MODEL_PRECISIONS
+
+        return MODEL_PRECISIONS.get(alias, self._specs[alias].precision)
+
+    def version(self, *aliases):
+        """Identify the checkpoints behind `aliases`, for keying cached results"""
+        versions = []
+        for alias in aliases:
+            for component in COMPOSITE_MODELS.get(alias, [alias]):
+                name = self._specs[component].name
+                precision = self.precision(component)
+                versions.append(name if precision == "fp32" else f"{name}@{precision}")
+        return "|".join(versions)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "memory_budget_mb": self.memory_budget / 1024 ** 2,
+                "resident_mb": self._resident_size() / 1024 ** 2,
+                "models": [
+                    {
+                        "alias": alias,
+                        "name": self._specs[alias].name,
+                        "size_mb": resident.size / 1024 ** 2,
+                        "precision": resident.precision,
+                        "pins": self._pins[alias],
+                    }
+                    for alias, resident in self._resident.items()
+                ],
+                "events": list(self.events),
+            }
+
+    def _resident_size(self):
+        return sum(resident.size for resident in self._resident.values())
+
+    def _record(self, event, alias, size):
+        self.events.append(
+            {"time": time.time(), "event": event, "alias": alias, "size": size}
+        )
+
+    def _load(self, alias) -> ResidentModel:
+        with self._lock:
+            if alias in self._resident:
+                self._resident.move_to_end(alias)
+                return self._resident[alias]
+
+        with self._alias_locks[alias]:
+            with self._lock:
+                if alias in self._resident:
+                    self._resident.move_to_end(alias)
+                    return self._resident[alias]
+                # make room ahead if we have seen this model before
+                self._evict(incoming=self._known_sizes.get(alias, 0))
+
+            resident = self._init(self._specs[alias])
+            with self._lock:
+                self._resident[alias] = resident
+                self._known_sizes[alias] = resident.size
+                self._record("load", alias, resident.size)
+                self._evict(keep=(alias,))
+            return resident
+
+    def _evict(self, incoming=0, keep=()):
+        if not self.memory_budget:
+            return
+        with self._lock:
+            for alias in list(self._resident.keys()):
+                if self._resident_size() + incoming <= self.memory_budget:
+                    return
+                if self._pins[alias] > 0 or alias in keep:
+                    continue
+                resident = self._resident.pop(alias)
+                for name, components in COMPOSITE_MODELS.items():
+                    if alias in components:
+                        composite = self._composites.pop(name, None)
+                        if hasattr(composite, "close"):
+                            composite.close()
+                if hasattr(resident.model, "close"):
+                    resident.model.close()
+                self._record("evict", alias, resident.size)
+                logger.info(
+                    f"<{self._specs[alias].name}> evicted, "
+                    f"freed {resident.size / 1024 ** 2:.0f} MB"
+                )
+            if self._resident_size() + incoming > self.memory_budget:
+                logger.warning(
+                    "Resident models exceed memory budget, remaining models are in use"
+                )
+
+    def _composite(self, name):
+        with self.hold(name):
+            with self._lock:
+                composite = self._composites.get(name)
+            if composite is None:
+                built = getattr(self, f"_build_{name}")()
+                with self._lock:
+                    composite = self._composites.setdefault(name, built)
+                # another thread built it first
+                if composite is not built and hasattr(built, "close"):
+                    built.close()
+            return composite
 
     def _init(self, spec: ModelSpec, download_only: bool = False):
         logger.info(f"Start loading <{spec.name}>...")
-        model = spec.model_class.from_pretrained(spec.name)
-        if not download_only:
-            from config import CUDA_MODELS
+        start_at = time.time()
+        size = 0
+        source = "checkpoint"
+        precision = "fp32"
+        if download_only:
+            model = spec.model_class.from_pretrained(spec.name)
+            tokenizer = spec.tokenizer_class.from_pretrained(spec.name)
+        else:
+            from config import (
+                BATCH_MAX_SIZE,
+                BATCH_MAX_WAIT_MS,
+                CUDA_MODELS,
+                MICRO_BATCHING_MODELS,
+                MODEL_SNAPSHOT_DIR,
+            )
 
+            model, tokenizer, source = load_model(spec, MODEL_SNAPSHOT_DIR)
             model.to(
                 "cuda"
                 if spec.name in CUDA_MODELS and torch.cuda.is_available()
                 else "cpu"
             )
-        tokenizer = spec.tokenizer_class.from_pretrained(spec.name)
-        setattr(self, f"{spec.alias}_model", model)
-        setattr(self, f"{spec.alias}_tokenizer", tokenizer)
-        logger.info(f"<{spec.name}> loaded!")
+            model, precision = apply_precision(model, self.precision(spec.alias))
+            size = _model_size(model)
+            if spec.name in MICRO_BATCHING_MODELS:
+                from utils.batching import MicroBatcher
 
-    def _post_dg_load(self):
+                model = MicroBatcher(
+                    model, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS
+                )
+        logger.info(
+            f"<{spec.name}> loaded from {source}! ({size / 1024 ** 2:.0f} MB, {precision}) "
+            f"took {(time.time() - start_at):.2f} secs, "
+            f"peak RSS {_peak_rss_mb():.0f} MB"
+        )
+        return ResidentModel(model, tokenizer, size, precision)
+
+    def _build_dis_en(self):
         from distractor_generation import BartDistractorGeneration
 
-        self.dis_en_model = BartDistractorGeneration(
+        return BartDistractorGeneration(
             dg_models=[self._dg_en_model, self._dg_pm_model, self._dg_both_model],
             dg_tokenizer=[
                 self._dg_en_tokenizer,
@@ -127,10 +521,160 @@ class LanguageModels:
             ],
             dg_selection_models=self._dg_rl_model,
             dg_selection_tokenizer=self._dg_rl_tokenizer,
-            pplscorer_model=self.pplscorer_model,
-            pplscorer_tokenizer=self.pplscorer_tokenizer,
         )
 
 
+def _example_texts():
+    """Articles, contexts and questions of `data/examples.json`"""
+    with open(Path(__file__).parent / "data" / "examples.json", "r") as f:
+        examples = json.load(f)
+
+    texts = []
+
+    def collect(value):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                if key in ("article", "context", "question") and isinstance(item, str):
+                    texts.append(item)
+                else:
+                    collect(item)
+        elif isinstance(value, list):
+            for item in value:
+                collect(item)
+
+    collect(examples)
+    return list(dict.fromkeys(texts))
+
+
+def _forward(model, tokenizer, texts):
+    """Logits of `model` on `texts`, encoder-decoder models are fed `texts` on both sides"""
+    encodings = tokenizer(
+        texts, return_tensors="pt", padding=True, truncation=True, max_length=512
+    )
+    inputs = {
+        "input_ids": encodings["input_ids"],
+        "attention_mask": encodings["attention_mask"],
+    }
+    if isinstance(model, RobertaForMultipleChoice):
+        inputs = {key: value.unsqueeze(1) for key, value in inputs.items()}
+    elif model.config.is_encoder_decoder:
+        inputs["decoder_input_ids"] = encodings["input_ids"]
+    with torch.no_grad():
+        return model(**inputs)[0].float(), encodings["attention_mask"]
+
+
+def _greedy_outputs(model, tokenizer, texts):
+    encodings = tokenizer(
+        texts, return_tensors="pt", padding=True, truncation=True, max_length=512
+    )
+    with torch.no_grad():
+        outputs = model.generate(
+            input_ids=encodings["input_ids"],
+            attention_mask=encodings["attention_mask"],
+            max_length=32,
+            num_beams=1,
+            do_sample=False,
+        )
+    return tokenizer.batch_decode(outputs, skip_special_tokens=True)
+
+
+def compare_precisions(spec: ModelSpec, precisions, texts, snapshot_dir=None, repeat=3):
+    """
+    Compare `precisions` of the model of `spec` against fp32 on CPU: output
+    drift on `texts`, forward latency and weight memory
+
+    Returns:
+        a row of measures per precision, fp32 first
+    """
+    rows = []
+    reference = None
+    for precision in ["fp32"] + [p for p in precisions if p != "fp32"]:
+        model, tokenizer, _ = load_model(spec, snapshot_dir)
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        model, applied = apply_precision(model, precision)
+        if applied != precision:
+            continue
+
+        # warm up, the first call pays for lazy initialization
+        _forward(model, tokenizer, texts)
+        latencies = []
+        for _ in range(repeat):
+            start_at = time.perf_counter()
+            logits, attention_mask = _forward(model, tokenizer, texts)
+            latencies.append(time.perf_counter() - start_at)
+        greedy = (
+            _greedy_outputs(model, tokenizer, texts)
+            if model.config.is_encoder_decoder
+            else None
+        )
+        if reference is None:
+            reference = (logits, greedy)
+
+        # share of positions whose most likely token (or choice) is unchanged
+        agree = logits.argmax(-1) == reference[0].argmax(-1)
+        if agree.shape == attention_mask.shape:
+            agree = agree[attention_mask.bool()]
+        rows.append(
+            {
+                "alias": spec.alias,
+                "precision": precision,
+                "size_mb": _model_size(model) / 1024 ** 2,
+                "latency_ms": float(np.median(latencies)) * 1000,
+                "max_abs_diff": (logits - reference[0]).abs().max().item(),
+                "top1_agreement": agree.float().mean().item(),
+                "greedy_match": (
+                    None
+                    if greedy is None
+                    else float(np.mean([a == b for a, b in zip(greedy, reference[1])]))
+                ),
+            }
+        )
+        del model
+    return rows
+
+
 if __name__ == "__main__":
-    models = LanguageModels(download_only=True)
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command")
+    snapshot_parser = subparsers.add_parser(
+        "snapshot", help="save memory-mappable snapshots of all models"
+    )
+    snapshot_parser.add_argument("--output", default="snapshots")
+    compare_parser = subparsers.add_parser(
+        "compare",
+        help="compare output drift, latency and memory of precisions against fp32 "
+        "on the inputs of data/examples.json",
+    )
+    compare_parser.add_argument("--aliases", nargs="+", default=MODELS_ALIASES)
+    compare_parser.add_argument(
+        "--precisions", nargs="+", choices=PRECISIONS, default=["int8", "bf16"]
+    )
+    compare_parser.add_argument("--snapshots", default="snapshots")
+    compare_parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.command == "snapshot":
+        for spec in MODELS_SPECS:
+            save_snapshot(spec, args.output)
+    elif args.command == "compare":
+        texts = _example_texts()
+        specs = {spec.alias: spec for spec in MODELS_SPECS}
+        print(
+            "| alias | precision | size MB | latency ms "
+            "| max abs diff | top-1 agreement | greedy match |"
+        )
+        print("|---|---|---|---|---|---|---|")
+        for alias in args.aliases:
+            for row in compare_precisions(
+                specs[alias], args.precisions, texts, args.snapshots, args.repeat
+            ):
+                greedy_match = row["greedy_match"]
+                print(
+                    f"| {row['alias']} | {row['precision']} | {row['size_mb']:.0f} "
+                    f"| {row['latency_ms']:.0f} | {row['max_abs_diff']:.4f} "
+                    f"| {row['top1_agreement']:.3f} "
+                    f"| {'-' if greedy_match is None else f'{greedy_match:.2f}'} |"
+                )
+    else:
+        models = LanguageModels(download_only=True)
@@ -1,21 +1,37 @@
+from typing import List, Tuple
+
 import torch
 from loguru import logger
 
 from config import hl_token, max_length
 
 
-def prepare_qg_model_input_ids(article, start_at, end_at, tokenizer):
-    hl_context = f"{article[:start_at]}{hl_token}{article[start_at:end_at]}{hl_token}{article[end_at:]}"
-    logger.info(hl_context)
-    model_input = tokenizer(hl_context, return_length=True)
+def prepare_qg_model_batch_input_ids(
+    article, spans: List[Tuple[int, int]], tokenizer
+) -> Tuple[List[List[int]], List[int]]:
+    """Highlight every `(start_at, end_at)` span of article and tokenize them in one call"""
+    hl_contexts = []
+    for start_at, end_at in spans:
+        hl_context = f"{article[:start_at]}{hl_token}{article[start_at:end_at]}{hl_token}{article[end_at:]}"
+        logger.info(hl_context)
+        hl_contexts.append(hl_context)
+    model_inputs = tokenizer(hl_contexts, return_length=True)
+
+    hl_token_id = tokenizer.convert_tokens_to_ids([hl_token])[0]
+    slice_length = int(max_length / 2)
+    batch_input_ids = []
+    for input_ids, input_length in zip(
+        model_inputs["input_ids"], model_inputs["length"]
+    ):
+        if input_length > max_length:
+            mid_index = input_ids.index(hl_token_id)
+            input_ids = input_ids[mid_index - slice_length : mid_index + slice_length]
+        batch_input_ids.append(input_ids)
+    return batch_input_ids, model_inputs["length"]
 
-    input_length = model_input["length"][0]
-    if input_length > max_length:
-        hl_token_id = tokenizer.convert_tokens_to_ids([hl_token])[0]
-        slice_length = int(max_length / 2)
-        mid_index = model_input["input_ids"].index(hl_token_id)
-        new_input_ids = model_input["input_ids"][
-            mid_index - slice_length : mid_index + slice_length
-        ]
-        model_input["input_ids"] = new_input_ids
-    return torch.LongTensor([model_input["input_ids"]]), input_length
+
+def prepare_qg_model_input_ids(article, start_at, end_at, tokenizer):
+    batch_input_ids, input_lengths = prepare_qg_model_batch_input_ids(
+        article, [(start_at, end_at)], tokenizer
+    )
+    return torch.LongTensor(batch_input_ids), input_lengths[0]
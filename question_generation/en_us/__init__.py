@@ -1,10 +1,22 @@
-from typing import Tuple
+from typing import List, Tuple
 
-from config import max_question_length
-from data.model import QGItem, QuestionAndAnswer
+from config import BATCH_MAX_SIZE, max_question_length
+from data.model import QGBatchItem, QGItem, QuestionAndAnswer
 from transformers import AutoModel, AutoTokenizer
+from utils.batching import pad_sequences
 
-from .. import prepare_qg_model_input_ids
+from .. import prepare_qg_model_batch_input_ids, prepare_qg_model_input_ids
+
+GENERATION_KWARGS = dict(
+    max_length=max_question_length,
+    early_stopping=True,
+    do_sample=False,
+    num_beam_groups=5,
+    diversity_penalty=0.5,
+    num_beams=10,
+    no_repeat_ngram_size=2,
+    num_return_sequences=5,
+)
 
 
 def setup() -> Tuple[AutoModel, AutoTokenizer]:
@@ -21,17 +33,7 @@ def generate(
     input_ids, input_length = prepare_qg_model_input_ids(
         article, start_at, end_at, tokenizer
     )
-    outputs = model.generate(
-        input_ids=input_ids.to(model.device),
-        max_length=max_question_length,
-        early_stopping=True,
-        do_sample=False,
-        num_beam_groups=5,
-        diversity_penalty=0.5,
-        num_beams=10,
-        no_repeat_ngram_size=2,
-        num_return_sequences=5,
-    )
+    outputs = model.generate(input_ids=input_ids.to(model.device), **GENERATION_KWARGS)
 
     decode_questions = []
     for output in outputs:
@@ -43,3 +45,47 @@ def generate(
         end_at=item.answer.end_at,
         questions=decode_questions,
     )
+
+
+def generate_batch(
+    model: AutoModel,
+    tokenizer: AutoTokenizer,
+    item: QGBatchItem,
+    batch_size: int = BATCH_MAX_SIZE,
+) -> List[QuestionAndAnswer]:
+    """
+    Generate questions for every answer of the same article in padded batches
+    of at most `batch_size` answers, each answer is searched with 10 beams
+    """
+    if len(item.answers) == 0:
+        return []
+
+    article = item.article
+    spans = [(answer.start_at, answer.end_at + 1) for answer in item.answers]
+    batch_input_ids, _ = prepare_qg_model_batch_input_ids(article, spans, tokenizer)
+    decode_questions = []
+    for start in range(0, len(batch_input_ids), batch_size):
+        input_ids, attention_mask = pad_sequences(
+            batch_input_ids[start : start + batch_size], tokenizer.pad_token_id
+        )
+        outputs = model.generate(
+            input_ids=input_ids.to(model.device),
+            attention_mask=attention_mask.to(model.device),
+            **GENERATION_KWARGS,
+        )
+        decode_questions += tokenizer.batch_decode(outputs, skip_special_tokens=True)
+
+    num_return_sequences = GENERATION_KWARGS["num_return_sequences"]
+    question_and_answers = []
+    for i, answer in enumerate(item.answers):
+        question_and_answers.append(
+            QuestionAndAnswer(
+                tag=answer.tag,
+                start_at=answer.start_at,
+                end_at=answer.end_at,
+                questions=decode_questions[
+                    i * num_return_sequences : (i + 1) * num_return_sequences
+                ],
+            )
+        )
+    return question_and_answers
@@ -1,28 +1,63 @@
 import re
 
-import torch
-from config import max_length
+from config import QGG_BATCH_SIZE, max_length
 from data.model import GenerationOrder
 from loguru import logger
 from transformers import AutoModel, AutoTokenizer
+from utils.batching import pad_sequences
 
-from .optimizer import GAOptimizer
+from .optimizer import GAOptimizer, run_to_end
 
 
-def feedback_generation(model, tokenizer, input_ids, feedback_times=3):
-    outputs = []
-    device = model.device
+def feedback_inputs(tokenizer, input_ids, feedback_times=3):
+    """
+    Model input of every feedback iteration, each one prepends as many more
+    BOS tokens as the number of questions generated so far plus one
+    """
+    inputs = []
     for i in range(feedback_times):
-        gened_text = tokenizer.bos_token * (len(outputs) + 1)
+        gened_text = tokenizer.bos_token * (i + 1)
         gened_ids = tokenizer(gened_text, add_special_tokens=False)["input_ids"]
         input_ids = gened_ids + input_ids
         input_ids = input_ids[:max_length]
+        inputs.append(input_ids)
+    return inputs
+
 
+def decode_question(tokenizer, sample_output):
+    decode_question = tokenizer.decode(sample_output, skip_special_tokens=False)
+    decode_question = re.sub(re.escape(tokenizer.pad_token), "", decode_question)
+    decode_question = re.sub(re.escape(tokenizer.eos_token), "", decode_question)
+    if tokenizer.bos_token is not None:
+        decode_question = re.sub(re.escape(tokenizer.bos_token), "", decode_question)
+    decode_question = decode_question.strip()
+    decode_question = decode_question.replace("[Q:]", "")
+    return decode_question
+
+
+def feedback_generation_batch(
+    model, tokenizer, windows_input_ids, feedback_times=3, batch_size=QGG_BATCH_SIZE
+):
+    """
+    `feedback_generation` of many windows, iterations do not depend on the
+    previous outputs so all of them are sampled together in padded batches
+
+    Returns:
+        generated questions, window by window
+    """
+    all_input_ids = []
+    for input_ids in windows_input_ids:
+        all_input_ids += feedback_inputs(tokenizer, input_ids, feedback_times)
+
+    outputs = []
+    device = model.device
+    for start in range(0, len(all_input_ids), batch_size):
+        input_ids, attention_mask = pad_sequences(
+            all_input_ids[start : start + batch_size], tokenizer.pad_token_id
+        )
         sample_outputs = model.generate(
-            input_ids=torch.LongTensor(input_ids).unsqueeze(0).to(device),
-            attention_mask=torch.LongTensor([1] * len(input_ids))
-            .unsqueeze(0)
-            .to(device),
+            input_ids=input_ids.to(device),
+            attention_mask=attention_mask.to(device),
             max_length=50,
             early_stopping=True,
             temperature=1.0,
@@ -33,41 +68,28 @@ def feedback_generation(model, tokenizer, input_ids, feedback_times=3):
             no_repeat_ngram_size=5,
             num_return_sequences=1,
         )
-        sample_output = sample_outputs[0]
-        decode_question = tokenizer.decode(sample_output, skip_special_tokens=False)
-        decode_question = re.sub(re.escape(tokenizer.pad_token), "", decode_question)
-        decode_question = re.sub(re.escape(tokenizer.eos_token), "", decode_question)
-        if tokenizer.bos_token is not None:
-            decode_question = re.sub(
-                re.escape(tokenizer.bos_token), "", decode_question
-            )
-        decode_question = decode_question.strip()
-        decode_question = decode_question.replace("[Q:]", "")
-        outputs.append(decode_question)
+        outputs += [
+            decode_question(tokenizer, sample_output)
+            for sample_output in sample_outputs
+        ]
     return outputs
 
 
-def generate(
-    model: AutoModel,
-    tokenizer: AutoTokenizer,
-    pplscorer_model: AutoModel,
-    pplscorer_tokenizer: AutoTokenizer,
-    order: GenerationOrder,
-):
-    context = order.context
-    question_group_size = order.question_group_size
-    candidate_pool_size = order.candidate_pool_size
-
-    #
-    if candidate_pool_size < question_group_size:
-        return {
-            "message": "`candidate_pool_size` must bigger than `question_group_size`"
-        }, 400
-    if candidate_pool_size > 20:
-        return {"message": "`candidate_pool_size` must smaller than 20"}, 400
-    if question_group_size > 10:
-        return {"message": "`question_group_size` must smaller than 10"}, 400
+def feedback_generation(model, tokenizer, input_ids, feedback_times=3):
+    return feedback_generation_batch(model, tokenizer, [input_ids], feedback_times)
+
 
+def _order_error(order: GenerationOrder):
+    if order.candidate_pool_size < order.question_group_size:
+        return "`candidate_pool_size` must bigger than `question_group_size`"
+    if order.candidate_pool_size > 20:
+        return "`candidate_pool_size` must smaller than 20"
+    if order.question_group_size > 10:
+        return "`question_group_size` must smaller than 10"
+    return None
+
+
+def _context_windows(tokenizer, context):
     tokenize_result = tokenizer.batch_encode_plus(
         [context],
         stride=max_length - int(max_length * 0.7),
@@ -77,7 +99,6 @@ def generate(
         return_overflowing_tokens=True,
         return_length=True,
     )
-    candidate_questions = []
     logger.info(f"Size of tokenize_result.input_ids:{len(tokenize_result.input_ids)}")
 
     if len(tokenize_result.input_ids) >= 10:
@@ -85,22 +106,94 @@ def generate(
             f"Force cut tokenize_result.input_ids({len(tokenize_result.input_ids)}) to 10, it's too big"
         )
         tokenize_result.input_ids = tokenize_result.input_ids[:10]
+    return tokenize_result.input_ids
 
-    for input_ids in tokenize_result.input_ids:
-        candidate_questions += feedback_generation(
+
+def _select_question_group(
+    candidate_questions,
+    question_group_size,
+    context,
+):
+    """Yield GA progress events, returns the picked question group"""
+    ga_round = 0
+    while len(candidate_questions) > question_group_size:
+        qgg_optim = GAOptimizer(len(candidate_questions), question_group_size)
+        progress = qgg_optim.iter_optimize(candidate_questions, context)
+        while True:
+            try:
+                event = next(progress)
+            except StopIteration as stop:
+                candidate_questions = stop.value
+                break
+            yield {"event": "progress", "round": ga_round, **event}
+        ga_round += 1
+    return candidate_questions
+
+
+def generate(
+    model: AutoModel,
+    tokenizer: AutoTokenizer,
+    order: GenerationOrder,
+):
+    message = _order_error(order)
+    if message is not None:
+        return {"message": message}, 400
+
+    candidate_questions = feedback_generation_batch(
+        model=model,
+        tokenizer=tokenizer,
+        windows_input_ids=_context_windows(tokenizer, order.context),
+        feedback_times=order.candidate_pool_size,
+    )
+    logger.info(f"Size of candidate_questions:{len(candidate_questions)}")
+
+    question_group = run_to_end(
+        _select_question_group(
+            candidate_questions,
+            order.question_group_size,
+            order.context,
+        )
+    )
+    return {"question_group": question_group}
+
+
+def generate_events(
+    model: AutoModel,
+    tokenizer: AutoTokenizer,
+    order: GenerationOrder,
+):
+    """
+    Same as `generate`, step by step: yields a `candidates` event with the
+    questions of every context window as soon as it is generated, `progress`
+    events of the GA, then a `result` event with the question group (or an
+    `error` event), closing the generator stops the remaining work
+    """
+    message = _order_error(order)
+    if message is not None:
+        yield {"event": "error", "message": message}
+        return
+
+    windows_input_ids = _context_windows(tokenizer, order.context)
+    candidate_questions = []
+    for window, input_ids in enumerate(windows_input_ids):
+        questions = feedback_generation_batch(
             model=model,
             tokenizer=tokenizer,
-            input_ids=input_ids,
+            windows_input_ids=[input_ids],
             feedback_times=order.candidate_pool_size,
         )
+        candidate_questions += questions
+        yield {
+            "event": "candidates",
+            "window": window,
+            "windows": len(windows_input_ids),
+            "questions": questions,
+        }
     logger.info(f"Size of candidate_questions:{len(candidate_questions)}")
 
-    while len(candidate_questions) > question_group_size:
-        qgg_optim = GAOptimizer(
-            pplscorer_model,
-            pplscorer_tokenizer,
-            len(candidate_questions),
-            question_group_size,
-        )
-        candidate_questions = qgg_optim.optimize(candidate_questions, context)
-    return {"question_group": candidate_questions}
+    question_group = yield from _select_question_group(
+        candidate_questions,
+        order.question_group_size,
+        order.context,
+    )
+    yield {"event": "result", "question_group": question_group}
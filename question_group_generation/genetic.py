@@ -0,0 +1,132 @@
+import numpy as np
+
+
+class GeneticAlgorithm:
+    def __init__(
+        self,
+        fitness_function,
+        dimension,
+        max_num_iteration=40,
+        population_size=20,
+        mutation_probability=0.2,
+        elit_ratio=0.2,
+        crossover_probability=0.6,
+        parents_portion=0.5,
+        max_iteration_without_improv=10,
+        seed=None,
+    ):
+        """
+        Minimize `fitness_function` over boolean genomes, the population is a
+        `(population_size, dimension)` bool matrix scored in one call
+
+        Args:
+            fitness_function: maps a bool matrix to a vector of objectives, one per row
+            dimension: genome length
+            max_iteration_without_improv: stop early after that many generations without a better genome
+            seed: seed of the random generator, for reproducible runs
+        """
+        self.fitness_function = fitness_function
+        self.dimension = dimension
+        self.max_num_iteration = max_num_iteration
+        self.population_size = population_size
+        self.mutation_probability = mutation_probability
+        self.crossover_probability = crossover_probability
+        self.max_iteration_without_improv = max_iteration_without_improv
+        self.rng = np.random.default_rng(seed)
+
+        # same sizing rules as `geneticalgorithm`
+        self.num_parents = int(parents_portion * population_size)
+        if (population_size - self.num_parents) % 2 != 0:
+            self.num_parents += 1
+        self.num_elit = int(population_size * elit_ratio)
+        if elit_ratio > 0 and self.num_elit < 1:
+            self.num_elit = 1
+        if self.num_parents < self.num_elit:
+            raise ValueError("number of parents must be greater than number of elits")
+
+        self.best_variable = None
+        self.best_function = np.inf
+        self.report = []
+
+    def _evaluate(self, population):
+        return np.asarray(self.fitness_function(population), dtype=float)
+
+    def _select_parents(self, population, objectives):
+        """Keep the elits, pick the other parents by roulette wheel"""
+        norm = objectives - min(objectives[0], 0)
+        norm = norm.max() - norm + 1
+        cumprob = np.cumsum(norm / norm.sum())
+        picks = np.searchsorted(
+            cumprob, self.rng.random(self.num_parents - self.num_elit)
+        )
+        picks = np.minimum(picks, len(population) - 1)
+        index = np.concatenate([np.arange(self.num_elit), picks])
+        return population[index], objectives[index]
+
+    def _breed(self, parents):
+        """Two point crossover and mutation of random pairs of effective parents"""
+        is_effective = self.rng.random(len(parents)) <= self.crossover_probability
+        if not is_effective.any():
+            is_effective[self.rng.integers(len(parents))] = True
+        effective = parents[is_effective]
+
+        num_pairs = (self.population_size - self.num_parents) // 2
+        x = effective[self.rng.integers(len(effective), size=num_pairs)]
+        y = effective[self.rng.integers(len(effective), size=num_pairs)]
+
+        # swap genes in [start, end) between each pair
+        start = self.rng.integers(self.dimension, size=(num_pairs, 1))
+        end = start + (
+            self.rng.random((num_pairs, 1)) * (self.dimension - start)
+        ).astype(int)
+        genes = np.arange(self.dimension)
+        swap = (genes >= start) & (genes < end)
+        children = np.concatenate([np.where(swap, y, x), np.where(swap, x, y)])
+
+        # mutated genes are redrawn at random
+        mutate = self.rng.random(children.shape) < self.mutation_probability
+        return np.where(mutate, self.rng.random(children.shape) < 0.5, children)
+
+    def _update_best(self, population, objectives):
+        if objectives[0] < self.best_function:
+            self.best_function = objectives[0]
+            self.best_variable = population[0].copy()
+            return True
+        return False
+
+    def run(self):
+        for _ in self.iterate():
+            pass
+        return self.best_variable, self.best_function
+
+    def iterate(self):
+        """Run the GA, yield the generation number after every generation"""
+        population = self.rng.random((self.population_size, self.dimension)) < 0.5
+        objectives = self._evaluate(population)
+        self.best_variable = population[-1].copy()
+        self.best_function = objectives[-1]
+        self.report = []
+
+        without_improv = 0
+        for _ in range(self.max_num_iteration):
+            order = np.argsort(objectives, kind="stable")
+            population, objectives = population[order], objectives[order]
+            if self._update_best(population, objectives):
+                without_improv = 0
+            else:
+                without_improv += 1
+            self.report.append(objectives[0])
+
+            parents, parent_objectives = self._select_parents(population, objectives)
+            children = self._breed(parents)
+            population = np.concatenate([parents, children])
+            objectives = np.concatenate([parent_objectives, self._evaluate(children)])
+            yield len(self.report)
+
+            if without_improv > self.max_iteration_without_improv:
+                break
+
+        order = np.argsort(objectives, kind="stable")
+        population, objectives = population[order], objectives[order]
+        self._update_best(population, objectives)
+        self.report.append(objectives[0])
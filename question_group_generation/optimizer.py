@@ -1,24 +1,37 @@
 import random
 import re
+from collections import Counter
 
-from geneticalgorithm import geneticalgorithm as ga
+import numpy as np
+from loguru import logger
 from transformers import AutoModel, AutoTokenizer
 
-from .scorer import CoverageScorer, PPLScorer, SimilarityScorer
+from .genetic import GeneticAlgorithm
+from .rouge import RougeLMatrix
+from .scorer import ContextIndex, CoverageScorer, PPLScorer, SimilarityScorer
+
+
+def run_to_end(generator):
+    """Exhaust `generator`, returns its return value"""
+    while True:
+        try:
+            next(generator)
+        except StopIteration as stop:
+            return stop.value
 
 
 class GAOptimizer:
     def __init__(
         self,
-        pplscorer_model: AutoModel,
-        pplscorer_tokenizer: AutoTokenizer,
         candicate_pool_size,
         target_question_qroup_size,
+        seed=None,
     ):
         """
         Args:
             candicate_pool_size: how many question in the candicate pool, refs to encoding size
             target_question_qroup_size: the questions number we execpt to pick
+            seed: seed of the GA random generator, for reproducible runs
         """
         if candicate_pool_size < target_question_qroup_size:
             raise ValueError(
@@ -31,78 +44,56 @@ class GAOptimizer:
         self.similarity_scorer = SimilarityScorer(
             metrics_to_omit=["CIDEr", "METEOR", "Bleu_1", "Bleu_2", "Bleu_3", "Bleu_4"]
         )
-        self.ppl_scorer = PPLScorer(pplscorer_model, pplscorer_tokenizer, use_sppl=True)
+        self.counters = Counter()
 
         self.candicate_pool_size = candicate_pool_size
-        self.model = ga(
-            function=self.fitness_function,
+        self.model = GeneticAlgorithm(
+            fitness_function=self.fitness_function,
             dimension=candicate_pool_size,
-            variable_type="bool",
-            convergence_curve=False,
-            algorithm_parameters={
-                "max_num_iteration": 40,
-                "population_size": 20,
-                "mutation_probability": 0.2,
-                "elit_ratio": 0.2,
-                "crossover_probability": 0.6,
-                "parents_portion": 0.5,
-                "crossover_type": "two_point",
-                "max_iteration_without_improv": 10,
-            },
+            max_num_iteration=40,
+            population_size=20,
+            mutation_probability=0.2,
+            elit_ratio=0.2,
+            crossover_probability=0.6,
+            parents_portion=0.5,
+            max_iteration_without_improv=10,
+            seed=seed,
         )
 
-    def fitness_function(self, genome):
-        # reset scorer
-        self.coverage_scorer.clean()
-        self.similarity_scorer.clean()
-        self.ppl_scorer.clean()
-
-        #
-        pick_questions = self.decode(genome)
+    def fitness_function(self, population):
+        """Score every genome (row) of the bool `population` matrix at once"""
+        population = np.asarray(population, dtype=bool)
+        self.counters["fitness_calls"] += 1
+        self.counters["genomes"] += len(population)
+        picks = population.astype(float)
+        count_pick = picks.sum(axis=1)
 
-        # question group keyword_coverage_score
-        self.coverage_scorer.add(pick_questions, self.context)
-        keyword_coverage_score = self.coverage_scorer.compute(return_score=True)[
-            "keyword_coverage"
-        ]
+        # question group keyword_coverage_score, a sentence is covered by a
+        # group if any question of the group covers it
+        keyword_coverage_score = np.zeros(len(population))
+        if self._covered_sents.shape[1] > 0:
+            keyword_coverage_score = (picks @ self._covered_sents > 0).sum(
+                axis=1
+            ) / self._covered_sents.shape[1]
 
         # question qroup classmate_similarity_score
-        if len(pick_questions) > 1:
-            for pick_question in pick_questions[:]:
-                classmate_questions = pick_questions[:]
-                classmate_questions.remove(pick_question)
-                self.similarity_scorer.add(hyp=pick_question, refs=classmate_questions)
-                self.ppl_scorer.add(pick_question)
-        similarity_score = self.similarity_scorer.compute(return_score=True)
-        ppl_score = self.ppl_scorer.compute(return_score=True)
-        classmate_similarity_score = similarity_score.get("ROUGE_L", 0.0)
-        scaled_ppl_score = ppl_score.get("scaled_ppl", 0.0)
+        classmate_similarity_score = self._rouge_l.classmate_similarity(population)
 
         # diversity_score
-        has_s_type = False
-        has_c_type = False
-        diversity_score = 0
-        for pick_question in pick_questions:
-            if re.search(re.escape("?") + "$", pick_question):
-                has_s_type = True
-            if re.search(re.escape("_"), pick_question):
-                has_c_type = True
-        if has_s_type and has_c_type:
-            diversity_score = 1
-        elif has_s_type or has_c_type:
-            diversity_score = 0.5
+        has_s_type = picks @ self._s_types > 0
+        has_c_type = picks @ self._c_types > 0
+        diversity_score = (has_s_type.astype(float) + has_c_type.astype(float)) / 2
 
+        # no scaled PPL term: the objective always read a "scaled_ppl" score
+        # `PPLScorer` never reports, so that term has always been 0
         score = (
-            keyword_coverage_score
-            + (1 - classmate_similarity_score)
-            + diversity_score
-            + scaled_ppl_score
+            keyword_coverage_score + (1 - classmate_similarity_score) + diversity_score
         )
 
         # punishment if count_pick not equal to question_group_size
-        count_pick = (genome == 1).sum()
         punish_weight = 1 - (
-            abs(self.target_question_qroup_size - count_pick) / self.candicate_pool_size
+            np.abs(self.target_question_qroup_size - count_pick)
+            / self.candicate_pool_size
         )
         return score * punish_weight * -1
 
@@ -114,19 +105,77 @@ class GAOptimizer:
                 pick_questions.append(self.condicate_questions[p_id][:])
         return pick_questions
 
+    def _precompute(self, condicate_questions, context):
+        """Compute everything a fitness evaluation needs per candidate only once"""
+        self.counters = Counter()
+        for scorer in (self.coverage_scorer, self.similarity_scorer):
+            scorer.calls.clear()
+
+        # context and candidates go through the tokenizer in one batch
+        preprocessed = self.coverage_scorer._preprocess_batch(
+            [context] + condicate_questions
+        )
+        preprocessed_context, preprocessed_questions = preprocessed[0], preprocessed[1:]
+
+        # which (preprocessed) context sentences each question covers a keyword of
+        context_index = ContextIndex(preprocessed_context)
+        self._covered_sents = np.zeros(
+            (len(condicate_questions), context_index.count_article_sent)
+        )
+        self._s_types = np.zeros(len(condicate_questions))
+        self._c_types = np.zeros(len(condicate_questions))
+        for p_id, question in enumerate(condicate_questions):
+            keywords = self.coverage_scorer._extract_keywords(
+                [preprocessed_questions[p_id]]
+            )
+            for sent_id in context_index.covered_sents(keywords):
+                self._covered_sents[p_id, sent_id] = 1
+            self._s_types[p_id] = re.search(re.escape("?") + "$", question) is not None
+            self._c_types[p_id] = re.search(re.escape("_"), question) is not None
+        # ROUGE-L of nlgeval, on the tokens of the preprocessed questions
+        self._rouge_l = RougeLMatrix(
+            self.similarity_scorer._preprocess_batch(condicate_questions)
+        )
+        self.counters["rouge_l_matrix"] += 1
+
+    def scorer_calls(self):
+        """Tokenizer and ROUGE-L invocations of the last optimization"""
+        calls = Counter()
+        for scorer in (self.coverage_scorer, self.similarity_scorer):
+            calls.update(scorer.calls)
+        calls["rouge_l_matrix"] = self.counters["rouge_l_matrix"]
+        return calls
+
     def optimize(self, condicate_questions, context, *args, **kwargs):
         """
         Args:
             condicate_questions: the condicate questions
             context: context that used to gen condicate questions
         """
+        return run_to_end(self.iter_optimize(condicate_questions, context))
+
+    def iter_optimize(self, condicate_questions, context):
+        """
+        Same as `optimize`, yield the generation number and best fitness so far
+        after every GA generation, returns the picked questions
+        """
         while len(condicate_questions) < self.candicate_pool_size:
             condicate_questions.append("")
             print("Warning!!: `len(condicate_questions) < self.candicate_pool_size`")
 
         self.context = context
         self.condicate_questions = condicate_questions
-        self.model.run()
+        self._precompute(condicate_questions, context)
+        for generation in self.model.iterate():
+            yield {
+                "generation": generation,
+                "best_fitness": float(-self.model.best_function),
+            }
+        logger.info(
+            f"GA fitness: {self.counters['fitness_calls']} calls, "
+            f"{self.counters['genomes']} genomes scored, "
+            f"scorer invocations: {dict(self.scorer_calls())}"
+        )
         return self.decode(self.model.best_variable)
 
 
@@ -167,7 +216,13 @@ class FirstNOptimizer:
 
 
 class GreedyOptimizer:
-    def __init__(self, candicate_pool_size, target_question_qroup_size):
+    def __init__(
+        self,
+        pplscorer_model: AutoModel,
+        pplscorer_tokenizer: AutoTokenizer,
+        candicate_pool_size,
+        target_question_qroup_size,
+    ):
         """
         Args:
             candicate_pool_size: how many question in the candicate pool, refs to encoding size
@@ -184,7 +239,7 @@ class GreedyOptimizer:
         self.similarity_scorer = SimilarityScorer(
             metrics_to_omit=["CIDEr", "METEOR", "Bleu_1", "Bleu_2", "Bleu_3", "Bleu_4"]
         )
-        self.ppl_scorer = PPLScorer(use_sppl=True)
+        self.ppl_scorer = PPLScorer(pplscorer_model, pplscorer_tokenizer, use_sppl=True)
 
     def optimize(self, condicate_questions, context, *args, **kwargs):
         """
@@ -193,7 +248,13 @@ class GreedyOptimizer:
             context: context that used to gen condicate questions
         """
         question_with_score = {}
-        for question in condicate_questions:
+        scaled_ppls = self.ppl_scorer._compute_scaled_ppls(condicate_questions)
+        rouge_l = RougeLMatrix(
+            self.similarity_scorer._preprocess_batch(condicate_questions)
+        )
+        for p_id, (question, scaled_ppl_score) in enumerate(
+            zip(condicate_questions, scaled_ppls)
+        ):
             # keyword_coverage
             self.coverage_scorer.clean()
             self.coverage_scorer.add([question], context)
@@ -202,16 +263,14 @@ class GreedyOptimizer:
             ]
 
             # classmate_similarity_score
-            self.similarity_scorer.clean()
-            classmate_questions = condicate_questions[:]
-            classmate_questions.remove(question)
-            if len(classmate_questions) > 1:
-                self.similarity_scorer.add(hyp=question, refs=classmate_questions)
-            classmate_similarity_score = self.similarity_scorer.compute(
-                return_score=True
-            ).get("ROUGE_L", 0.0)
-
-            scaled_ppl_score = self.ppl_scorer._compute_scaled_ppl(question)
+            classmate_ids = [
+                classmate_id
+                for classmate_id in range(len(condicate_questions))
+                if classmate_id != p_id
+            ]
+            classmate_similarity_score = 0.0
+            if len(classmate_ids) > 1:
+                classmate_similarity_score = rouge_l.score(p_id, classmate_ids)
 
             score = (
                 keyword_coverage_score
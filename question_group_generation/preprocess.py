@@ -0,0 +1,150 @@
+import re
+import threading
+from collections import Counter, OrderedDict
+
+from config import PREPROCESS_CACHE_SIZE, SCORER_TOKENIZER
+from loguru import logger
+
+from . import resources
+
+# Penn Treebank like tokens, close to what the stanza English tokenizer gives
+_TOKEN_RE = re.compile(
+    r"""
+    \w+(?=n't\b)                # do|n't
+    | n't\b
+    | '(?:s|re|ve|ll|d|m)\b     # 's 're 've 'll 'd 'm
+    | (?:[A-Za-z]\.){2,}        # U.S.
+    | \d+(?:[.,:]\d+)+\b        # 3.5 1,000 10:30
+    | \w+(?:-\w+)*              # e-mail
+    | \S
+    """,
+    re.VERBOSE | re.IGNORECASE,
+)
+
+
+def regex_tokenize(text):
+    return _TOKEN_RE.findall(text)
+
+
+class TokenCache:
+    """Bounded LRU of text to tokens, shared by every scorer, thread safe"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.store = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.store:
+                return None
+            self.store.move_to_end(key)
+            return self.store[key]
+
+    def set(self, key, value):
+        with self.lock:
+            self.store[key] = value
+            self.store.move_to_end(key)
+            while len(self.store) > self.max_size:
+                self.store.popitem(last=False)
+
+
+_cache = TokenCache(PREPROCESS_CACHE_SIZE)
+
+
+def _stanza_tokenize(text):
+    result = resources.get_tokenize_pipeline()(text)
+    try:
+        return [token.text for token in result.sentences[0].tokens]
+    except Exception as e:
+        logger.warning(e)
+        logger.warning(f"tokenize fail, text:{text} result:{result}")
+        return None
+
+
+def _stanza_tokenize_batch(texts):
+    """
+    Tokenize `texts` in one stanza document, one paragraph per text, falls
+    back to one call per text if the paragraphs do not line up
+    """
+    if len(texts) > 1 and all(text.strip() != "" for text in texts):
+        result = resources.get_tokenize_pipeline()("\n\n".join(texts))
+        if len(result.sentences) == len(texts):
+            return [
+                [token.text for token in sentence.tokens]
+                for sentence in result.sentences
+            ]
+        logger.warning(
+            f"stanza gave {len(result.sentences)} sentences for {len(texts)} texts, "
+            "tokenize them one by one"
+        )
+    return [_stanza_tokenize(text) for text in texts]
+
+
+def tokenize_batch(raw_sentences, tokenizer=None):
+    """
+    Tokens of every sentence, None if it could not be tokenized
+
+    Args:
+        tokenizer: "stanza" or "regex", defaults to `SCORER_TOKENIZER`
+    """
+    tokenizer = tokenizer or SCORER_TOKENIZER
+    texts = [raw_sentence.replace("\n\n", "") for raw_sentence in raw_sentences]
+    tokens = {}
+    missing = []
+    for text in texts:
+        if text in tokens:
+            continue
+        tokens[text] = _cache.get((tokenizer, text))
+        if tokens[text] is None:
+            missing.append(text)
+
+    if len(missing) > 0:
+        if tokenizer == "regex":
+            missing_tokens = [regex_tokenize(text) for text in missing]
+        else:
+            missing_tokens = _stanza_tokenize_batch(missing)
+        for text, text_tokens in zip(missing, missing_tokens):
+            tokens[text] = text_tokens
+            if text_tokens is not None:
+                _cache.set((tokenizer, text), text_tokens)
+    return [tokens[text] for text in texts]
+
+
+def agreement(sentences):
+    """How often the regex tokenizer agrees with stanza, per token and per sentence"""
+    stanza_tokens = tokenize_batch(sentences, tokenizer="stanza")
+    regex_tokens = tokenize_batch(sentences, tokenizer="regex")
+    same_sentences = 0
+    same_tokens = 0
+    total_tokens = 0
+    for expected, actual in zip(stanza_tokens, regex_tokens):
+        expected = expected or []
+        same_sentences += expected == actual
+        same_tokens += sum((Counter(expected) & Counter(actual)).values())
+        total_tokens += max(len(expected), len(actual))
+    return {
+        "sentences": same_sentences / max(len(sentences), 1),
+        "tokens": same_tokens / max(total_tokens, 1),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(
+        description="Agreement of the regex tokenizer with stanza"
+    )
+    parser.add_argument(
+        "file", help="text file, one sentence per line, or a json list of sentences"
+    )
+    args = parser.parse_args()
+
+    with open(args.file, "r", encoding="utf-8") as f:
+        content = f.read()
+    if args.file.endswith(".json"):
+        sentences = json.loads(content)
+    else:
+        sentences = [line for line in content.splitlines() if line.strip() != ""]
+    print(json.dumps(agreement(sentences), indent=2))
@@ -0,0 +1,100 @@
+import os
+import pathlib
+import threading
+import time
+from collections import Counter
+
+import stanza
+from config import SCORER_TOKENIZER
+from loguru import logger
+from nlgeval import NLGEval
+
+current_dir = pathlib.Path(__file__).parent.absolute()
+
+_lock = threading.Lock()
+_resources = {}
+construction_counts = Counter()
+construction_seconds = Counter()
+
+
+def _get_or_create(key, create):
+    """Create the resource `key` only once per process, thread safe"""
+    resource = _resources.get(key)
+    if resource is not None:
+        return resource
+    with _lock:
+        if key not in _resources:
+            start = time.perf_counter()
+            _resources[key] = create()
+            elapsed = time.perf_counter() - start
+            construction_counts[key[0]] += 1
+            construction_seconds[key[0]] += elapsed
+            logger.info(
+                f"Build shared {key[0]} in {elapsed:.2f}s "
+                f"({construction_counts[key[0]]} built so far)"
+            )
+        return _resources[key]
+
+
+class LockedPipeline:
+    """A stanza pipeline shared between threads, one call at a time"""
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        with self.lock:
+            return self.pipeline(*args, **kwargs)
+
+
+def get_nlgeval(metrics_to_omit=("CIDEr", "METEOR")):
+    metrics_to_omit = tuple(sorted(metrics_to_omit))
+    return _get_or_create(
+        ("nlgeval", metrics_to_omit),
+        lambda: NLGEval(
+            no_glove=True, no_skipthoughts=True, metrics_to_omit=list(metrics_to_omit)
+        ),
+    )
+
+
+def get_tokenize_pipeline():
+    return _get_or_create(
+        ("stanza",),
+        lambda: LockedPipeline(
+            stanza.Pipeline(
+                lang="en", processors="tokenize", tokenize_no_ssplit=True, verbose=False
+            )
+        ),
+    )
+
+
+def get_stop_words(file_name):
+    """Words of a stopwords file next to this module, as a tuple"""
+
+    def read():
+        with open(os.path.join(current_dir, file_name), "r", encoding="utf-8") as f:
+            return tuple(f.read().split())
+
+    return _get_or_create(("stopwords", file_name), read)
+
+
+def stats():
+    return {
+        name: {
+            "count": construction_counts[name],
+            "seconds": round(construction_seconds[name], 3),
+        }
+        for name in construction_counts
+    }
+
+
+def preload():
+    """Build every shared resource the scorers use, e.g. at server startup"""
+    get_nlgeval()
+    get_nlgeval(["CIDEr", "METEOR", "Bleu_1", "Bleu_2", "Bleu_3", "Bleu_4"])
+    if SCORER_TOKENIZER == "stanza":
+        get_tokenize_pipeline()
+    get_stop_words("stopwords-en.txt")
+    get_stop_words("stopwords-sign.txt")
+    logger.info(f"Shared scorer resources: {stats()}")
@@ -0,0 +1,83 @@
+import numpy as np
+
+# recall weight of the nlgeval (pycocoevalcap) ROUGE-L scorer
+BETA = 1.2
+
+
+def tokenize(sentence):
+    return sentence.strip().split(" ")
+
+
+def _pairwise_lcs(tokens):
+    """Length of the longest common subsequence of every pair of token lists"""
+    vocab = {}
+    max_len = max(len(sentence_tokens) for sentence_tokens in tokens)
+    # padding never matches, so it does not change any LCS
+    ids = np.full((len(tokens), max_len), -1)
+    for i, sentence_tokens in enumerate(tokens):
+        ids[i, : len(sentence_tokens)] = [
+            vocab.setdefault(token, len(vocab)) for token in sentence_tokens
+        ]
+    other_ids = np.where(ids < 0, -2, ids)
+
+    # row by row LCS table of all pairs at once, with
+    # lcs[k] = max(lcs[k - 1], prev[k], prev[k - 1] + 1 if tokens match)
+    prev = np.zeros((len(tokens), len(tokens), max_len + 1), dtype=int)
+    for step in range(max_len):
+        match = ids[:, None, step, None] == other_ids[None, :, :]
+        candidates = prev.copy()
+        candidates[..., 1:] = np.maximum(
+            prev[..., 1:], np.where(match, prev[..., :-1] + 1, 0)
+        )
+        prev = np.maximum.accumulate(candidates, axis=-1)
+    return prev[..., -1]
+
+
+class RougeLMatrix:
+    """
+    Pairwise ROUGE-L between sentences, `score` is the same as
+    `nlgeval.compute_individual_metrics(refs, hyp)["ROUGE_L"]`
+    """
+
+    def __init__(self, sentences):
+        tokens = [tokenize(sentence) for sentence in sentences]
+        lengths = np.array([len(sentence_tokens) for sentence_tokens in tokens])
+        lcs = _pairwise_lcs(tokens) if len(tokens) > 0 else np.zeros((0, 0))
+
+        # [ref, hyp]
+        self.precision = lcs / lengths[None, :]
+        self.recall = lcs / lengths[:, None]
+
+    @staticmethod
+    def _f_score(precision, recall):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            score = ((1 + BETA ** 2) * precision * recall) / (
+                recall + BETA ** 2 * precision
+            )
+        return np.where((precision != 0) & (recall != 0), score, 0.0)
+
+    def score(self, hyp, refs):
+        """ROUGE-L of sentence `hyp` against sentences `refs`, by index"""
+        return float(
+            self._f_score(self.precision[refs, hyp].max(), self.recall[refs, hyp].max())
+        )
+
+    def classmate_similarity(self, population):
+        """
+        Mean ROUGE-L of each picked sentence against the other picked ones, for
+        every row of the bool `population` matrix, 0 if less than 2 are picked
+        """
+        population = np.asarray(population, dtype=bool)
+        count_pick = population.sum(axis=1)
+
+        # is_ref[genome, ref, hyp]
+        is_ref = population[:, :, None] & population[:, None, :]
+        is_ref &= ~np.eye(population.shape[1], dtype=bool)
+        precision = np.where(is_ref, self.precision, 0.0).max(axis=1, initial=0.0)
+        recall = np.where(is_ref, self.recall, 0.0).max(axis=1, initial=0.0)
+        scores = np.where(population, self._f_score(precision, recall), 0.0)
+        # add up in pick order like the nlgeval scorer does, for the same floats
+        total = np.zeros(len(population))
+        for column in scores.T:
+            total += column
+        return np.where(count_pick > 1, total / np.maximum(count_pick, 1), 0.0)
@@ -1,16 +1,15 @@
 import os
-import pathlib
 import re
-from collections import defaultdict
+from collections import Counter, defaultdict
 from functools import lru_cache
 
-import stanza
 import torch
+import torch.nn.functional as F
 from loguru import logger
-from nlgeval import NLGEval
 from transformers import AutoModelForCausalLM, AutoTokenizer
+from utils.batching import pad_sequences
 
-current_dir = pathlib.Path(__file__).parent.absolute()
+from . import preprocess, resources
 
 
 def step_len(func):
@@ -25,42 +24,38 @@ def step_len(func):
 class Scorer:
     def __init__(self, preprocess=True, metrics_to_omit=["CIDEr", "METEOR"]):
         self.preprocess = preprocess
-        self.nlgeval = NLGEval(
-            no_glove=True, no_skipthoughts=True, metrics_to_omit=metrics_to_omit
-        )
+        self.nlgeval = resources.get_nlgeval(metrics_to_omit)
         self.score = defaultdict(lambda: 0.0)
         self.len = 0
-        if self.preprocess:
-            self.nlp = stanza.Pipeline(
-                lang="en", processors="tokenize", tokenize_no_ssplit=True, verbose=False
-            )
-
+        # invocations of the tokenizer and of the metrics
+        self.calls = Counter()
         #
-        self.stop_words_sign = (
-            open(os.path.join(current_dir, "stopwords-sign.txt"), "r", encoding="utf-8")
-            .read()
-            .split()
-        )
+        self.stop_words_sign = list(resources.get_stop_words("stopwords-sign.txt"))
         self.stop_words_sign_rule = "|".join(
             [re.escape(sign) for sign in self.stop_words_sign]
         )
 
-    @lru_cache(maxsize=200)
     def _preprocess(self, raw_sentence):
-        result = self.nlp(raw_sentence.replace("\n\n", ""))
-        tokens = []
-        try:
-            for token in result.sentences[0].tokens:
-                tokens.append(token.text.lower())
-            tokenize_sentence = " ".join(tokens)
+        return self._preprocess_batch([raw_sentence])[0]
+
+    def _preprocess_batch(self, raw_sentences):
+        """`_preprocess` every sentence, tokenized together in one batch"""
+        self.calls["tokenizer"] += 1
+        self.calls["tokenized_sentences"] += len(raw_sentences)
+        tokenize_sentences = []
+        for raw_sentence, tokens in zip(
+            raw_sentences, preprocess.tokenize_batch(raw_sentences)
+        ):
+            if tokens is None:
+                logger.warning(
+                    f'preprocess fail, return "" raw_sentence:{raw_sentence}'
+                )
+                tokenize_sentences.append("")
+                continue
+            tokenize_sentence = " ".join(token.lower() for token in tokens)
             tokenize_sentence = re.sub(self.stop_words_sign_rule, "", tokenize_sentence)
-        except Exception as e:
-            logger.warning(e)
-            logger.warning(
-                f'preprocess fail, return "" raw_sentence:{raw_sentence} result:{result}'
-            )
-            return ""
-        return tokenize_sentence
+            tokenize_sentences.append(tokenize_sentence)
+        return tokenize_sentences
 
     def clean(self):
         self.score = defaultdict(lambda: 0.0)
@@ -100,30 +95,62 @@ class SimilarityScorer(Scorer):
         if self.preprocess:
             hyp = self._preprocess(hyp)
             refs = [self._preprocess(ref) for ref in refs]
+        self._add_score(hyp, refs)
+
+    @step_len
+    def add_preprocessed(self, hyp, refs):
+        """Same as `add`, for `hyp` and `refs` already run through `_preprocess`"""
+        self._add_score(hyp, refs)
+
+    def _add_score(self, hyp, refs):
+        self.calls["nlgeval"] += 1
         _score = self.nlgeval.compute_individual_metrics(hyp=hyp, ref=refs)
         for score_key in _score.keys():
             self.score[score_key] += _score[score_key]
 
 
+class ContextIndex:
+    """
+    Article split into sentences once, with an inverted index from lowercased
+    word to the ids of the sentences containing it
+    """
+
+    def __init__(self, article: str):
+        article_sent_list = re.split(r",|\.|\!|\?", article)
+        self.count_article_sent = len(article_sent_list)
+        self.postings = defaultdict(set)
+        for sent_id, article_sent in enumerate(article_sent_list):
+            for word in article_sent.lower().split():
+                self.postings[word].add(sent_id)
+
+    def covered_sents(self, keyword_list):
+        """Ids of the sentences containing any of the keywords"""
+        covered = set()
+        for keyword in set(keyword_list):
+            covered.update(self.postings.get(keyword, ()))
+        return covered
+
+    def coverage(self, keyword_list):
+        if self.count_article_sent == 0:
+            return 0.0
+        return len(self.covered_sents(keyword_list)) / self.count_article_sent
+
+
+@lru_cache(maxsize=64)
+def get_context_index(article: str):
+    return ContextIndex(article)
+
+
 class CoverageScorer(Scorer):
     def __init__(self, preprocess=True):
         super().__init__(preprocess=preprocess)
-        self.stop_words_en = open(
-            os.path.join(current_dir, "stopwords-en.txt"), "r", encoding="utf-8"
-        )
-        self.stop_words_sign = open(
-            os.path.join(current_dir, "stopwords-sign.txt"), "r", encoding="utf-8"
-        )
-        self.stop_words = (
-            self.stop_words_en.read().split() + self.stop_words_sign.read().split()
+        self.stop_words = frozenset(
+            resources.get_stop_words("stopwords-en.txt")
+            + resources.get_stop_words("stopwords-sign.txt")
         )
 
         # some sign used to split context to sentence, remove them from `stopwords-sign`
-        self.stop_words_sign = (
-            open(os.path.join(current_dir, "stopwords-sign.txt"), "r", encoding="utf-8")
-            .read()
-            .split()
-        )
+        self.stop_words_sign = list(resources.get_stop_words("stopwords-sign.txt"))
         self.stop_words_sign.remove(",")
         self.stop_words_sign.remove(".")
         self.stop_words_sign.remove("!")
@@ -132,7 +159,10 @@ class CoverageScorer(Scorer):
             [re.escape(sign) for sign in self.stop_words_sign]
         )
 
-    def _compute_coverage_score(self, sents: list, article: str):
+    def _compute_coverage_score(self, sents: list, article):
+        return self._compute_keyword_coverage(self._extract_keywords(sents), article)
+
+    def _extract_keywords(self, sents: list):
         sent = " ".join(sents)
         sent_list = re.split(r",|\.|\!|\?", sent)
         for sent in sent_list[:]:
@@ -147,22 +177,16 @@ class CoverageScorer(Scorer):
             for word in word_list:
                 if word not in self.stop_words:
                     keyword_list.append(word)
+        return keyword_list
 
-        # process acticle into words and compute coverage
-        article_sent_list = re.split(r",|\.|\!|\?", article)
-
-        count_article_sent = len(article_sent_list)
-        if count_article_sent == 0:
-            return 0.0
-
-        count_coverage = 0
-        for article_sent in article_sent_list:
-            article_sent = article_sent.lower().split()
-            for keyword in keyword_list:
-                if keyword in article_sent:
-                    count_coverage += 1
-                    break
-        return count_coverage / count_article_sent
+    def _compute_keyword_coverage(self, keyword_list, article):
+        """
+        Args:
+            article: the article or its `ContextIndex`
+        """
+        if not isinstance(article, ContextIndex):
+            article = get_context_index(article)
+        return article.coverage(keyword_list)
 
     @step_len
     def add(self, sents: list, article: str):
@@ -185,6 +209,7 @@ class PPLScorer(Scorer):
         #
         self.score = defaultdict(lambda: 0.0)
         self.len = 0
+        self.calls = Counter()
 
     @step_len
     def add(self, sentence):
@@ -198,17 +223,69 @@ class PPLScorer(Scorer):
         avg_ll = self._compute_avg_log_likelihood(sentence)
         return torch.exp(-avg_ll * alpha).item()
 
+    def _compute_scaled_ppls(self, sentences: list, alpha=0.2):
+        """Batched `_compute_scaled_ppl`"""
+        return [
+            torch.exp(-avg_ll * alpha).item()
+            for avg_ll in self._compute_avg_log_likelihoods(sentences)
+        ]
+
     def _compute_ppl(self, sentence):
         # https://huggingface.co/transformers/perplexity.html
         avg_ll = self._compute_avg_log_likelihood(sentence)
         return torch.exp(avg_ll).item()
 
+    def _compute_avg_log_likelihoods(self, sentences: list, batch_size=16):
+        """
+        Batched `_compute_avg_log_likelihood`, sentences are scored in padded
+        forward passes with per-sequence masked loss
+        """
+        avg_lls = [None] * len(sentences)
+        batch_ids = []
+        for i, input_ids in enumerate(self.tokenizer(sentences)["input_ids"]):
+            # nothing to predict, or needs the stride loop
+            if len(input_ids) < 2 or len(input_ids) > self.max_length:
+                avg_lls[i] = self._compute_avg_log_likelihood(sentences[i])
+            else:
+                batch_ids.append((i, input_ids))
+
+        # group similar lengths together to waste less on padding
+        batch_ids.sort(key=lambda x: len(x[1]))
+        pad_token_id = self.tokenizer.pad_token_id
+        if pad_token_id is None:
+            pad_token_id = self.tokenizer.eos_token_id
+        for start in range(0, len(batch_ids), batch_size):
+            batch = batch_ids[start : start + batch_size]
+            input_ids, attention_mask = pad_sequences(
+                [input_ids for _, input_ids in batch], pad_token_id
+            )
+            input_ids = input_ids.to(self.model.device)
+            attention_mask = attention_mask.to(self.model.device)
+            self.calls["ppl_forward"] += 1
+            with torch.no_grad():
+                logits = self.model(
+                    input_ids, attention_mask=attention_mask
+                ).logits.float()
+
+            # same shift as the model's own loss, mask out padding
+            losses = F.cross_entropy(
+                logits[:, :-1].transpose(1, 2), input_ids[:, 1:], reduction="none"
+            )
+            target_mask = attention_mask[:, 1:].to(losses.dtype)
+            batch_avg_lls = (losses * target_mask).sum(-1) / target_mask.sum(-1)
+            for (i, _), avg_ll in zip(batch, batch_avg_lls.cpu()):
+                avg_lls[i] = avg_ll
+        return avg_lls
+
     @lru_cache(maxsize=200)
     def _compute_avg_log_likelihood(self, sentence):
         stride = self.stride
         max_length = self.max_length
         encodings = self.tokenizer(sentence, return_tensors="pt")
         model = self.model
+        if encodings.input_ids.size(1) < 2:
+            # nothing to predict, scaled ppl of such sentence is 0
+            return torch.tensor(float("inf"))
 
         lls = []
         for i in range(0, encodings.input_ids.size(1), stride):
@@ -219,9 +296,10 @@ class PPLScorer(Scorer):
             target_ids = input_ids.clone()
             target_ids[:, :-trg_len] = -100
 
+            self.calls["ppl_forward"] += 1
             with torch.no_grad():
                 outputs = model(input_ids, labels=target_ids)
-                log_likelihood = outputs[0] * trg_len
+                log_likelihood = outputs[0].float() * trg_len
 
             lls.append(log_likelihood)
         return torch.stack(lls).sum() / end_loc
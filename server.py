@@ -1,11 +1,27 @@
-import json
 import os
 from typing import List
 
-from fastapi import BackgroundTasks, Body, FastAPI
+from fastapi import Body, FastAPI, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, RedirectResponse
-
+from fastapi.responses import RedirectResponse, StreamingResponse
+from loguru import logger
+
+from config import (
+    DOCX_RENDER_QUEUE_TIMEOUT,
+    DOCX_RENDER_WORKERS,
+    INFERENCE_POOLS,
+    INFERENCE_TORCH_THREADS,
+    JOB_CONCURRENCY,
+    JOB_QUEUE_MAX_SIZE,
+    JOB_RESULT_TTL,
+    JOB_STORE_PATH,
+    LAZY_MODEL_LOADING,
+    RESULT_CACHE_DISK_MAX_BYTES,
+    RESULT_CACHE_MAX_BYTES,
+    RESULT_CACHE_PATH,
+    RESULT_CACHE_TTL,
+)
 from data.model import (
     DisItem,
     DistractorOrder,
@@ -14,19 +30,83 @@ from data.model import (
     ExportSet,
     FMGItem,
     GenerationOrder,
+    QGBatchItem,
     QGItem,
 )
 from distractor_group_generation import generate as generate_dgg_en_us
 from language_model import LanguageModels
 from phishing_email_generation import generate as generate_fm_en_us
 from question_generation.en_us import generate as generate_qg_en_us
+from question_generation.en_us import generate_batch as generate_qg_batch_en_us
 from question_generation.zh_tw import generate as generate_qg_zh_tw
 from question_group_generation import generate as generate_qgg_en_us
-from utils import delete_later, export_file, load_examples
+from question_group_generation import generate_events as generate_qgg_events_en_us
+from question_group_generation import resources as scorer_resources
+from utils import (
+    InferenceExecutor,
+    ResultCache,
+    export_file,
+    load_examples,
+)
+from utils.export import DocxRenderer, RenderQueueTimeout
+from utils.inference import stream_ndjson
+from utils.jobs import JobQueue, JobStore, submit_job
 
 # Initialize Language Models
 models = LanguageModels()
 
+# Build shared scorer resources (NLGEval, stanza pipeline, stopwords) up front
+if not LAZY_MODEL_LOADING:
+    scorer_resources.preload()
+
+# Initialize inference worker pools, keep blocking inference off the event loop
+executor = InferenceExecutor(INFERENCE_POOLS, INFERENCE_TORCH_THREADS)
+
+# Initialize generation result cache
+result_cache = ResultCache(
+    RESULT_CACHE_MAX_BYTES,
+    ttl=RESULT_CACHE_TTL,
+    disk_path=RESULT_CACHE_PATH or None,
+    disk_max_bytes=RESULT_CACHE_DISK_MAX_BYTES,
+)
+
+
+def run_question_group(order: GenerationOrder):
+    with models.hold("qgg_en"):
+        return generate_qgg_en_us(
+            model=models.qgg_en_model,
+            tokenizer=models.qgg_en_tokenizer,
+            order=order,
+        )
+
+
+def run_group_distractor(order: DistractorOrder):
+    with models.hold("dis_en"):
+        return generate_dgg_en_us(model=models.dis_en_model, order=order)
+
+
+# Initialize job queue of long running generations
+job_queue = JobQueue(
+    JobStore(JOB_STORE_PATH),
+    executor,
+    {
+        "generate-question-group/en-US": (
+            "qgg",
+            lambda payload: run_question_group(GenerationOrder.parse_obj(payload)),
+        ),
+        "generate-group-distractor/en-US": (
+            "dis",
+            lambda payload: run_group_distractor(DistractorOrder.parse_obj(payload)),
+        ),
+    },
+    concurrency=JOB_CONCURRENCY,
+    max_queued=JOB_QUEUE_MAX_SIZE,
+    result_ttl=JOB_RESULT_TTL,
+)
+
+# Render DOCX exports on their own processes, CPU bound and unrelated to inference
+docx_renderer = DocxRenderer(DOCX_RENDER_WORKERS, DOCX_RENDER_QUEUE_TIMEOUT)
+
 # Initialize example data
 examples = load_examples()
 
@@ -46,23 +126,75 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+async def start_job_queue():
+    await job_queue.start()
+
+
+@app.on_event("shutdown")
+def shutdown_executor():
+    job_queue.stop()
+    executor.shutdown(wait=False)
+    docx_renderer.shutdown()
+
+
 @app.get("/")
 async def root():
     return RedirectResponse("docs")
 
 
+@app.get("/status/models")
+async def model_status():
+    return models.stats()
+
+
+@app.get("/status/cache")
+async def cache_status():
+    return result_cache.stats()
+
+
+@app.get("/status/jobs")
+async def job_status():
+    return job_queue.stats()
+
+
+@app.get("/status/exports")
+async def export_status():
+    return docx_renderer.stats()
+
+
+async def run_cached(route, aliases, payload, use_cache, pool, func):
+    """Run `func` on inference pool `pool`, serve repeated requests from the cache"""
+    if not use_cache:
+        return await executor.run(pool, func)
+    key = result_cache.make_key(
+        route, jsonable_encoder(payload), models.version(*aliases)
+    )
+    result = await result_cache.aget(key)
+    if result is None:
+        result = jsonable_encoder(await executor.run(pool, func))
+        await result_cache.aset(key, result)
+    return result
+
+
 @app.post("/export-qa-pairs/{format}")
 async def export_qa_pairs(
     format: str,
-    background_tasks: BackgroundTasks,
     qa_pairs: List[ExportSet] = Body(None, examples=examples.get("export-qa-pairs")),
 ):
-    file_path = export_file(qa_pairs, format)
-    background_tasks.add_task(delete_later, file_path)
-    return FileResponse(
-        file_path,
-        filename=file_path.name,
-        headers={"Access-Control-Expose-Headers": "Content-Disposition"},
+    chunks, media_type, filename = export_file(qa_pairs, format)
+    if format.lower() == "docx":
+        try:
+            chunks = iter([await docx_renderer.render(qa_pairs)])
+        except RenderQueueTimeout as e:
+            raise HTTPException(status_code=503, detail=f"Export is busy: {e}")
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "Access-Control-Expose-Headers": "Content-Disposition",
+        },
     )
 
 
@@ -74,18 +206,48 @@ async def export_qa_pairs(
 @app.post("/en-US/generate-question")
 async def generate_en_question(
     item: QGItem = Body(None, examples=examples.get("generate-question/en-US")),
+    use_cache: bool = True,
+):
+    def _generate():
+        with models.hold("qg_en"):
+            return generate_qg_en_us(
+                model=models.qg_en_model, tokenizer=models.qg_en_tokenizer, item=item
+            )
+
+    return await run_cached(
+        "generate-question/en-US", ["qg_en"], item, use_cache, "qg_en", _generate
+    )
+
+
+@app.post("/en-US/generate-questions")
+async def generate_en_questions(
+    item: QGBatchItem = Body(None, examples=examples.get("generate-questions/en-US")),
+    use_cache: bool = True,
 ):
-    return generate_qg_en_us(
-        model=models.qg_en_model, tokenizer=models.qg_en_tokenizer, item=item
+    def _generate():
+        with models.hold("qg_en"):
+            return generate_qg_batch_en_us(
+                model=models.qg_en_model, tokenizer=models.qg_en_tokenizer, item=item
+            )
+
+    return await run_cached(
+        "generate-questions/en-US", ["qg_en"], item, use_cache, "qg_en", _generate
     )
 
 
 @app.post("/zh-TW/generate-question")
 async def generate_zh_question(
     item: QGItem = Body(None, examples=examples.get("generate-question/zh-TW")),
+    use_cache: bool = True,
 ):
-    return generate_qg_zh_tw(
-        model=models.qg_zh_model, tokenizer=models.qg_zh_tokenizer, item=item
+    def _generate():
+        with models.hold("qg_zh"):
+            return generate_qg_zh_tw(
+                model=models.qg_zh_model, tokenizer=models.qg_zh_tokenizer, item=item
+            )
+
+    return await run_cached(
+        "generate-question/zh-TW", ["qg_zh"], item, use_cache, "qg", _generate
     )
 
 
@@ -98,14 +260,26 @@ async def generate_zh_question(
 async def generate_en_distractor(
     item: DisItem = Body(None, examples=examples.get("generate-distractor/en-US")),
     strategy: DistractorSelectionStrategry = DistractorSelectionStrategry.RL,
+    use_cache: bool = True,
 ):
+    def _generate():
+        with models.hold("dis_en"):
+            return models.dis_en_model.generate_distractor(
+                item.article,
+                item.question,
+                item.answer,
+                item.gen_quantity,
+                strategy,
+            )
+
     if strategy is DistractorSelectionStrategry.RL:
-        decodes = models.dis_en_model.generate_distractor(
-            item.article,
-            item.question,
-            json.dumps(item.answer.dict()),
-            item.gen_quantity,
-            strategy,
+        decodes = await run_cached(
+            "generate-distractor/en-US",
+            ["dis_en"],
+            {"item": item, "strategy": strategy},
+            use_cache,
+            "dis",
+            _generate,
         )
         return Distractors(distractors=decodes)
     elif strategy is DistractorSelectionStrategry.GA:
@@ -128,23 +302,56 @@ async def generate(
     order: GenerationOrder = Body(
         None, examples=examples.get("generate-question-group/en-US")
     ),
+    use_cache: bool = True,
 ):
-    return generate_qgg_en_us(
-        model=models.qgg_en_model,
-        tokenizer=models.qgg_en_tokenizer,
-        pplscorer_model=models.pplscorer_model,
-        pplscorer_tokenizer=models.pplscorer_tokenizer,
-        order=order,
+    return await run_cached(
+        "generate-question-group/en-US",
+        ["qgg_en"],
+        order,
+        use_cache,
+        "qgg",
+        lambda: run_question_group(order),
     )
 
 
+@app.post("/en-US/generate-question-group/stream")
+async def generate_stream(
+    request: Request,
+    order: GenerationOrder = Body(
+        None, examples=examples.get("generate-question-group/en-US")
+    ),
+):
+    """
+    Stream question group generation as NDJSON events: `candidates` of every
+    context window, GA `progress`, then the `result` (or an `error`)
+    """
+
+    def _events():
+        with models.hold("qgg_en"):
+            yield from generate_qgg_events_en_us(
+                model=models.qgg_en_model,
+                tokenizer=models.qgg_en_tokenizer,
+                order=order,
+            )
+
+    return stream_ndjson(executor, request, "qgg", _events())
+
+
 @app.post("/en-US/generate-group-distractor")
 async def generate_en_group_distractors(
     order: DistractorOrder = Body(
         None, examples=examples.get("generate-group-distractor/en-US")
     ),
+    use_cache: bool = True,
 ):
-    return generate_dgg_en_us(model=models.dis_en_model, order=order)
+    return await run_cached(
+        "generate-group-distractor/en-US",
+        ["dis_en"],
+        order,
+        use_cache,
+        "dis",
+        lambda: run_group_distractor(order),
+    )
 
 
 #
@@ -153,7 +360,48 @@ async def generate_en_group_distractors(
 
 
 @app.post("/en-US/generate-phishing-email")
-async def generate_en_phishing_email(item: FMGItem):
-    return generate_fm_en_us(
-        model=models.fm_en_model, tokenizer=models.fm_en_tokenizer, item=item
+async def generate_en_phishing_email(item: FMGItem, use_cache: bool = True):
+    def _generate():
+        with models.hold("fm_en"):
+            return generate_fm_en_us(
+                model=models.fm_en_model, tokenizer=models.fm_en_tokenizer, item=item
+            )
+
+    return await run_cached(
+        "generate-phishing-email/en-US", ["fm_en"], item, use_cache, "fm", _generate
     )
+
+
+#
+# JOBS
+#
+
+
+@app.post("/jobs/en-US/generate-question-group", status_code=202)
+async def submit_question_group_job(
+    order: GenerationOrder = Body(
+        None, examples=examples.get("generate-question-group/en-US")
+    ),
+    priority: int = 0,
+):
+    return await submit_job(job_queue, "generate-question-group/en-US", order, priority)
+
+
+@app.post("/jobs/en-US/generate-group-distractor", status_code=202)
+async def submit_group_distractor_job(
+    order: DistractorOrder = Body(
+        None, examples=examples.get("generate-group-distractor/en-US")
+    ),
+    priority: int = 0,
+):
+    return await submit_job(
+        job_queue, "generate-group-distractor/en-US", order, priority
+    )
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await job_queue.store.call(job_queue.store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
@@ -0,0 +1,76 @@
+import threading
+
+import torch
+
+from utils.batching import MicroBatcher, pad_sequences
+from utils.inference import set_torch_threads
+
+
+class EchoModel:
+    """Returns its inputs, records the torch threads it generates with"""
+
+    class config:
+        is_encoder_decoder = True
+        pad_token_id = 0
+        eos_token_id = 2
+
+    device = torch.device("cpu")
+
+    def __init__(self):
+        self.num_threads = []
+
+    def generate(self, input_ids, attention_mask=None, **kwargs):
+        self.num_threads.append(torch.get_num_threads())
+        return input_ids
+
+
+def test_pad_sequences():
+    input_ids, attention_mask = pad_sequences([[5, 6, 7], [8]], 0)
+    assert input_ids.tolist() == [[5, 6, 7], [8, 0, 0]]
+    assert attention_mask.tolist() == [[1, 1, 1], [1, 0, 0]]
+    input_ids, _ = pad_sequences([[5, 6, 7], [8]], 0, padding_side="left")
+    assert input_ids.tolist() == [[5, 6, 7], [0, 0, 8]]
+
+
+def test_batched_outputs_go_back_to_their_callers():
+    model = EchoModel()
+    batcher = MicroBatcher(model, max_batch_size=8, max_wait_ms=50)
+    results = {}
+
+    def call(i):
+        results[i] = batcher.generate(torch.LongTensor([[i + 3] * (i + 1)])).tolist()
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    batcher.close()
+
+    for i in range(4):
+        assert results[i][0][: i + 1] == [i + 3] * (i + 1)
+    assert len(model.num_threads) < 4
+
+
+def test_batcher_generates_with_torch_threads_of_its_caller():
+    model = EchoModel()
+    batcher = MicroBatcher(model, max_batch_size=8, max_wait_ms=1)
+    num_threads = torch.get_num_threads()
+
+    def call():
+        # an inference pool thread with its own count
+        set_torch_threads(2)
+        # while another pool's thread sets another one
+        other = threading.Thread(target=torch.set_num_threads, args=(5,))
+        other.start()
+        other.join()
+        batcher.generate(torch.LongTensor([[5, 6]]))
+
+    try:
+        thread = threading.Thread(target=call)
+        thread.start()
+        thread.join()
+    finally:
+        torch.set_num_threads(num_threads)
+        batcher.close()
+    assert model.num_threads == [2]
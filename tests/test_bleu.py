@@ -0,0 +1,62 @@
+import math
+from collections import Counter
+from pathlib import Path
+
+import pytest
+
+# distractor_generation imports the question group scorers
+pytest.importorskip("nlgeval")
+
+from distractor_generation.bleu import Bleu1Matrix, tokenize  # noqa: E402
+
+OPTIONS = (Path(__file__).parent / "fixtures" / "options.txt").read_text().splitlines()
+
+
+def reference_bleu_1(ref, hyp):
+    """BLEU-1 of one hypothesis and one reference, as computed by pycocoevalcap"""
+    ref_tokens, hyp_tokens = ref.split(), hyp.split()
+    ref_counts = Counter(ref_tokens)
+    correct = sum(min(count, ref_counts[w]) for w, count in Counter(hyp_tokens).items())
+    bleu = (correct + 1e-15) / (len(hyp_tokens) + 1e-9)
+    ratio = (len(hyp_tokens) + 1e-15) / (len(ref_tokens) + 1e-9)
+    if ratio < 1:
+        bleu *= math.exp(1 - 1 / ratio)
+    return bleu
+
+
+def nlgeval_input(sentence):
+    # how `_selection_with_rl` fed options to nlgeval
+    return " ".join(tokenize(sentence)).strip()
+
+
+def test_matches_pycocoevalcap_formula():
+    bleu_1 = Bleu1Matrix(OPTIONS)
+    for ref in OPTIONS:
+        for hyp in OPTIONS:
+            expected = reference_bleu_1(nlgeval_input(ref), nlgeval_input(hyp))
+            assert bleu_1(ref, hyp) == pytest.approx(expected, rel=1e-9, abs=1e-12)
+
+
+def test_matches_pycocoevalcap():
+    bleu = pytest.importorskip("pycocoevalcap.bleu.bleu")
+    bleu_1 = Bleu1Matrix(OPTIONS)
+    for ref in OPTIONS[::3]:
+        for hyp in OPTIONS:
+            scores, _ = bleu.Bleu(4).compute_score(
+                {0: [nlgeval_input(ref)]}, {0: [nlgeval_input(hyp)]}
+            )
+            assert bleu_1(ref, hyp) == pytest.approx(scores[0], rel=1e-9, abs=1e-12)
+
+
+def test_same_threshold_decisions():
+    bleu_1 = Bleu1Matrix(OPTIONS)
+    for ref in OPTIONS:
+        for hyp in OPTIONS:
+            expected = reference_bleu_1(nlgeval_input(ref), nlgeval_input(hyp)) > 0.60
+            assert (bleu_1(ref, hyp) > 0.60) == expected
+
+
+def test_duplicates_share_an_index():
+    bleu_1 = Bleu1Matrix(["Harry Potter", "Ron Weasley", "Harry Potter"])
+    assert len(bleu_1.index) == 2
+    assert bleu_1.matrix.shape == (2, 2)
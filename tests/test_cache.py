@@ -0,0 +1,70 @@
+import asyncio
+import threading
+import time
+
+from utils.cache import ResultCache
+
+
+def test_lru_bounded_in_bytes():
+    cache = ResultCache(max_bytes=30)
+    cache.set("a", "x" * 10)
+    cache.set("b", "y" * 10)
+    assert cache.get("a") == "x" * 10
+    # "b" is the least recently used
+    cache.set("c", "z" * 10)
+    assert cache.get("b") is None
+    assert cache.get("a") == "x" * 10
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+
+
+def test_ttl(monkeypatch):
+    cache = ResultCache(max_bytes=1024, ttl=10)
+    cache.set("a", [1, 2])
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 11)
+    assert cache.get("a") is None
+
+
+def test_results_survive_restarts(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    ResultCache(max_bytes=1024, disk_path=path).set("a", {"question": "Who?"})
+    cache = ResultCache(max_bytes=1024, disk_path=path)
+    assert cache.get("a") == {"question": "Who?"}
+    mode = cache._db.execute("PRAGMA journal_mode").fetchone()[0]
+    assert mode == "wal"
+
+
+def test_disk_lookups_run_off_the_event_loop(tmp_path):
+    cache = ResultCache(max_bytes=1024, disk_path=str(tmp_path / "cache.sqlite3"))
+    cache.set("a", "answer")
+    cache._entries.clear()
+
+    async def scenario():
+        # the on-disk store is busy, e.g. another worker process writing
+        with cache._db_lock:
+            lookup = asyncio.ensure_future(cache.aget("a"))
+            lags = []
+            for _ in range(20):
+                start = time.perf_counter()
+                await asyncio.sleep(0.01)
+                lags.append(time.perf_counter() - start - 0.01)
+            assert not lookup.done()
+        return lags, await lookup
+
+    lags, result = asyncio.run(scenario())
+    assert result == "answer"
+    assert max(lags) < 0.1
+
+
+def test_memory_hits_do_not_wait_for_the_disk(tmp_path):
+    cache = ResultCache(max_bytes=1024, disk_path=str(tmp_path / "cache.sqlite3"))
+    cache.set("a", "answer")
+    with cache._db_lock:
+        thread = threading.Thread(target=cache.set, args=("b", "other"))
+        thread.start()
+        start = time.perf_counter()
+        assert asyncio.run(cache.aget("a")) == "answer"
+        assert time.perf_counter() - start < 0.1
+    thread.join()
+    assert cache.get("b") == "other"
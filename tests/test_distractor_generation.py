@@ -0,0 +1,100 @@
+import asyncio
+import threading
+
+import pytest
+import torch
+
+# distractor_generation imports the question group scorers
+pytest.importorskip("nlgeval")
+
+from distractor_generation import BartDistractorGeneration  # noqa: E402
+from utils import inference  # noqa: E402
+from utils.batching import MicroBatcher  # noqa: E402
+from utils.inference import InferenceExecutor  # noqa: E402
+
+
+class FakeTokenizer:
+    pad_token_id = 0
+
+    def batch_decode(self, outputs, skip_special_tokens=True):
+        return [f"option {int(output[0])}" for output in outputs]
+
+
+class FakeModel:
+    class config:
+        is_encoder_decoder = True
+        pad_token_id = 0
+        eos_token_id = 2
+
+    device = torch.device("cpu")
+
+    def __init__(self):
+        self.calls = []
+
+    def eval(self):
+        return self
+
+    def generate(self, input_ids, num_return_sequences, **kwargs):
+        self.calls.append((threading.current_thread().name, torch.get_num_threads()))
+        return input_ids[:, :1].repeat_interleave(num_return_sequences, dim=0)
+
+
+def build(dg_models):
+    return BartDistractorGeneration(
+        dg_models=dg_models,
+        dg_tokenizer=[FakeTokenizer() for _ in dg_models],
+        dg_selection_models=FakeModel(),
+        dg_selection_tokenizer=None,
+    )
+
+
+def test_models_generate_on_their_own_threads(monkeypatch):
+    monkeypatch.setattr("distractor_generation.DG_TORCH_THREADS", 2)
+    models = [FakeModel() for _ in range(3)]
+    # a micro-batcher in front of a model must not move its work to another thread
+    dg = build([models[0], MicroBatcher(models[1]), models[2]])
+    try:
+        options = dg._generate_options_batch(lambda tokenizer: [[7, 8], [9]], 1)
+    finally:
+        dg.close()
+
+    assert options == [[["option 7"] * 2] * 3, [["option 9"] * 2] * 3]
+    for model in models:
+        ((thread_name, num_threads),) = model.calls
+        assert thread_name.startswith("dg")
+        assert num_threads == 2
+
+
+@pytest.fixture
+def restore_torch_threads():
+    num_threads = torch.get_num_threads()
+    yield
+    inference.set_default_torch_threads(num_threads)
+    inference._default_torch_threads = None
+
+
+def test_models_split_the_threads_of_the_worker(restore_torch_threads):
+    # built before fork, e.g. in the gunicorn master with every core
+    torch.set_num_threads(12)
+    models = [FakeModel() for _ in range(3)]
+    dg = build(models)
+    # the worker's share after fork, and a pool with its own count
+    inference.set_default_torch_threads(6)
+    executor = InferenceExecutor({"dis": 1, "dis_own": 1}, {"dis_own": 9})
+    generate = lambda: dg._generate_options_batch(lambda tokenizer: [[7]], 1)
+    try:
+        asyncio.run(executor.run("dis", generate))
+        asyncio.run(executor.run("dis_own", generate))
+    finally:
+        executor.shutdown()
+        dg.close()
+
+    for model in models:
+        assert [num_threads for _, num_threads in model.calls] == [2, 3]
+
+
+def test_close_stops_the_threads():
+    dg = build([FakeModel()])
+    dg.close()
+    with pytest.raises(RuntimeError):
+        dg._generate_options_batch(lambda tokenizer: [[7]], 1)
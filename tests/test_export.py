@@ -0,0 +1,67 @@
+import asyncio
+import io
+import subprocess
+import sys
+
+import docx
+import pytest
+
+from data.model import ExportSet
+from utils.export import DocxRenderer, RenderQueueTimeout, export_file, render_docx
+
+QUESTION_SETS = [
+    ExportSet.parse_obj(
+        {
+            "context": "Harry Potter is a series of seven fantasy novels.",
+            "question_pairs": [
+                {
+                    "question": "How many novels are in the series?",
+                    "options": [
+                        {"text": "seven", "is_answer": True},
+                        {"text": "five", "is_answer": False},
+                    ],
+                }
+            ],
+        }
+    )
+]
+
+
+def paragraphs(content):
+    return [p.text for p in docx.Document(io.BytesIO(content)).paragraphs]
+
+
+def test_render_workers_do_not_import_torch():
+    # what a spawned render worker imports to unpickle `render_docx`
+    code = "import sys, docx_render; print('torch' in sys.modules)"
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout
+    assert output.strip() == "False"
+    assert render_docx.__module__ == "docx_render"
+
+
+def test_renderer_same_document_as_export_file():
+    chunks, _, _ = export_file(QUESTION_SETS, "docx")
+    renderer = DocxRenderer(max_concurrency=1)
+    try:
+        content = asyncio.run(renderer.render(QUESTION_SETS))
+    finally:
+        renderer.shutdown()
+    assert paragraphs(content) == paragraphs(b"".join(chunks))
+    assert renderer.stats()["renders"] == 1
+
+
+def test_renderer_queue_timeout():
+    renderer = DocxRenderer(max_concurrency=1, queue_timeout=0.01)
+
+    async def render_while_busy():
+        renderer._semaphore = asyncio.Semaphore(0)
+        with pytest.raises(RenderQueueTimeout):
+            await renderer.render(QUESTION_SETS)
+
+    try:
+        asyncio.run(render_while_busy())
+    finally:
+        renderer.shutdown()
+    assert renderer.stats()["timeouts"] == 1
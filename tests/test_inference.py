@@ -0,0 +1,151 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+import torch
+
+from utils import inference
+from utils.inference import InferenceExecutor, stream_ndjson
+
+
+def slow_ga(seconds=1.0):
+    # stands in for a question group request, blocks its worker like the GA does
+    time.sleep(seconds)
+    return "question group"
+
+
+def cheap_qg():
+    time.sleep(0.01)
+    return "question"
+
+
+def test_cheap_requests_stay_fast_while_slow_request_runs():
+    executor = InferenceExecutor({"qg": 2, "qgg": 1})
+
+    async def scenario():
+        slow = asyncio.ensure_future(executor.run("qgg", slow_ga))
+        await asyncio.sleep(0.05)
+        latencies = []
+        for _ in range(10):
+            start = time.perf_counter()
+            assert await executor.run("qg", cheap_qg) == "question"
+            latencies.append(time.perf_counter() - start)
+        assert not slow.done()
+        assert await slow == "question group"
+        return latencies
+
+    try:
+        latencies = asyncio.run(scenario())
+    finally:
+        executor.shutdown()
+    assert max(latencies) < 0.2
+
+
+def test_event_loop_keeps_ticking_while_slow_request_runs():
+    executor = InferenceExecutor({"qgg": 1})
+
+    async def scenario():
+        slow = asyncio.ensure_future(executor.run("qgg", slow_ga, 0.5))
+        lags = []
+        while not slow.done():
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lags.append(time.perf_counter() - start - 0.01)
+        return lags
+
+    try:
+        lags = asyncio.run(scenario())
+    finally:
+        executor.shutdown()
+    assert max(lags) < 0.1
+
+
+def test_unknown_pool():
+    executor = InferenceExecutor({"qg": 1})
+    try:
+        with pytest.raises(ValueError):
+            asyncio.run(executor.run("nope", cheap_qg))
+    finally:
+        executor.shutdown()
+
+
+@pytest.fixture
+def restore_torch_threads():
+    num_threads = torch.get_num_threads()
+    yield
+    inference.set_default_torch_threads(num_threads)
+    inference._default_torch_threads = None
+
+
+def test_torch_threads_apply_to_pool_threads(restore_torch_threads):
+    # e.g. gunicorn splitting cores between workers after fork
+    inference.set_default_torch_threads(3)
+    # another pool setting its own count must not leak into the others
+    executor = InferenceExecutor({"qg": 1, "dis": 1}, {"dis": 2})
+    try:
+        assert asyncio.run(executor.run("dis", torch.get_num_threads)) == 2
+        assert asyncio.run(executor.run("qg", torch.get_num_threads)) == 3
+    finally:
+        executor.shutdown()
+
+
+class FakeRequest:
+    """Request of a client that goes away after reading `read` lines"""
+
+    def __init__(self, read=None):
+        self.read = read
+        self.checks = 0
+        self.url = type("URL", (), {"path": "/stream"})
+
+    async def is_disconnected(self):
+        self.checks += 1
+        return self.read is not None and self.checks > self.read
+
+
+def counting_events(steps, closed):
+    try:
+        for i in range(5):
+            steps.append(i)
+            yield {"event": "progress", "generation": i}
+        yield {"event": "result", "value": len(steps)}
+    finally:
+        closed.set()
+
+
+async def read_lines(response):
+    return [json.loads(line) async for line in response.body_iterator]
+
+
+def test_stream_yields_every_event_in_order():
+    executor = InferenceExecutor({"qgg": 1})
+    steps, closed = [], threading.Event()
+    response = stream_ndjson(
+        executor, FakeRequest(), "qgg", counting_events(steps, closed)
+    )
+    try:
+        lines = asyncio.run(read_lines(response))
+    finally:
+        executor.shutdown()
+    assert response.media_type == "application/x-ndjson"
+    assert lines == [{"event": "progress", "generation": i} for i in range(5)] + [
+        {"event": "result", "value": 5}
+    ]
+    assert closed.is_set()
+
+
+def test_stream_stops_the_generator_once_the_client_goes_away():
+    executor = InferenceExecutor({"qgg": 1})
+    steps, closed = [], threading.Event()
+    request = FakeRequest(read=2)
+    response = stream_ndjson(executor, request, "qgg", counting_events(steps, closed))
+    try:
+        lines = asyncio.run(read_lines(response))
+    finally:
+        # waits for the generator to be closed on its worker
+        executor.shutdown()
+    assert len(lines) == 2
+    # the item read when the disconnect is seen is the last one stepped
+    assert steps == [0, 1, 2]
+    assert closed.is_set()
@@ -0,0 +1,178 @@
+import asyncio
+import sqlite3
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from utils.inference import InferenceExecutor
+from utils.jobs import DONE, FAILED, QUEUED, JobQueue, JobStore, submit_job
+
+
+@pytest.fixture
+def executor():
+    executor = InferenceExecutor({"jobs": 1})
+    yield executor
+    executor.shutdown()
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.sqlite3"))
+
+
+def build_queue(store, executor, handlers, **kwargs):
+    return JobQueue(
+        store,
+        executor,
+        {kind: ("jobs", func) for kind, func in handlers.items()},
+        **kwargs,
+    )
+
+
+async def wait_for(store, job_id, timeout=5):
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        job = await store.call(store.get, job_id)
+        if job["status"] in (DONE, FAILED):
+            return job
+        await asyncio.sleep(0.01)
+    raise TimeoutError(job_id)
+
+
+def test_higher_priority_runs_first(store, executor):
+    gate = threading.Event()
+    ran = []
+    queue = build_queue(
+        store,
+        executor,
+        {"gate": lambda payload: gate.wait(5), "record": ran.append},
+    )
+
+    async def scenario():
+        await queue.start()
+        await queue.submit("gate", {})
+        await asyncio.sleep(0.05)
+        job_ids = [
+            await queue.submit("record", name, priority)
+            for name, priority in [("low", 0), ("high", 2), ("mid", 1), ("low2", 0)]
+        ]
+        gate.set()
+        for job_id in job_ids:
+            await wait_for(store, job_id)
+        queue.stop()
+
+    asyncio.run(scenario())
+    assert ran == ["high", "mid", "low", "low2"]
+
+
+def test_full_queue_answers_503(store, executor):
+    gate = threading.Event()
+    queue = build_queue(
+        store, executor, {"gate": lambda payload: gate.wait(5)}, max_queued=1
+    )
+
+    async def scenario():
+        await queue.start()
+        # the first job runs, the second one waits, the third one is refused
+        await submit_job(queue, "gate", {})
+        await asyncio.sleep(0.05)
+        assert (await submit_job(queue, "gate", {}))["status"] == "queued"
+        with pytest.raises(HTTPException) as refused:
+            await submit_job(queue, "gate", {})
+        gate.set()
+        queue.stop()
+        return refused.value
+
+    refused = asyncio.run(scenario())
+    assert refused.status_code == 503
+    assert "Job queue is full" in refused.detail
+    assert queue.submitted == 2
+
+
+def test_failures_are_recorded(store, executor):
+    def fail(payload):
+        raise ValueError("bad order")
+
+    queue = build_queue(store, executor, {"fail": fail, "ok": lambda p: p})
+
+    async def scenario():
+        await queue.start()
+        failed = await wait_for(store, await queue.submit("fail", {"n": 1}))
+        done = await wait_for(store, await queue.submit("ok", {"n": 2}))
+        queue.stop()
+        return failed, done
+
+    failed, done = asyncio.run(scenario())
+    assert failed["status"] == FAILED
+    assert failed["error"] == "ValueError('bad order')"
+    assert failed["result"] is None
+    assert done["status"] == DONE and done["result"] == {"n": 2}
+    assert queue.stats()["failed"] == 1 and queue.stats()["completed"] == 1
+
+
+def test_jobs_of_a_dead_process_are_taken_over(store, executor):
+    ran = []
+    queue = build_queue(store, executor, {"record": ran.append}, heartbeat_interval=1)
+    # a process that missed its heartbeats, and a live one
+    store.add("orphan", "record", 0, "orphan", "dead-owner")
+    store.add("taken", "record", 0, "taken", "live-owner")
+    store.start("orphan")
+    store._execute("INSERT INTO owners VALUES (?, ?)", ("dead-owner", time.time() - 10))
+    store.heartbeat("live-owner")
+
+    async def scenario():
+        await queue.start()
+        job = await wait_for(store, "orphan")
+        queue.stop()
+        return job
+
+    assert asyncio.run(scenario())["status"] == DONE
+    assert ran == ["orphan"]
+    assert queue.stats()["requeued"] == 1
+    assert store.get("taken")["status"] == QUEUED
+
+
+def test_finished_jobs_expire(store, executor):
+    queue = build_queue(store, executor, {"ok": lambda p: p}, result_ttl=60)
+    for job_id in ["old", "recent", "unfinished"]:
+        store.add(job_id, "ok", 0, {}, "other-owner")
+    store.finish("old", result={})
+    store.finish("recent", result={})
+    store._execute(
+        "UPDATE jobs SET finished_at = ? WHERE id = ?", (time.time() - 61, "old")
+    )
+    store.heartbeat("other-owner")
+
+    async def scenario():
+        await queue.start()
+        queue.stop()
+
+    asyncio.run(scenario())
+    assert store.get("old") is None
+    assert store.get("recent")["status"] == DONE
+    assert store.get("unfinished")["status"] == QUEUED
+
+
+def test_store_calls_do_not_block_the_event_loop(store, executor):
+    queue = build_queue(store, executor, {"ok": lambda p: p})
+
+    async def scenario():
+        await queue.start()
+        # another process holding the write lock of the store
+        other = sqlite3.connect(store.path)
+        other.execute("BEGIN IMMEDIATE")
+        submit = asyncio.ensure_future(queue.submit("ok", {}))
+        start = time.perf_counter()
+        await asyncio.sleep(0.2)
+        lag = time.perf_counter() - start
+        assert not submit.done()
+        other.commit()
+        job = await wait_for(store, await submit)
+        queue.stop()
+        return lag, job
+
+    lag, job = asyncio.run(scenario())
+    assert lag < 0.3
+    assert job["status"] == DONE
@@ -0,0 +1,139 @@
+import json
+
+import pytest
+
+pytest.importorskip("stanza")
+
+import config  # noqa: E402
+import language_model  # noqa: E402
+from language_model import (  # noqa: E402
+    LanguageModels,
+    ModelSpec,
+    ResidentModel,
+    has_snapshot,
+    load_snapshot,
+)
+
+SPEC = ModelSpec(None, None, "p208p2002/bart-squad-qg-hl", "qg_en")
+DIS_EN = ["_dg_en", "_dg_rl"]
+
+
+def write_index(snapshot_dir, name):
+    path = snapshot_dir / SPEC.alias
+    path.mkdir(parents=True)
+    with open(path / "weights.json", "w") as f:
+        json.dump({"name": name, "tensors": []}, f)
+
+
+def test_has_snapshot(tmp_path):
+    assert not has_snapshot(SPEC, None)
+    assert not has_snapshot(SPEC, tmp_path)
+    write_index(tmp_path, SPEC.name)
+    assert has_snapshot(SPEC, tmp_path)
+
+
+def test_stale_snapshot_is_not_used(tmp_path):
+    write_index(tmp_path, "facebook/bart-base")
+    assert not has_snapshot(SPEC, tmp_path)
+    with pytest.raises(ValueError):
+        load_snapshot(SPEC, tmp_path)
+
+
+class FakeModel:
+    def __init__(self, alias):
+        self.alias = alias
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeComposite:
+    def __init__(self, *models):
+        self.models = models
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def models(monkeypatch):
+    """Lazy registry of 1 MB fake models, 2 MB budget, `dis_en` made of two of them"""
+    specs = [ModelSpec(None, None, f"fake/{alias}", alias) for alias in "abc"]
+    specs += [ModelSpec(None, None, f"fake/{alias}", alias) for alias in DIS_EN]
+    monkeypatch.setattr(language_model, "MODELS_SPECS", specs)
+    monkeypatch.setattr(
+        language_model, "MODELS_ALIASES", [spec.alias for spec in specs]
+    )
+    monkeypatch.setattr(language_model, "COMPOSITE_MODELS", {"dis_en": DIS_EN})
+    monkeypatch.setattr(config, "LAZY_MODEL_LOADING", True)
+    monkeypatch.setattr(config, "MODEL_MEMORY_BUDGET_MB", 2)
+    monkeypatch.setattr(
+        LanguageModels,
+        "_init",
+        lambda self, spec, download_only=False: ResidentModel(
+            FakeModel(spec.alias), f"{spec.alias} tokenizer", 1024 ** 2
+        ),
+    )
+    monkeypatch.setattr(
+        LanguageModels,
+        "_build_dis_en",
+        lambda self: FakeComposite(self._dg_en_model, self._dg_rl_model),
+        raising=False,
+    )
+    return LanguageModels()
+
+
+def resident(models):
+    return [model["alias"] for model in models.stats()["models"]]
+
+
+def test_least_recently_used_model_is_evicted_first(models):
+    a = models.a_model
+    b = models.b_model
+    assert models.a_model is a  # `a` is now the most recently used
+    models.c_model
+    assert resident(models) == ["a", "c"]
+    assert b.closed and not a.closed
+    assert models.a_tokenizer == "a tokenizer"
+    assert [(e["event"], e["alias"]) for e in models.events] == [
+        ("load", "a"),
+        ("load", "b"),
+        ("load", "c"),
+        ("evict", "b"),
+    ]
+
+
+def test_held_model_is_never_evicted(models):
+    with models.hold("a"):
+        a = models.a_model
+        for alias in "bcbc":
+            getattr(models, f"{alias}_model")
+            assert "a" in resident(models)
+        assert not a.closed
+        # nothing else can make room, the budget is exceeded for a while
+        with models.hold("b"):
+            models.c_model
+            assert resident(models) == ["a", "b", "c"]
+    assert resident(models) == ["a", "c"]
+    # released, `a` is the least recently used again
+    models.b_model
+    assert resident(models) == ["c", "b"]
+    assert a.closed
+
+
+def test_composite_is_rebuilt_after_component_eviction(models):
+    dis_en = models.dis_en_model
+    assert models.dis_en_model is dis_en
+    dg_en = dis_en.models[0]
+
+    # `_dg_en` is the least recently used, loading two models evicts it
+    models._dg_rl_model
+    models.a_model
+    assert "_dg_en" not in resident(models)
+    assert dg_en.closed and dis_en.closed
+
+    rebuilt = models.dis_en_model
+    assert rebuilt is not dis_en and not rebuilt.closed
+    assert rebuilt.models[0] is models._dg_en_model is not dg_en
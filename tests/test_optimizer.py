@@ -0,0 +1,110 @@
+import re
+
+import numpy as np
+import pytest
+
+# the question group scorers wrap nlgeval
+pytest.importorskip("nlgeval")
+
+from question_group_generation import preprocess  # noqa: E402
+from question_group_generation.optimizer import GAOptimizer  # noqa: E402
+
+CONTEXT = (
+    "Harry Potter is a series of seven fantasy novels written by J. K. Rowling. "
+    "The novels chronicle the lives of a young wizard, Harry Potter, and his "
+    "friends Hermione Granger and Ron Weasley, all of whom are students at "
+    "Hogwarts School of Witchcraft and Wizardry. The main story arc concerns "
+    "Harry's conflict with Lord Voldemort, a dark wizard who intends to become "
+    "immortal, overthrow the wizard governing body known as the Ministry of "
+    "Magic and subjugate all wizards and Muggles."
+)
+QUESTIONS = [
+    "Who wrote the Harry Potter novels?",
+    "How many novels are in the Harry Potter series?",
+    "Hermione Granger and Ron Weasley are friends of _ .",
+    "Where do Harry and his friends study?",
+    "Who is the dark wizard that Harry fights?",
+    "Lord Voldemort wants to overthrow the _ .",
+    "What does Lord Voldemort intend to become?",
+    "The novels chronicle the lives of a young _ .",
+]
+
+
+@pytest.fixture(autouse=True)
+def regex_tokenizer(monkeypatch):
+    monkeypatch.setattr(preprocess, "SCORER_TOKENIZER", "regex")
+
+
+def build(seed=0):
+    ga_optim = GAOptimizer(len(QUESTIONS), 3, seed=seed)
+    ga_optim.context = CONTEXT
+    ga_optim.condicate_questions = QUESTIONS
+    ga_optim._precompute(QUESTIONS, CONTEXT)
+    return ga_optim
+
+
+def original_fitness(ga_optim, genome):
+    """Fitness of one genome as the GA always scored it, one question at a time"""
+    ga_optim.coverage_scorer.clean()
+    ga_optim.similarity_scorer.clean()
+    pick_questions = ga_optim.decode(genome)
+
+    ga_optim.coverage_scorer.add(pick_questions, CONTEXT)
+    keyword_coverage_score = ga_optim.coverage_scorer.compute()["keyword_coverage"]
+
+    if len(pick_questions) > 1:
+        for pick_question in pick_questions[:]:
+            classmate_questions = pick_questions[:]
+            classmate_questions.remove(pick_question)
+            ga_optim.similarity_scorer.add(hyp=pick_question, refs=classmate_questions)
+    similarity_score = ga_optim.similarity_scorer.compute()
+    classmate_similarity_score = similarity_score.get("ROUGE_L", 0.0)
+    # "scaled_ppl" is never reported by `PPLScorer`
+    scaled_ppl_score = 0.0
+
+    has_s_type = any(re.search(re.escape("?") + "$", q) for q in pick_questions)
+    has_c_type = any(re.search(re.escape("_"), q) for q in pick_questions)
+    diversity_score = (has_s_type + has_c_type) / 2
+
+    score = (
+        keyword_coverage_score
+        + (1 - classmate_similarity_score)
+        + diversity_score
+        + scaled_ppl_score
+    )
+    count_pick = (genome == 1).sum()
+    punish_weight = 1 - (
+        abs(ga_optim.target_question_qroup_size - count_pick)
+        / ga_optim.candicate_pool_size
+    )
+    return score * punish_weight * -1
+
+
+def test_fitness_same_as_original_objective():
+    ga_optim = build()
+    rng = np.random.default_rng(0)
+    population = rng.integers(0, 2, size=(40, len(QUESTIONS)))
+    population[0] = 0
+    population[1] = 1
+    population[2] = np.eye(len(QUESTIONS), dtype=int)[3]
+
+    fitness = ga_optim.fitness_function(population)
+    assert fitness.tolist() == [
+        original_fitness(ga_optim, genome) for genome in population
+    ]
+
+
+def test_scorer_calls_do_not_grow_with_genomes():
+    ga_optim = build()
+    calls = ga_optim.scorer_calls()
+    # context and candidates tokenized once per scorer, no per-genome metric
+    assert calls["tokenizer"] == 2
+    assert calls["tokenized_sentences"] == 2 * len(QUESTIONS) + 1
+    assert calls["rouge_l_matrix"] == 1
+    assert calls["nlgeval"] == 0
+
+    rng = np.random.default_rng(1)
+    for size in (1, 20, 500):
+        ga_optim.fitness_function(rng.integers(0, 2, size=(size, len(QUESTIONS))))
+    assert ga_optim.scorer_calls() == calls
+    assert ga_optim.counters["genomes"] == 521
@@ -0,0 +1,38 @@
+import pytest
+
+# question_group_generation imports the question group scorers
+pytest.importorskip("nlgeval")
+
+from question_group_generation import preprocess  # noqa: E402
+
+
+@pytest.mark.parametrize(
+    "text,tokens",
+    [
+        ("Why didn't he go?", ["Why", "did", "n't", "he", "go", "?"]),
+        ("Harry's e-mail", ["Harry", "'s", "e-mail"]),
+        ("in the U.S.?", ["in", "the", "U.S.", "?"]),
+        ("$12.50, or 1,000 yen", ["$", "12.50", ",", "or", "1,000", "yen"]),
+        ('"Stop!" he said.', ['"', "Stop", "!", '"', "he", "said", "."]),
+    ],
+)
+def test_regex_tokenize(text, tokens):
+    assert preprocess.regex_tokenize(text) == tokens
+
+
+def test_agreement(monkeypatch):
+    stanza_tokens = {
+        "Who wrote it?": ["Who", "wrote", "it", "?"],
+        "It's late.": ["It", "'s", "late", "."],
+        "Go to the U.S.": ["Go", "to", "the", "U.S", "."],
+    }
+    monkeypatch.setattr(preprocess, "_cache", preprocess.TokenCache(16))
+    monkeypatch.setattr(
+        preprocess,
+        "_stanza_tokenize_batch",
+        lambda texts: [stanza_tokens[text] for text in texts],
+    )
+    assert preprocess.agreement(list(stanza_tokens)) == {
+        "sentences": 2 / 3,
+        "tokens": 11 / 13,
+    }
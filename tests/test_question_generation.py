@@ -0,0 +1,49 @@
+import torch
+
+from data.model import Answer, QGBatchItem
+from question_generation.en_us import GENERATION_KWARGS, generate_batch
+
+
+class FakeTokenizer:
+    pad_token_id = 0
+
+    def __call__(self, texts, return_length=False):
+        input_ids = [[ord(c) for c in text] for text in texts]
+        return {"input_ids": input_ids, "length": [len(ids) for ids in input_ids]}
+
+    def convert_tokens_to_ids(self, tokens):
+        return [1 for _ in tokens]
+
+    def batch_decode(self, outputs, skip_special_tokens=True):
+        return [f"question {int(output[0])}" for output in outputs]
+
+
+class FakeModel:
+    device = torch.device("cpu")
+
+    def __init__(self):
+        self.batch_sizes = []
+        self.calls = 0
+
+    def generate(self, input_ids, attention_mask, num_return_sequences, **kwargs):
+        self.batch_sizes.append(input_ids.size(0))
+        rows = torch.arange(input_ids.size(0)) + self.calls * 100
+        self.calls += 1
+        return rows.repeat_interleave(num_return_sequences).unsqueeze(-1)
+
+
+def test_generate_batch_splits_long_answer_lists():
+    article = "Harry Potter is a series of seven fantasy novels."
+    answers = [Answer(tag="seven", start_at=28, end_at=32) for _ in range(11)]
+    model = FakeModel()
+
+    question_and_answers = generate_batch(
+        model, FakeTokenizer(), QGBatchItem(article=article, answers=answers), 4
+    )
+
+    assert model.batch_sizes == [4, 4, 3]
+    assert len(question_and_answers) == 11
+    num_return_sequences = GENERATION_KWARGS["num_return_sequences"]
+    # every answer gets the questions of its own row
+    assert question_and_answers[5].questions == ["question 101"] * num_return_sequences
+    assert question_and_answers[10].questions == ["question 202"] * num_return_sequences
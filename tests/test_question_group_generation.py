@@ -0,0 +1,238 @@
+import asyncio
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+import torch
+from tokenizers import Tokenizer
+from tokenizers.models import WordLevel
+from tokenizers.pre_tokenizers import WhitespaceSplit
+from transformers import (
+    BartConfig,
+    BartForConditionalGeneration,
+    PreTrainedTokenizerFast,
+)
+
+# the question group scorers wrap nlgeval, language_model imports stanza
+pytest.importorskip("nlgeval")
+pytest.importorskip("stanza")
+
+import question_group_generation  # noqa: E402
+from config import max_length  # noqa: E402
+from data.model import GenerationOrder  # noqa: E402
+from language_model import LanguageModels, ResidentModel  # noqa: E402
+from question_group_generation import preprocess  # noqa: E402
+from utils.inference import InferenceExecutor, stream_ndjson  # noqa: E402
+
+FIXTURES = Path(__file__).parent / "fixtures"
+QUESTIONS = (FIXTURES / "questions.txt").read_text().splitlines()
+CONTEXT = " ".join((FIXTURES / "sentences.txt").read_text().splitlines()[:20])
+WINDOWS = 3
+
+
+class FakeRequest:
+    """Request of a client that goes away after reading `read` lines"""
+
+    def __init__(self, read=None):
+        self.read = read
+        self.checks = 0
+        self.url = type("URL", (), {"path": "/en-US/generate-question-group/stream"})
+
+    async def is_disconnected(self):
+        self.checks += 1
+        return self.read is not None and self.checks > self.read
+
+
+@pytest.fixture(autouse=True)
+def regex_tokenizer(monkeypatch):
+    monkeypatch.setattr(preprocess, "SCORER_TOKENIZER", "regex")
+
+
+@pytest.fixture
+def windows(monkeypatch):
+    """Generated windows, each window gets 4 questions of the fixture"""
+    generated = []
+
+    def feedback_generation_batch(model, tokenizer, windows_input_ids, **kwargs):
+        generated.extend(windows_input_ids)
+        start = windows_input_ids[0] * 4
+        return QUESTIONS[start : start + 4]
+
+    monkeypatch.setattr(
+        question_group_generation,
+        "_context_windows",
+        lambda tokenizer, context: list(range(WINDOWS)),
+    )
+    monkeypatch.setattr(
+        question_group_generation,
+        "feedback_generation_batch",
+        feedback_generation_batch,
+    )
+    return generated
+
+
+@pytest.fixture
+def models(monkeypatch):
+    monkeypatch.setattr(
+        LanguageModels,
+        "_init",
+        lambda self, spec, download_only=False: ResidentModel(
+            spec.alias, spec.alias, 1
+        ),
+    )
+    return LanguageModels(lazy=True, memory_budget_mb=0)
+
+
+def held_events(models, order):
+    # same as the stream route of the server
+    with models.hold("qgg_en"):
+        yield from question_group_generation.generate_events(
+            model=models.qgg_en_model,
+            tokenizer=models.qgg_en_tokenizer,
+            order=order,
+        )
+
+
+def stream(models, request):
+    executor = InferenceExecutor({"qgg": 1})
+    order = GenerationOrder(context=CONTEXT, question_group_size=3)
+    response = stream_ndjson(executor, request, "qgg", held_events(models, order))
+
+    async def read_lines():
+        return [json.loads(line) async for line in response.body_iterator]
+
+    try:
+        return asyncio.run(read_lines())
+    finally:
+        # waits for the generator to be closed on its worker
+        executor.shutdown()
+
+
+def test_candidates_then_progress_then_result(models, windows):
+    events = stream(models, FakeRequest())
+    kinds = [event["event"] for event in events]
+
+    assert kinds[:WINDOWS] == ["candidates"] * WINDOWS
+    assert [event["window"] for event in events[:WINDOWS]] == list(range(WINDOWS))
+    assert events[0]["questions"] == QUESTIONS[:4]
+    assert set(kinds[WINDOWS:-1]) == {"progress"}
+    assert kinds[-1] == "result"
+    question_group = events[-1]["question_group"]
+    assert len(question_group) == 3
+    assert set(question_group) <= set(QUESTIONS[: WINDOWS * 4])
+    assert models._pins["qgg_en"] == 0
+
+
+def test_disconnect_stops_generation_and_releases_the_model(models, windows):
+    events = stream(models, FakeRequest(read=1))
+
+    assert [event["event"] for event in events] == ["candidates"]
+    # the window stepped when the disconnect is seen is the last one generated
+    assert windows == [0, 1]
+    assert models._pins["qgg_en"] == 0
+
+
+def sequential_feedback_generation(model, tokenizer, input_ids, feedback_times=3):
+    """`feedback_generation` before batching, one `generate` call per iteration"""
+    outputs = []
+    device = model.device
+    for i in range(feedback_times):
+        gened_text = tokenizer.bos_token * (len(outputs) + 1)
+        gened_ids = tokenizer(gened_text, add_special_tokens=False)["input_ids"]
+        input_ids = gened_ids + input_ids
+        input_ids = input_ids[:max_length]
+
+        sample_outputs = model.generate(
+            input_ids=torch.LongTensor(input_ids).unsqueeze(0).to(device),
+            attention_mask=torch.LongTensor([1] * len(input_ids))
+            .unsqueeze(0)
+            .to(device),
+            max_length=50,
+            early_stopping=True,
+            temperature=1.0,
+            do_sample=True,
+            top_p=0.9,
+            top_k=10,
+            num_beams=1,
+            no_repeat_ngram_size=5,
+            num_return_sequences=1,
+        )
+        outputs.append(
+            question_group_generation.decode_question(tokenizer, sample_outputs[0])
+        )
+    return outputs
+
+
+class GreedyModel:
+    """Tiny random BART, decoding greedily so both paths have a single answer"""
+
+    def __init__(self, vocab_size):
+        torch.manual_seed(0)
+        config = BartConfig(
+            vocab_size=vocab_size,
+            d_model=32,
+            encoder_layers=1,
+            decoder_layers=1,
+            encoder_attention_heads=2,
+            decoder_attention_heads=2,
+            encoder_ffn_dim=64,
+            decoder_ffn_dim=64,
+            max_position_embeddings=max_length,
+        )
+        self.model = BartForConditionalGeneration(config).eval()
+        self.device = self.model.device
+        self.inputs = []
+
+    def generate(self, input_ids, attention_mask, **kwargs):
+        # at least a few tokens, a random model tends to stop right away
+        kwargs.update(
+            do_sample=False, temperature=None, top_p=None, top_k=None, min_length=10
+        )
+        self.inputs += [
+            ids[mask.bool()].tolist() for ids, mask in zip(input_ids, attention_mask)
+        ]
+        with torch.no_grad():
+            return self.model.generate(
+                input_ids=input_ids, attention_mask=attention_mask, **kwargs
+            )
+
+
+def build_tokenizer(vocab_size):
+    vocab = {"<s>": 0, "<pad>": 1, "</s>": 2, "<unk>": 3}
+    vocab.update({f"w{i}": i for i in range(len(vocab), vocab_size)})
+    backend = Tokenizer(WordLevel(vocab, unk_token="<unk>"))
+    backend.pre_tokenizer = WhitespaceSplit()
+    return PreTrainedTokenizerFast(
+        tokenizer_object=backend,
+        bos_token="<s>",
+        pad_token="<pad>",
+        eos_token="</s>",
+        unk_token="<unk>",
+    )
+
+
+def test_batched_feedback_same_as_sequential():
+    vocab_size = 64
+    tokenizer = build_tokenizer(vocab_size)
+    generator = np.random.default_rng(0)
+    # the last window is truncated once the BOS prefix grows
+    windows_input_ids = [
+        generator.integers(4, vocab_size, size=length).tolist()
+        for length in (3, 17, 60, max_length - 1)
+    ]
+
+    sequential_model = GreedyModel(vocab_size)
+    sequential = []
+    for input_ids in windows_input_ids:
+        sequential += sequential_feedback_generation(
+            sequential_model, tokenizer, input_ids, feedback_times=3
+        )
+    batched_model = GreedyModel(vocab_size)
+    batched = question_group_generation.feedback_generation_batch(
+        batched_model, tokenizer, windows_input_ids, feedback_times=3, batch_size=5
+    )
+
+    assert batched_model.inputs == sequential_model.inputs
+    assert batched == sequential
+    assert len(set(batched)) > 1
@@ -0,0 +1,96 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+# question_group_generation imports the question group scorers
+pytest.importorskip("nlgeval")
+
+from question_group_generation.rouge import RougeLMatrix  # noqa: E402
+
+QUESTIONS = (
+    (Path(__file__).parent / "fixtures" / "questions.txt").read_text().splitlines()
+)
+
+
+def reference_lcs(ref_tokens, hyp_tokens):
+    lengths = [[0] * (len(hyp_tokens) + 1) for _ in range(len(ref_tokens) + 1)]
+    for i, ref_token in enumerate(ref_tokens, 1):
+        for j, hyp_token in enumerate(hyp_tokens, 1):
+            if ref_token == hyp_token:
+                lengths[i][j] = lengths[i - 1][j - 1] + 1
+            else:
+                lengths[i][j] = max(lengths[i - 1][j], lengths[i][j - 1])
+    return lengths[-1][-1]
+
+
+def reference_rouge_l(hyp, refs, beta=1.2):
+    """ROUGE-L of one hypothesis against references, as computed by pycocoevalcap"""
+    hyp_tokens = hyp.strip().split(" ")
+    precisions, recalls = [], []
+    for ref in refs:
+        ref_tokens = ref.strip().split(" ")
+        lcs = reference_lcs(ref_tokens, hyp_tokens)
+        precisions.append(lcs / float(len(hyp_tokens)))
+        recalls.append(lcs / float(len(ref_tokens)))
+    prec_max, rec_max = max(precisions), max(recalls)
+    if prec_max != 0 and rec_max != 0:
+        return ((1 + beta ** 2) * prec_max * rec_max) / float(
+            rec_max + beta ** 2 * prec_max
+        )
+    return 0.0
+
+
+def reference_classmate_similarity(sentences, genome):
+    """How the GA scored a question group, one nlgeval call per picked question"""
+    pick_questions = [sentences[i] for i in np.flatnonzero(genome)]
+    if len(pick_questions) < 2:
+        return 0.0
+    score = 0.0
+    for pick_question in pick_questions:
+        classmate_questions = pick_questions[:]
+        classmate_questions.remove(pick_question)
+        score += reference_rouge_l(pick_question, classmate_questions)
+    return score / len(pick_questions)
+
+
+def test_score_matches_pycocoevalcap_formula():
+    rouge_l = RougeLMatrix(QUESTIONS)
+    for hyp in range(len(QUESTIONS)):
+        for refs in ([(hyp + 1) % len(QUESTIONS)], list(range(0, hyp, 3)) or [hyp]):
+            expected = reference_rouge_l(QUESTIONS[hyp], [QUESTIONS[i] for i in refs])
+            assert rouge_l.score(hyp, refs) == expected
+
+
+def test_score_matches_pycocoevalcap():
+    rouge = pytest.importorskip("pycocoevalcap.rouge.rouge")
+    rouge_l = RougeLMatrix(QUESTIONS)
+    for hyp in range(len(QUESTIONS)):
+        refs = [i for i in range(hyp % 4, len(QUESTIONS), 4) if i != hyp]
+        score, _ = rouge.Rouge().compute_score(
+            {0: [QUESTIONS[i] for i in refs]}, {0: [QUESTIONS[hyp]]}
+        )
+        assert rouge_l.score(hyp, refs) == score
+
+
+def test_classmate_similarity_matches_per_question_scoring():
+    rouge_l = RougeLMatrix(QUESTIONS)
+    rng = np.random.default_rng(0)
+    population = rng.random((200, len(QUESTIONS))) < rng.random((200, 1))
+    population[0] = False
+    population[1] = True
+    population[2] = np.eye(len(QUESTIONS), dtype=bool)[5]
+
+    similarity = rouge_l.classmate_similarity(population)
+    assert similarity.tolist() == [
+        reference_classmate_similarity(QUESTIONS, genome) for genome in population
+    ]
+
+
+def test_classmate_similarity_of_duplicates():
+    sentences = ["who wrote it", "who wrote it", "what is it"]
+    rouge_l = RougeLMatrix(sentences)
+    population = np.array([[1, 1, 0], [1, 1, 1], [1, 0, 1]], dtype=bool)
+    assert rouge_l.classmate_similarity(population).tolist() == [
+        reference_classmate_similarity(sentences, genome) for genome in population
+    ]
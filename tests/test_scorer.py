@@ -0,0 +1,109 @@
+import re
+from pathlib import Path
+
+import pytest
+import torch
+from tokenizers import Tokenizer
+from tokenizers.models import WordLevel
+from tokenizers.pre_tokenizers import WhitespaceSplit
+from transformers import GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast
+
+# the question group scorers wrap nlgeval
+pytest.importorskip("nlgeval")
+
+from question_group_generation.scorer import (  # noqa: E402
+    ContextIndex,
+    CoverageScorer,
+    PPLScorer,
+)
+
+FIXTURES = Path(__file__).parent / "fixtures"
+SENTENCES = (FIXTURES / "sentences.txt").read_text().splitlines()
+QUESTIONS = (FIXTURES / "questions.txt").read_text().splitlines()
+
+
+def reference_coverage(keyword_list, article):
+    """Keyword coverage as scored by scanning every article sentence"""
+    article_sent_list = re.split(r",|\.|\!|\?", article)
+    count_article_sent = len(article_sent_list)
+    if count_article_sent == 0:
+        return 0.0
+    count_coverage = 0
+    for article_sent in article_sent_list:
+        article_sent = article_sent.lower().split()
+        for keyword in keyword_list:
+            if keyword in article_sent:
+                count_coverage += 1
+                break
+    return count_coverage / count_article_sent
+
+
+@pytest.fixture(scope="module")
+def scorer():
+    return CoverageScorer(preprocess=False)
+
+
+@pytest.mark.parametrize("article_size", [1, 10, len(SENTENCES)])
+def test_coverage_matches_sentence_scan(scorer, article_size):
+    article = " ".join(SENTENCES[:article_size])
+    index = ContextIndex(article)
+    for question in QUESTIONS + SENTENCES[::7]:
+        keywords = scorer._extract_keywords([question])
+        expected = reference_coverage(keywords, article)
+        assert index.coverage(keywords) == expected
+        assert scorer._compute_keyword_coverage(keywords, article) == expected
+
+
+def test_group_coverage_matches_sentence_scan(scorer):
+    article = " ".join(SENTENCES)
+    for start in range(0, len(QUESTIONS), 3):
+        group = QUESTIONS[start : start + 3]
+        expected = reference_coverage(scorer._extract_keywords(group), article)
+        assert scorer._compute_coverage_score(group, article) == expected
+
+
+def test_empty_article(scorer):
+    keywords = scorer._extract_keywords(["who wrote harry potter"])
+    assert ContextIndex("").coverage(keywords) == reference_coverage(keywords, "")
+    assert ContextIndex(". ,").coverage(keywords) == 0.0
+
+
+def build_causal_lm(pad_token, eos_token):
+    """Random tiny GPT-2, with a word level tokenizer of the fixture sentences"""
+    words = sorted({word for sentence in SENTENCES for word in sentence.split()})
+    vocab = {"[PAD]": 0, "[EOS]": 1, "[UNK]": 2}
+    vocab.update({word: i for i, word in enumerate(words, start=len(vocab))})
+    backend = Tokenizer(WordLevel(vocab, unk_token="[UNK]"))
+    backend.pre_tokenizer = WhitespaceSplit()
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=backend,
+        unk_token="[UNK]",
+        pad_token=pad_token,
+        eos_token=eos_token,
+    )
+
+    torch.manual_seed(0)
+    config = GPT2Config(
+        vocab_size=len(vocab), n_positions=64, n_embd=32, n_layer=2, n_head=2
+    )
+    return GPT2LMHeadModel(config).eval(), tokenizer
+
+
+# a pad token id of 0 must not fall back to a missing eos token
+@pytest.mark.parametrize("pad_token,eos_token", [("[PAD]", None), (None, "[EOS]")])
+def test_batched_ppl_same_as_per_sentence(pad_token, eos_token):
+    model, tokenizer = build_causal_lm(pad_token, eos_token)
+    scorer = PPLScorer(model, tokenizer, stride=32, max_length=32, use_sppl=True)
+    # mixed lengths: one word (nothing to predict), short, long, over `max_length`
+    sentences = ["Harry", SENTENCES[0], " ".join(SENTENCES[:2])] + SENTENCES[2:40]
+    sentences.append(" ".join(SENTENCES[:8]))
+    lengths = [len(ids) for ids in tokenizer(sentences)["input_ids"]]
+    assert min(lengths) == 1 and max(lengths) > 32
+
+    batched = scorer._compute_avg_log_likelihoods(sentences, batch_size=8)
+    for sentence, avg_ll in zip(sentences, batched):
+        expected = scorer._compute_avg_log_likelihood(sentence)
+        assert torch.allclose(avg_ll, expected, atol=1e-5), sentence
+    assert scorer._compute_scaled_ppls(sentences) == pytest.approx(
+        [scorer._compute_scaled_ppl(sentence) for sentence in sentences], abs=1e-5
+    )
@@ -1,11 +1,14 @@
 import json
 from pathlib import Path
 
-from .export import delete_later, export_file
+from .cache import ResultCache
+from .export import export_file
+from .inference import InferenceExecutor
 
 __all__ = [
-    "delete_later",
     "export_file",
+    "InferenceExecutor",
+    "ResultCache",
 ]
 
 
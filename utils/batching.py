@@ -0,0 +1,180 @@
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import List, Optional
+
+import torch
+from loguru import logger
+
+from .inference import set_torch_threads
+
+
+def pad_sequences(sequences: List[List[int]], pad_token_id: int, padding_side="right"):
+    """Pad token id lists into a `(input_ids, attention_mask)` pair of LongTensor"""
+    max_len = max(len(sequence) for sequence in sequences)
+    input_ids = torch.full((len(sequences), max_len), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(sequences), max_len), dtype=torch.long)
+    for i, sequence in enumerate(sequences):
+        if len(sequence) == 0:
+            continue
+        if padding_side == "left":
+            input_ids[i, -len(sequence) :] = torch.LongTensor(sequence)
+            attention_mask[i, -len(sequence) :] = 1
+        else:
+            input_ids[i, : len(sequence)] = torch.LongTensor(sequence)
+            attention_mask[i, : len(sequence)] = 1
+    return input_ids, attention_mask
+
+
+class _Request:
+    __slots__ = ("rows", "kwargs", "key", "future")
+
+    def __init__(self, rows, kwargs, key):
+        self.rows = rows
+        self.kwargs = kwargs
+        self.key = key
+        self.future = Future()
+
+
+class MicroBatcher:
+    """
+    Stand in front of a generation model, collect concurrent `generate` calls
+    sharing the same generation settings and run them as one padded batch
+    """
+
+    def __init__(self, model, max_batch_size=8, max_wait_ms=10):
+        """
+        Args:
+            model: the model to generate with
+            max_batch_size: max rows of a batch, batching is disabled if <= 1
+            max_wait_ms: how long the first request of a batch waits for others
+        """
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.padding_side = "right" if model.config.is_encoder_decoder else "left"
+        self.pad_token_id = model.config.pad_token_id
+        if self.pad_token_id is None:
+            self.pad_token_id = model.config.eos_token_id
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._num_threads = None
+
+    def __getattr__(self, name):
+        # proxy everything else (device, config, ...) to the underlying model
+        if name == "model":
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+    def generate(
+        self,
+        input_ids: torch.LongTensor,
+        attention_mask: Optional[torch.LongTensor] = None,
+        **kwargs,
+    ):
+        key = self._batch_key(kwargs)
+        if (
+            key is None
+            or self.max_batch_size <= 1
+            or input_ids.size(0) >= self.max_batch_size
+        ):
+            return self.model.generate(
+                input_ids=input_ids, attention_mask=attention_mask, **kwargs
+            )
+
+        if attention_mask is None:
+            rows = input_ids.tolist()
+        else:
+            rows = [
+                row[mask.bool()].tolist()
+                for row, mask in zip(input_ids, attention_mask)
+            ]
+        request = _Request(rows, kwargs, key)
+        self._ensure_worker()
+        self._queue.put(request)
+        return request.future.result()
+
+    @staticmethod
+    def _batch_key(kwargs):
+        if kwargs.get("return_dict_in_generate"):
+            return None
+        try:
+            key = tuple(sorted(kwargs.items()))
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                # torch threads are set per thread, generate with those of the
+                # inference pool calling us
+                self._num_threads = torch.get_num_threads()
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+
+    def close(self):
+        """Stop the scheduler thread, so the wrapped model can be released"""
+        self._queue.put(None)
+
+    def _run(self):
+        set_torch_threads(self._num_threads)
+        while True:
+            request = self._queue.get()
+            if request is None:
+                return
+            pending = [request]
+            num_rows = len(request.rows)
+            deadline = time.monotonic() + self.max_wait
+            while num_rows < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if request is None:
+                    # keep the stop signal for after this batch
+                    self._queue.put(None)
+                    break
+                pending.append(request)
+                num_rows += len(request.rows)
+
+            # only requests sharing generation settings can run in the same batch
+            groups = OrderedDict()
+            for request in pending:
+                groups.setdefault(request.key, []).append(request)
+            for requests in groups.values():
+                self._generate_batch(requests)
+
+    def _generate_batch(self, requests: List[_Request]):
+        rows = [row for request in requests for row in request.rows]
+        input_ids, attention_mask = pad_sequences(
+            rows, self.pad_token_id, self.padding_side
+        )
+        kwargs = requests[0].kwargs
+        try:
+            outputs = self.model.generate(
+                input_ids=input_ids.to(self.model.device),
+                attention_mask=attention_mask.to(self.model.device),
+                **kwargs,
+            )
+        except Exception as e:
+            for request in requests:
+                request.future.set_exception(e)
+            return
+        logger.debug(f"Batched {len(requests)} requests ({len(rows)} rows)")
+
+        # route each output slice back to its caller
+        num_return_sequences = kwargs.get("num_return_sequences", 1)
+        offset = 0
+        for request in requests:
+            size = len(request.rows) * num_return_sequences
+            request.future.set_result(outputs[offset : offset + size])
+            offset += size
@@ -0,0 +1,208 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from loguru import logger
+
+
+class ResultCache:
+    """
+    Generation result cache keyed by content hash of the request, bounded in
+    bytes with LRU and TTL eviction, optionally backed by a SQLite file so warm
+    results survive restarts
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        ttl: float = 0,
+        disk_path: Optional[str] = None,
+        disk_max_bytes: int = 0,
+    ):
+        """
+        Args:
+            max_bytes: max bytes of results kept in memory
+            ttl: seconds a result stays valid, 0 means forever
+            disk_path: SQLite file of the on-disk store, `None` disables it
+            disk_max_bytes: max bytes of results kept on disk, 0 means unlimited
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        # SQLite calls may block, they never hold the lock of the in-memory store
+        self._db_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self.disk_path = disk_path
+        self._conn = None
+        self._pid = None
+        if disk_path:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results "
+                "(key TEXT PRIMARY KEY, value TEXT, size INTEGER, created_at REAL)"
+            )
+            if self.ttl:
+                self._db.execute(
+                    "DELETE FROM results WHERE created_at < ?",
+                    (time.time() - self.ttl,),
+                )
+            self._db.commit()
+            logger.info(f"Result cache backed by {disk_path}")
+
+    @property
+    def _db(self):
+        """SQLite connection of this process, `None` without on-disk store"""
+        if not self.disk_path:
+            return None
+        # a connection must not cross a fork, every worker process opens its own
+        if self._pid != os.getpid():
+            self._conn = sqlite3.connect(
+                self.disk_path, check_same_thread=False, timeout=30
+            )
+            # readers do not wait for the writes of other worker processes
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._pid = os.getpid()
+        return self._conn
+
+    @staticmethod
+    def make_key(route: str, payload, version: str):
+        """Content hash of a normalized request to `route` served by models `version`"""
+        normalized = json.dumps(
+            {"route": route, "payload": payload, "version": version},
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Return cached result of `key`, or `None` on miss"""
+        value = self._lookup(key)
+        if value is None and self.disk_path:
+            value = self._load(key)
+        return self._count(value)
+
+    async def aget(self, key):
+        """`get` from the event loop, the on-disk store is read on a thread"""
+        value = self._lookup(key)
+        if value is None and self.disk_path:
+            loop = asyncio.get_event_loop()
+            value = await loop.run_in_executor(None, self._load, key)
+        return self._count(value)
+
+    def set(self, key, result):
+        """Cache a JSON compatible `result` under `key`"""
+        value, created_at = self._cache(key, result)
+        if self.disk_path:
+            self._store(key, value, created_at)
+
+    async def aset(self, key, result):
+        """`set` from the event loop, the on-disk store is written on a thread"""
+        value, created_at = self._cache(key, result)
+        if self.disk_path:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, self._store, key, value, created_at)
+
+    def _lookup(self, key):
+        """Cached value of `key` in memory, or `None`"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self._expired(entry[1]):
+                self._pop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def _load(self, key):
+        """Cached value of `key` on disk, or `None`, kept in memory once found"""
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT value, created_at FROM results WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or self._expired(row[1]):
+            return None
+        with self._lock:
+            self._put(key, *row)
+        return row[0]
+
+    def _count(self, value):
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(value)
+
+    def _cache(self, key, result):
+        value = json.dumps(result, ensure_ascii=False)
+        created_at = time.time()
+        with self._lock:
+            self._put(key, value, created_at)
+        return value, created_at
+
+    def _store(self, key, value, created_at):
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                (key, value, len(value.encode("utf-8")), created_at),
+            )
+            self._prune_disk()
+            self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _expired(self, created_at):
+        return self.ttl > 0 and time.time() - created_at > self.ttl
+
+    def _put(self, key, value, created_at):
+        if key in self._entries:
+            self._pop(key)
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (value, created_at, size)
+        self._size += size
+        # evict least recently used results
+        while self._size > self.max_bytes:
+            self._pop(next(iter(self._entries)))
+
+    def _pop(self, key):
+        _, _, size = self._entries.pop(key)
+        self._size -= size
+
+    def _prune_disk(self):
+        if not self.disk_max_bytes:
+            return
+        (disk_size,) = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM results"
+        ).fetchone()
+        if disk_size <= self.disk_max_bytes:
+            return
+        # drop the oldest results until back under budget
+        rows = self._db.execute(
+            "SELECT key, size FROM results ORDER BY created_at"
+        ).fetchall()
+        for key, size in rows:
+            if disk_size <= self.disk_max_bytes:
+                break
+            self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+            disk_size -= size
@@ -1,71 +1,158 @@
 import asyncio
 import json
-import os
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from pathlib import Path
+from tempfile import SpooledTemporaryFile
 from typing import List
 
-from docx import Document
+from loguru import logger
 
 from data.model import ExportSet
+from docx_render import build_docx, render_docx
 
+MEDIA_TYPES = {
+    "json": "application/json",
+    "txt": "text/plain; charset=utf-8",
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+}
 
-def _export_json(question_sets: List[ExportSet]):
-    now = datetime.now().strftime("%Y%m%d%H%M%S")
-    filename = Path(f"{now}.json")
-    with open(filename, "w") as f:
-        json.dump([question_set.dict() for question_set in question_sets], f)
-    return filename
-
+# documents up to this size stay in memory, bigger ones spill to a temporary file
+DOCX_SPOOL_MAX_SIZE = 16 * 1024 ** 2
+CHUNK_SIZE = 64 * 1024
 
-def _export_txt(question_sets: List[ExportSet]):
-    now = datetime.now().strftime("%Y%m%d%H%M%S")
-    filename = Path(f"{now}.txt")
-    with open(filename, "w") as f:
-        for question_set in question_sets:
-            f.write(f"{question_set.context}\n\n")
-            for qa_pair in question_set.question_pairs:
-                f.write(f"{qa_pair.question}\n\n")
-                for option in qa_pair.options:
-                    if option.is_answer:
-                        f.write(f"* {option.text}\n")
-                    else:
-                        f.write(f"- {option.text}\n")
-                f.write("\n")
-            f.write("\n\n")
-        f.write("\n\n\n")
-    return filename
 
+def _export_json(question_sets: List[ExportSet]):
+    yield b"["
+    for i, question_set in enumerate(question_sets):
+        if i > 0:
+            yield b", "
+        yield json.dumps(question_set.dict()).encode("utf-8")
+    yield b"]"
 
-def _export_docx(question_sets: List[ExportSet]):
-    now = datetime.now().strftime("%Y%m%d%H%M%S")
-    filename = Path(f"{now}.docx")
 
-    document = Document()
+def _export_txt(question_sets: List[ExportSet]):
     for question_set in question_sets:
-        document.add_paragraph(f"{question_set.context}")
-        document.add_paragraph("")
+        lines = [f"{question_set.context}\n\n"]
         for qa_pair in question_set.question_pairs:
-            document.add_paragraph(f"{qa_pair.question}")
-            document.add_paragraph("")
+            lines.append(f"{qa_pair.question}\n\n")
             for option in qa_pair.options:
                 if option.is_answer:
-                    document.add_paragraph(f"+ {option.text}")
+                    lines.append(f"* {option.text}\n")
                 else:
-                    document.add_paragraph(f"- {option.text}")
-            document.add_paragraph("")
-    document.save(filename)
+                    lines.append(f"- {option.text}\n")
+            lines.append("\n")
+        lines.append("\n\n")
+        yield "".join(lines).encode("utf-8")
+    yield b"\n\n\n"
+
+
+class RenderQueueTimeout(Exception):
+    pass
+
 
-    return filename
+class DocxRenderer:
+    """
+    Render DOCX exports on a dedicated process pool, keep CPU bound document
+    building off the event loop, at most `max_concurrency` renders at once
+    """
+
+    def __init__(self, max_concurrency: int = 2, queue_timeout: float = 10):
+        """
+        Args:
+            max_concurrency: worker processes, and renders running or queued on them
+            queue_timeout: seconds an export waits for a free worker before giving up
+        """
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self._pool = None
+        self._semaphore = None
+        self.renders = 0
+        self.timeouts = 0
+        self._total_wait = 0.0
+        self._total_render = 0.0
+
+    async def render(self, question_sets: List[ExportSet]):
+        """
+        Returns the DOCX bytes, raises `RenderQueueTimeout` if no worker
+        frees up in time
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        if self._pool is None:
+            # spawn, forking a process holding models and threads is unsafe
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_concurrency,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise RenderQueueTimeout(
+                f"no DOCX render worker free after {self.queue_timeout}s"
+            )
+        try:
+            wait = time.perf_counter() - start
+            loop = asyncio.get_event_loop()
+            # converting big exports takes tens of ms, not on the event loop
+            payload = await loop.run_in_executor(
+                None, lambda: [question_set.dict() for question_set in question_sets]
+            )
+            content, render_seconds = await loop.run_in_executor(
+                self._pool, render_docx, payload
+            )
+        finally:
+            self._semaphore.release()
+        self.renders += 1
+        self._total_wait += wait
+        self._total_render += render_seconds
+        logger.info(
+            f"Rendered DOCX of {len(question_sets)} sets ({len(content)} bytes) "
+            f"in {render_seconds:.3f}s, waited {wait:.3f}s"
+        )
+        return content
+
+    def stats(self):
+        return {
+            "renders": self.renders,
+            "timeouts": self.timeouts,
+            "max_concurrency": self.max_concurrency,
+            "avg_wait_seconds": (
+                self._total_wait / self.renders if self.renders else 0.0
+            ),
+            "avg_render_seconds": (
+                self._total_render / self.renders if self.renders else 0.0
+            ),
+        }
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+
+
+def _export_docx(question_sets: List[ExportSet]):
+    document = build_docx(question_sets)
+    with SpooledTemporaryFile(max_size=DOCX_SPOOL_MAX_SIZE) as f:
+        document.save(f)
+        f.seek(0)
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            yield chunk
 
 
 def export_file(question_sets: List[ExportSet], format: str):
+    """
+    Returns:
+        `(chunks, media_type, filename)`, `chunks` generates the exported file
+        as bytes, lazily
+    """
+    format = format.lower()
     try:
-        return globals()[f"_export_{format.lower()}"](question_sets)
+        exporter = globals()[f"_export_{format}"]
     except KeyError:
-        raise ValueError(f"Unsupported format: {format.lower()}")
-
-
-async def delete_later(file_path, wait=120):
-    await asyncio.sleep(wait)
-    os.remove(file_path)
+        raise ValueError(f"Unsupported format: {format}")
+    now = datetime.now().strftime("%Y%m%d%H%M%S")
+    return exporter(question_sets), MEDIA_TYPES[format], f"{now}.{format}"
@@ -0,0 +1,130 @@
+import asyncio
+import functools
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+import torch
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from loguru import logger
+
+
+# torch threads of inference threads whose pool sets none, set per worker process
+_default_torch_threads = None
+
+
+def set_torch_threads(num_threads: int):
+    """Set torch intra-op threads of the calling thread"""
+    # the first torch call of a thread resets its count to the last one set by
+    # any thread, get it over with before setting ours
+    torch.get_num_threads()
+    torch.set_num_threads(num_threads)
+
+
+def set_default_torch_threads(num_threads: int):
+    """
+    Torch threads of this process and of its inference threads, the count is
+    kept per thread so threads started later are set on start
+    """
+    global _default_torch_threads
+    _default_torch_threads = num_threads
+    set_torch_threads(num_threads)
+
+
+def _set_torch_threads(num_threads: Optional[int] = None):
+    num_threads = num_threads or _default_torch_threads
+    if num_threads:
+        set_torch_threads(num_threads)
+
+
+class InferenceExecutor:
+    """Run blocking model inference on per-model worker pools, off the event loop"""
+
+    def __init__(
+        self, pools: Dict[str, int], torch_threads: Optional[Dict[str, int]] = None
+    ):
+        """
+        Args:
+            pools: pool name to max concurrent workers of that pool
+            torch_threads: pool name to torch intra-op threads of each worker
+        """
+        torch_threads = torch_threads or {}
+        self._executors = {}
+        for name, max_workers in pools.items():
+            num_threads = torch_threads.get(name)
+            self._executors[name] = ThreadPoolExecutor(
+                max_workers=max_workers,
+                thread_name_prefix=f"inference-{name}",
+                initializer=_set_torch_threads,
+                initargs=(num_threads,),
+            )
+            logger.info(
+                f"Inference pool <{name}>: {max_workers} workers, "
+                f"torch threads: {num_threads or 'default'}"
+            )
+
+    async def run(self, pool: str, func, *args, **kwargs):
+        """Run `func(*args, **kwargs)` on worker pool `pool` and await its result"""
+        try:
+            executor = self._executors[pool]
+        except KeyError:
+            raise ValueError(f"Unknown inference pool: {pool}")
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            executor, functools.partial(func, *args, **kwargs)
+        )
+
+    async def iterate(self, pool: str, generator):
+        """
+        Step the blocking `generator` on worker pool `pool` and yield its items,
+        the generator is closed on a worker once the iteration ends or is abandoned
+        """
+        lock = threading.Lock()
+        done = object()
+
+        def step():
+            with lock:
+                return next(generator, done)
+
+        def close():
+            # waits for a step still running on another worker
+            with lock:
+                generator.close()
+
+        try:
+            while True:
+                item = await self.run(pool, step)
+                if item is done:
+                    return
+                yield item
+        finally:
+            self._executors[pool].submit(close)
+
+    def shutdown(self, wait=True):
+        for executor in self._executors.values():
+            executor.shutdown(wait=wait)
+
+
+def stream_ndjson(executor: InferenceExecutor, request: Request, pool, events):
+    """
+    Stream the items of blocking generator `events` as NDJSON, stepped on
+    inference pool `pool`, stop the work once the client goes away
+    """
+
+    async def _stream():
+        items = executor.iterate(pool, events)
+        try:
+            async for item in items:
+                if await request.is_disconnected():
+                    logger.info(
+                        f"Client disconnected, stop streaming {request.url.path}"
+                    )
+                    break
+                yield json.dumps(jsonable_encoder(item)) + "\n"
+        finally:
+            await items.aclose()
+
+    return StreamingResponse(_stream(), media_type="application/x-ndjson")
@@ -0,0 +1,299 @@
+import asyncio
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Tuple
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from loguru import logger
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobStore:
+    """
+    SQLite table of jobs and of the processes running them, shared by every
+    worker process and kept across restarts
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+        self._pid = None
+        self._execute(
+            "CREATE TABLE IF NOT EXISTS jobs "
+            "(id TEXT PRIMARY KEY, kind TEXT, priority INTEGER, status TEXT, "
+            "payload TEXT, result TEXT, error TEXT, owner TEXT, "
+            "created_at REAL, started_at REAL, finished_at REAL)"
+        )
+        self._execute(
+            "CREATE TABLE IF NOT EXISTS owners (owner TEXT PRIMARY KEY, heartbeat REAL)"
+        )
+        logger.info(f"Job store at {path}")
+
+    async def call(self, method, *args):
+        """
+        Run store `method` from the event loop, on a thread, SQLite may wait
+        up to 30s for the write lock of another worker process
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, method, *args)
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            # a connection must not cross a fork, every worker process opens its own
+            if self._pid != os.getpid():
+                self._db = sqlite3.connect(
+                    self.path, check_same_thread=False, timeout=30
+                )
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._pid = os.getpid()
+            cursor = self._db.execute(sql, params)
+            self._db.commit()
+            return cursor
+
+    def add(self, job_id, kind, priority, payload, owner):
+        self._execute(
+            "INSERT INTO jobs (id, kind, priority, status, payload, owner, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, priority, QUEUED, json.dumps(payload), owner, time.time()),
+        )
+
+    def start(self, job_id):
+        self._execute(
+            "UPDATE jobs SET status = ?, started_at = ? WHERE id = ?",
+            (RUNNING, time.time(), job_id),
+        )
+
+    def finish(self, job_id, result=None, error=None):
+        self._execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? "
+            "WHERE id = ?",
+            (
+                FAILED if error is not None else DONE,
+                json.dumps(result) if error is None else None,
+                error,
+                time.time(),
+                job_id,
+            ),
+        )
+
+    def get(self, job_id):
+        row = self._execute(
+            "SELECT id, kind, priority, status, result, error, "
+            "created_at, started_at, finished_at FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        keys = ["id", "kind", "priority", "status", "result", "error"]
+        keys += ["created_at", "started_at", "finished_at"]
+        job = dict(zip(keys, row))
+        if job["result"] is not None:
+            job["result"] = json.loads(job["result"])
+        return job
+
+    def heartbeat(self, owner):
+        self._execute(
+            "INSERT OR REPLACE INTO owners VALUES (?, ?)", (owner, time.time())
+        )
+
+    def claim_orphans(self, owner, dead_after):
+        """
+        Take over unfinished jobs of owners without a heartbeat for
+        `dead_after` seconds, returns them as `(id, kind, priority, payload, created_at)`
+        """
+        rows = self._execute(
+            "SELECT id, kind, priority, payload, created_at, owner FROM jobs "
+            "WHERE status IN (?, ?) AND owner NOT IN "
+            "(SELECT owner FROM owners WHERE heartbeat > ?)",
+            (QUEUED, RUNNING, time.time() - dead_after),
+        ).fetchall()
+        claimed = []
+        for job_id, kind, priority, payload, created_at, old_owner in rows:
+            # another process may be claiming the same job
+            cursor = self._execute(
+                "UPDATE jobs SET owner = ?, status = ? WHERE id = ? AND owner = ?",
+                (owner, QUEUED, job_id, old_owner),
+            )
+            if cursor.rowcount == 1:
+                claimed.append(
+                    (job_id, kind, priority, json.loads(payload), created_at)
+                )
+        return claimed
+
+    def prune(self, ttl):
+        """Drop finished jobs older than `ttl` seconds and long dead owners"""
+        self._execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+            (DONE, FAILED, time.time() - ttl),
+        )
+        self._execute("DELETE FROM owners WHERE heartbeat < ?", (time.time() - ttl,))
+
+
+class JobQueue:
+    """
+    Bounded priority queue of generation jobs, executed by a fixed number of
+    asyncio workers on the inference pools, job states and results live in a
+    `JobStore`
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        executor,
+        handlers: Dict[str, Tuple[str, Callable]],
+        concurrency: int = 1,
+        max_queued: int = 100,
+        heartbeat_interval: float = 10,
+        result_ttl: float = 24 * 60 * 60,
+    ):
+        """
+        Args:
+            executor: `InferenceExecutor` the jobs run on
+            handlers: job kind to `(inference pool, function of the job payload)`
+            concurrency: max jobs running at the same time in this process
+            max_queued: max jobs waiting in this process, more are refused
+            heartbeat_interval: seconds between heartbeats, unfinished jobs of a
+                process missing 3 heartbeats are taken over by another one
+            result_ttl: seconds finished jobs are kept
+        """
+        self.store = store
+        self.executor = executor
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.max_queued = max_queued
+        self.heartbeat_interval = heartbeat_interval
+        self.result_ttl = result_ttl
+        self.owner = uuid.uuid4().hex
+        self._queue = None
+        # submitted jobs being written to the store, not queued yet
+        self._adding = 0
+        self._tasks = []
+        self._counter = itertools.count()
+        self._running = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.requeued = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    async def start(self):
+        """Start the workers, on the running event loop"""
+        self._queue = asyncio.PriorityQueue()
+        await self.store.call(self.store.prune, self.result_ttl)
+        await self._heartbeat()
+        self._tasks = [
+            asyncio.ensure_future(self._work()) for _ in range(self.concurrency)
+        ]
+        self._tasks.append(asyncio.ensure_future(self._keep_alive()))
+        logger.info(
+            f"Job queue: {self.concurrency} workers, up to {self.max_queued} queued"
+        )
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+
+    async def submit(self, kind, payload, priority=0):
+        """Queue a job, higher `priority` runs first, returns the job id"""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        queued = self._queue.qsize() + self._adding
+        if queued >= self.max_queued:
+            raise QueueFull(f"{queued} jobs already queued")
+        job_id = uuid.uuid4().hex
+        payload = jsonable_encoder(payload)
+        self._adding += 1
+        try:
+            await self.store.call(
+                self.store.add, job_id, kind, priority, payload, self.owner
+            )
+        finally:
+            self._adding -= 1
+        self._put(job_id, kind, priority, payload, time.time())
+        self.submitted += 1
+        return job_id
+
+    def _put(self, job_id, kind, priority, payload, created_at):
+        self._queue.put_nowait(
+            (-priority, next(self._counter), job_id, kind, payload, created_at)
+        )
+
+    async def _work(self):
+        while True:
+            _, _, job_id, kind, payload, created_at = await self._queue.get()
+            wait = time.time() - created_at
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+            self._running += 1
+            pool, func = self.handlers[kind]
+            try:
+                await self.store.call(self.store.start, job_id)
+                result = jsonable_encoder(await self.executor.run(pool, func, payload))
+            except Exception as e:
+                logger.exception(f"Job {job_id} ({kind}) failed")
+                await self.store.call(self.store.finish, job_id, None, repr(e))
+                self.failed += 1
+            else:
+                await self.store.call(self.store.finish, job_id, result)
+                self.completed += 1
+                logger.info(f"Job {job_id} ({kind}) done, waited {wait:.1f}s")
+            finally:
+                self._running -= 1
+
+    def _beat(self):
+        self.store.heartbeat(self.owner)
+        return self.store.claim_orphans(self.owner, 3 * self.heartbeat_interval)
+
+    async def _heartbeat(self):
+        for job in await self.store.call(self._beat):
+            logger.warning(f"Requeue job {job[0]} ({job[1]}) of a dead process")
+            self._put(*job)
+            self.requeued += 1
+
+    async def _keep_alive(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self._heartbeat()
+            except sqlite3.Error:
+                logger.exception("Job store heartbeat failed")
+
+    def stats(self):
+        started = self.completed + self.failed + self._running
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "running": self._running,
+            "concurrency": self.concurrency,
+            "max_queued": self.max_queued,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "requeued": self.requeued,
+            "avg_wait_seconds": self._total_wait / started if started else 0.0,
+            "max_wait_seconds": self._max_wait,
+        }
+
+
+async def submit_job(job_queue: JobQueue, kind, payload, priority=0):
+    """`JobQueue.submit` of a route, answers 503 if the queue is full"""
+    try:
+        job_id = await job_queue.submit(kind, payload, priority)
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=f"Job queue is full: {e}")
+    return {"job_id": job_id, "status": "queued"}